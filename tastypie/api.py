@@ -4,9 +4,11 @@ from django.conf.urls.defaults import *
 from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse
-from tastypie.exceptions import NotRegistered
+from tastypie.authentication import Authentication
+from tastypie.exceptions import BadRequest, ImmediateHttpResponse, NotRegistered, Unauthorized
 from tastypie.serializers import Serializer
-from tastypie.utils import trailing_slash, is_valid_jsonp_callback_value, cached_property
+from tastypie.utils import trailing_slash, is_valid_jsonp_callback_value, cached_property, LRUCache
+from tastypie.utils.caching import content_etag, static_response
 from tastypie.utils.mime import determine_format, build_content_type
 
 
@@ -26,6 +28,10 @@ class Api(object):
         self.api_name = api_name
         self._registry = {}
         self._canonicals = {}
+        self.serializer = Serializer()
+        # The serialized ``top_level`` & ``schema`` responses, by view, api
+        # name, format & JSONP callback.
+        self._responses = LRUCache(max_size=64)
     
     def register(self, resource, canonical=True):
         """
@@ -44,6 +50,7 @@ class Api(object):
             raise ImproperlyConfigured("Resource %r must define a 'resource_name'." % resource)
         
         self._registry[resource_name] = resource
+        self._responses.clear()
         
         if canonical is True:
             if resource_name in self._canonicals:
@@ -64,6 +71,8 @@ class Api(object):
         
         if resource_name in self._canonicals:
             del(self._canonicals[resource_name])
+        
+        self._responses.clear()
     
     def canonical_resource_for(self, resource_name):
         """
@@ -93,6 +102,7 @@ class Api(object):
         """
         pattern_list = [
             url(r"^(?P<api_name>%s)%s$" % (self.api_name, trailing_slash()), self.wrap_view('top_level'), name="api_%s_top_level" % self.api_name),
+            url(r"^(?P<api_name>%s)/schema%s$" % (self.api_name, trailing_slash()), self.wrap_view('schema'), name="api_%s_schema" % self.api_name),
         ]
         
         for name in sorted(self._registry.keys()):
@@ -109,16 +119,22 @@ class Api(object):
         """
         A view that returns a serialized list of all resources registers
         to the ``Api``. Useful for discovery.
-        """
-        serializer = Serializer()
-        available_resources = {}
         
+        The response is built once (per format), then served with an ``ETag``
+        & ``Cache-Control``.
+        """
         if api_name is None:
             api_name = self.api_name
         
+        return self.cached_response(request, 'top_level', api_name, self.build_top_level)
+    
+    def build_top_level(self, api_name):
+        """
+        Returns the list endpoint & schema URL of every registered resource.
+        """
+        available_resources = {}
+        
         for name in sorted(self._registry.keys()):
-            print name
-            print self._registry[name].urls
             available_resources[name] = {
                 'list_endpoint': self._build_reverse_url("api_dispatch_list", kwargs={
                     'api_name': api_name,
@@ -130,7 +146,63 @@ class Api(object):
                 }),
             }
         
-        desired_format = determine_format(request, serializer)
+        return available_resources
+    
+    def schema(self, request, api_name=None):
+        """
+        A view that returns the schemas of all the registered resources at
+        once, so clients don't need a request per resource.
+        
+        Each resource authenticates & throttles the request as its own
+        ``get_schema`` would, and resources the client can't get at are left
+        out. Like ``top_level``, the response is built once (per format & set
+        of resources), then served with an ``ETag`` & ``Cache-Control``, which
+        is ``private`` if any of the resources needed authentication.
+        """
+        if api_name is None:
+            api_name = self.api_name
+        
+        resource_names = []
+        private = False
+        
+        for name in sorted(self._registry.keys()):
+            resource = self._registry[name]
+            
+            try:
+                resource.is_authenticated(request)
+                resource.throttle_check(request)
+            except (ImmediateHttpResponse, Unauthorized):
+                continue
+            
+            resource.log_throttled_access(request)
+            resource_names.append(name)
+            
+            if type(resource._meta.authentication) is not Authentication:
+                private = True
+        
+        resource_names = tuple(resource_names)
+        build = lambda api_name: self.build_schemas(api_name, resource_names)
+        return self.cached_response(request, 'schema', api_name, build, variant=resource_names, private=private)
+    
+    def build_schemas(self, api_name, resource_names=None):
+        """
+        Returns the schema of every registered resource (or only those in
+        ``resource_names``), by resource name.
+        """
+        if resource_names is None:
+            resource_names = self._registry.keys()
+        
+        return dict([(name, self._registry[name].build_schema()) for name in resource_names])
+    
+    def cached_response(self, request, view, api_name, build, variant=None, private=False):
+        """
+        Serializes the data from ``build`` in the format the client wants,
+        reusing the result from earlier requests.
+        
+        Responses that differ for the same ``view`` (such as a ``schema`` of
+        fewer resources) are told apart by ``variant``.
+        """
+        desired_format = determine_format(request, self.serializer)
         options = {}
         
         if 'text/javascript' in desired_format:
@@ -141,8 +213,16 @@ class Api(object):
             
             options['callback'] = callback
         
-        serialized = serializer.serialize(available_resources, desired_format, options)
-        return HttpResponse(content=serialized, content_type=build_content_type(desired_format))
+        key = (view, api_name, variant, desired_format, options.get('callback'))
+        
+        try:
+            serialized, etag = self._responses[key]
+        except KeyError:
+            serialized = self.serializer.serialize(build(api_name), desired_format, options)
+            etag = content_etag(serialized)
+            self._responses[key] = (serialized, etag)
+        
+        return static_response(request, serialized, build_content_type(desired_format), etag=etag, private=private)
     
     def _build_reverse_url(self, name, args=None, kwargs=None):
         """
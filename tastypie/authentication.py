@@ -5,8 +5,16 @@ import time
 import uuid
 
 from django.conf import settings
+from django.conf.urls.defaults import patterns, url
 from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import simplejson
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.functional import SimpleLazyObject
 from tastypie.exceptions import Unauthorized
+from tastypie.http import HttpBadRequest, HttpMethodNotAllowed, HttpUnauthorized
+from tastypie.utils import trailing_slash
 
 try:
     from hashlib import sha1
@@ -14,6 +22,13 @@ except ImportError:
     import sha
     sha1 = sha.sha
 
+# If ``csrf_exempt`` isn't present, stub it.
+try:
+    from django.views.decorators.csrf import csrf_exempt
+except ImportError:
+    def csrf_exempt(func):
+        return func
+
 
 class Authentication(object):
     """
@@ -54,10 +69,20 @@ class BasicAuthentication(Authentication):
     ``realm``
         The realm to use in the ``HttpUnauthorized`` response.  Default:
         ``django-tastypie``.
+    ``cache_timeout``
+        How long (in seconds) verified credentials are cached for, so the
+        password hash only has to be checked once in that time. ``0``
+        disables the cache. Default: the ``TASTYPIE_BASIC_AUTH_CACHE_TIMEOUT``
+        setting, or ``0``.
     """
-    def __init__(self, backend=None, realm='django-tastypie'):
+    def __init__(self, backend=None, realm='django-tastypie', cache_timeout=None):
         self.backend = backend
         self.realm = realm
+        
+        if cache_timeout is None:
+            cache_timeout = getattr(settings, 'TASTYPIE_BASIC_AUTH_CACHE_TIMEOUT', 0)
+        
+        self.cache_timeout = cache_timeout
     
     def _unauthorized(self):
         # FIXME: Sanitize realm.
@@ -87,17 +112,67 @@ class BasicAuthentication(Authentication):
         if len(bits) != 2:
             self._unauthorized()
         
-        if self.backend:
-            user = self.backend.authenticate(username=bits[0], password=bits[1])
-        else:
-            user = authenticate(username=bits[0], password=bits[1])
+        user = self.get_cached_user(bits[0], request.META['HTTP_AUTHORIZATION'])
         
         if user is None:
-            self._unauthorized()
+            if self.backend:
+                user = self.backend.authenticate(username=bits[0], password=bits[1])
+            else:
+                user = authenticate(username=bits[0], password=bits[1])
+            
+            if user is None:
+                self._unauthorized()
+            
+            self.cache_user(bits[0], request.META['HTTP_AUTHORIZATION'], user)
         
         request.user = user
         return True
     
+    def _credentials(self, authorization):
+        # Credentials verified by one backend mean nothing to another.
+        backend = self.backend and '%s.%s' % (self.backend.__class__.__module__, self.backend.__class__.__name__) or ''
+        return '%s:%s' % (backend, authorization)
+    
+    def get_cached_user(self, username, authorization):
+        """
+        Returns the user previously verified with the same ``Authorization``
+        header, or ``None`` if there isn't one (or caching is disabled).
+        """
+        if not self.cache_timeout:
+            return None
+        
+        from django.contrib.auth.models import User
+        from tastypie.models import basic_auth_cache_key, credential_digest
+        
+        cache_key = basic_auth_cache_key(username)
+        cached = cache.get(cache_key)
+        
+        if cached is None or cached[1] != credential_digest(self._credentials(authorization)):
+            return None
+        
+        try:
+            user = User.objects.get(pk=cached[0])
+            
+            # Also catches password changes that didn't send any signals.
+            if credential_digest(user.password) == cached[2]:
+                return user
+        except User.DoesNotExist:
+            pass
+        
+        cache.delete(cache_key)
+        return None
+    
+    def cache_user(self, username, authorization, user):
+        """
+        Remembers that ``authorization`` was verified as ``user``.
+        """
+        if not self.cache_timeout or not getattr(user, 'pk', None):
+            return
+        
+        from tastypie.models import basic_auth_cache_key, credential_digest
+        
+        cache.set(basic_auth_cache_key(username), (user.pk, credential_digest(self._credentials(authorization)), credential_digest(user.password)), self.cache_timeout)
+    
     def get_identifier(self, request):
         """
         Provides a unique string identifier for the requestor.
@@ -114,7 +189,32 @@ class ApiKeyAuthentication(Authentication):
     Uses the ``ApiKey`` model that ships with tastypie. If you wish to use
     a different model, override the ``get_key`` method to perform the key check
     as suits your needs.
+    
+    Verified credentials are cached, so most requests only need to load the
+    user by primary key. The cache is cleared whenever the user or their
+    ``ApiKey`` is saved or deleted.
+    
+    Optional keyword arguments:
+    
+    ``cache_timeout``
+        How long (in seconds) verified credentials are cached for. ``0``
+        disables the cache. Default: the ``TASTYPIE_API_KEY_CACHE_TIMEOUT``
+        setting, or ``300``.
+    ``use_filter``
+        Whether to turn away unknown keys with the ``ApiKeyFilter`` before
+        running any query. Default: the ``TASTYPIE_API_KEY_FILTER`` setting,
+        or ``False``.
     """
+    def __init__(self, cache_timeout=None, use_filter=None):
+        if cache_timeout is None:
+            cache_timeout = getattr(settings, 'TASTYPIE_API_KEY_CACHE_TIMEOUT', 300)
+        
+        if use_filter is None:
+            use_filter = getattr(settings, 'TASTYPIE_API_KEY_FILTER', False)
+        
+        self.cache_timeout = cache_timeout
+        self.use_filter = use_filter
+    
     def _unauthorized(self):
         raise Unauthorized('API Key authentication required')
     
@@ -133,13 +233,64 @@ class ApiKeyAuthentication(Authentication):
         if not username or not api_key:
             return self._unauthorized()
         
-        try:
-            user = User.objects.get(username=username)
-        except (User.DoesNotExist, User.MultipleObjectsReturned):
+        if self.get_key.im_func is not ApiKeyAuthentication.get_key.im_func:
+            # A custom ``get_key`` does the checking.
+            try:
+                user = User.objects.get(username=username)
+            except (User.DoesNotExist, User.MultipleObjectsReturned):
+                return self._unauthorized()
+            
+            request.user = user
+            return self.get_key(user, api_key)
+        
+        user = self.get_user(username, api_key)
+        
+        if user is None:
             return self._unauthorized()
         
         request.user = user
-        return self.get_key(user, api_key)
+        return True
+    
+    def get_user(self, username, api_key):
+        """
+        Returns the user with ``username`` if ``api_key`` is theirs, ``None``
+        otherwise.
+        
+        Checks the ``ApiKeyFilter`` (if enabled) & the cache first, then the
+        ``ApiKey`` & ``User`` tables in a single query.
+        """
+        from django.contrib.auth.models import User
+        from tastypie.models import ApiKey, api_key_cache_key, api_key_filter, credential_digest
+        
+        if self.use_filter and not api_key_filter.might_contain_key(api_key):
+            return None
+        
+        cache_key = api_key_cache_key(username)
+        digest = credential_digest(api_key)
+        
+        if self.cache_timeout:
+            cached = cache.get(cache_key)
+            
+            if cached is not None and cached[1] == digest:
+                try:
+                    user = User.objects.get(pk=cached[0])
+                    
+                    if user.username == username:
+                        return user
+                except User.DoesNotExist:
+                    pass
+                
+                cache.delete(cache_key)
+        
+        try:
+            key = ApiKey.objects.select_related('user').get(user__username=username, key=api_key)
+        except (ApiKey.DoesNotExist, ApiKey.MultipleObjectsReturned):
+            return None
+        
+        if self.cache_timeout:
+            cache.set(cache_key, (key.user_id, digest), self.cache_timeout)
+        
+        return key.user
     
     def get_key(self, user, api_key):
         """
@@ -171,6 +322,12 @@ class DigestAuthentication(Authentication):
     ``authenticate`` method from ``django.contrib.auth``. However, instead of
     the user's password, their API key should be used.
     
+    Nonces stay valid for ``nonce_timeout`` seconds, so clients can keep
+    using one (with an increasing nonce count) rather than being challenged
+    on every request. Each nonce count is only accepted once. The nonce
+    counts seen are kept in the cache, as are the ids of the users, so most
+    requests only need a single query.
+    
     Optional keyword arguments:
     
     ``backend``
@@ -180,15 +337,40 @@ class DigestAuthentication(Authentication):
     ``realm``
         The realm to use in the ``HttpUnauthorized`` response.  Default:
         ``django-tastypie``.
+    ``nonce_timeout``
+        How long (in seconds) a nonce can be used for. Default: the
+        ``TASTYPIE_DIGEST_NONCE_TIMEOUT`` setting, or ``300``.
+    ``cache_timeout``
+        How long (in seconds) the ids of users are cached for (by username).
+        ``0`` disables the cache. Default: the ``TASTYPIE_API_KEY_CACHE_TIMEOUT`` setting, or
+        ``300``.
+    ``use_filter``
+        Whether to turn away users without an API key with the
+        ``ApiKeyFilter`` before running any query. Ignored if ``get_key`` is
+        overridden. Default: the ``TASTYPIE_API_KEY_FILTER`` setting, or
+        ``False``.
     """
-    def __init__(self, backend=None, realm='django-tastypie'):
+    def __init__(self, backend=None, realm='django-tastypie', nonce_timeout=None, cache_timeout=None, use_filter=None):
         self.backend = backend
         self.realm = realm
+        
+        if nonce_timeout is None:
+            nonce_timeout = getattr(settings, 'TASTYPIE_DIGEST_NONCE_TIMEOUT', 300)
+        
+        if cache_timeout is None:
+            cache_timeout = getattr(settings, 'TASTYPIE_API_KEY_CACHE_TIMEOUT', 300)
+        
+        if use_filter is None:
+            use_filter = getattr(settings, 'TASTYPIE_API_KEY_FILTER', False)
+        
+        self.nonce_timeout = nonce_timeout
+        self.cache_timeout = cache_timeout
+        self.use_filter = use_filter and self.get_key.im_func is DigestAuthentication.get_key.im_func
     
-    def _unauthorized(self):
+    def _unauthorized(self, stale=False):
         new_uuid = uuid.uuid4()
         opaque = hmac.new(str(new_uuid), digestmod=sha1).hexdigest()
-        raise Unauthorized('Digest authentication required', python_digest.build_digest_challenge(time.time(), getattr(settings, 'SECRET_KEY', ''), self.realm, opaque, False))
+        raise Unauthorized('Digest authentication required', python_digest.build_digest_challenge(time.time(), getattr(settings, 'SECRET_KEY', ''), self.realm, opaque, stale))
     
     def is_authenticated(self, request, **kwargs):
         """
@@ -210,27 +392,115 @@ class DigestAuthentication(Authentication):
         
         digest_response = python_digest.parse_digest_credentials(request.META['HTTP_AUTHORIZATION'])
         
+        if digest_response is None:
+            return self._unauthorized()
+        
         # FIXME: Should the nonce be per-user?
         if not python_digest.validate_nonce(digest_response.nonce, getattr(settings, 'SECRET_KEY', '')):
             return self._unauthorized()
         
-        user = self.get_user(digest_response.username)
-        api_key = self.get_key(user)
+        nonce_age = time.time() - python_digest.get_nonce_timestamp(digest_response.nonce)
+        
+        if nonce_age > self.nonce_timeout:
+            # Tells the client to retry with the new nonce, rather than asking
+            # the user for their credentials again.
+            return self._unauthorized(stale=True)
         
-        if user is False or api_key is False:
+        user, partial_digest = self.get_partial_digest(digest_response.username)
+        
+        if user is False or partial_digest is False:
             return self._unauthorized()
         
         expected = python_digest.calculate_request_digest(
             request.method,
-            python_digest.calculate_partial_digest(digest_response.username, self.realm, api_key),
+            partial_digest,
             digest_response)
         
         if not digest_response.response == expected:
             return self._unauthorized()
         
+        # Only now, so bogus requests can't use up nonce counts.
+        if not self.use_nonce_count(digest_response.nonce, digest_response.nc, self.nonce_timeout - nonce_age):
+            return self._unauthorized()
+        
         request.user = user
         return True
     
+    def use_nonce_count(self, nonce, nonce_count, timeout):
+        """
+        Records the use of ``nonce_count`` with ``nonce``, returning ``False``
+        if it's been used before (a replayed request).
+        
+        Counts may arrive out of order when clients make concurrent requests,
+        so each is tracked separately rather than only the highest.
+        """
+        key = 'tastypie_digest_nc:%s:%08x' % (sha1(nonce).hexdigest(), nonce_count)
+        return cache.add(key, 1, max(int(timeout) + 1, 1))
+    
+    def get_partial_digest(self, username):
+        """
+        Returns the user with ``username`` & their partial digest (of their
+        username, the realm & their API key), or ``False`` for either if
+        they're not found.
+        
+        The partial digest is as good as the API key to a client, so it's
+        never cached. Only the user's id is, which saves a query: the user &
+        their key are then loaded together.
+        """
+        from tastypie.models import api_key_filter, digest_cache_key
+        
+        if self.use_filter and not api_key_filter.might_contain_user(username):
+            return False, False
+        
+        cache_key = digest_cache_key(username)
+        user, api_key = None, None
+        
+        if self.cache_timeout:
+            user_id = cache.get(cache_key)
+            
+            if user_id is not None:
+                user, api_key = self.get_user_and_key(user_id)
+        
+        if user is None:
+            user = self.get_user(username)
+            
+            if user is False:
+                return False, False
+            
+            api_key = self.get_key(user)
+            
+            if self.cache_timeout and api_key is not False:
+                cache.set(cache_key, user.pk, self.cache_timeout)
+        
+        if api_key is False:
+            return user, False
+        
+        return user, python_digest.calculate_partial_digest(username, self.realm, api_key)
+    
+    def get_user_and_key(self, user_id):
+        """
+        Returns the user with ``user_id`` & their API key (in one query,
+        unless ``get_key`` is overridden), or ``None`` for both if the user is
+        gone.
+        """
+        from django.contrib.auth.models import User
+        from tastypie.models import ApiKey
+        
+        if self.get_key.im_func is DigestAuthentication.get_key.im_func:
+            try:
+                key = ApiKey.objects.select_related('user').get(user__pk=user_id)
+            except ApiKey.DoesNotExist:
+                return None, None
+            
+            return key.user, key.key
+        
+        try:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None, None
+        
+        return user, self.get_key(user)
+    
     def get_user(self, username):
         from django.contrib.auth.models import User
         
@@ -269,3 +539,221 @@ class DigestAuthentication(Authentication):
                 return request.user.username
         
         return 'nouser'
+
+
+class TokenAuthentication(Authentication):
+    """
+    Handles signed bearer tokens, sent as ``Authorization: Bearer <token>``.
+    
+    Tokens carry the user's id & username, their scopes, an expiry and the id
+    of the key they were signed with, so checking one takes no queries.
+    ``request.user`` is only loaded from the database if it's used. Tokens are
+    minted with ``issue_token`` or by exchanging an API key (see
+    ``exchange``, hooked up by including ``urls``).
+    
+    Tokens are signed with ``SECRET_KEY`` and a key id. New tokens use the
+    first of ``key_ids``, while any of them is accepted, so keys can be
+    rotated by putting a new id first & dropping the old one once its tokens
+    have expired.
+    
+    Optional keyword arguments:
+    
+    ``scopes``
+        The scopes a token needs (all of them) to be accepted. Default: none.
+    ``lifetime``
+        How long (in seconds) new tokens last. Default: the
+        ``TASTYPIE_TOKEN_LIFETIME`` setting, or ``3600``.
+    ``key_ids``
+        The ids of the keys tokens may be signed with, newest first. Default:
+        the ``TASTYPIE_TOKEN_KEY_IDS`` setting, or ``('1',)``.
+    ``allowed_scopes``
+        The scopes ``exchange`` may grant. Default: ``None``, which allows any.
+    ``check_revocation``
+        Whether to check (in the cache) that tokens haven't been revoked.
+        Default: ``True``.
+    """
+    def __init__(self, scopes=None, lifetime=None, key_ids=None, allowed_scopes=None, check_revocation=True):
+        self.scopes = tuple(scopes or ())
+        
+        if lifetime is None:
+            lifetime = getattr(settings, 'TASTYPIE_TOKEN_LIFETIME', 3600)
+        
+        if key_ids is None:
+            key_ids = getattr(settings, 'TASTYPIE_TOKEN_KEY_IDS', ('1',))
+        
+        self.lifetime = lifetime
+        self.key_ids = tuple(key_ids)
+        self.allowed_scopes = allowed_scopes
+        self.check_revocation = check_revocation
+    
+    def _unauthorized(self):
+        raise Unauthorized('Token authentication required', 'Bearer realm="django-tastypie"')
+    
+    def _encode(self, data):
+        return base64.urlsafe_b64encode(data).rstrip('=')
+    
+    def _decode(self, data):
+        return base64.urlsafe_b64decode(str(data) + '=' * (-len(data) % 4))
+    
+    def _signature(self, key_id, payload):
+        return self._encode(salted_hmac('tastypie.authentication.TokenAuthentication:%s' % key_id, payload).digest())
+    
+    def issue_token(self, user, scopes=None, lifetime=None):
+        """
+        Returns a new token for ``user``, granting ``scopes``.
+        """
+        if lifetime is None:
+            lifetime = self.lifetime
+        
+        key_id = self.key_ids[0]
+        payload = self._encode(simplejson.dumps({
+            'k': key_id,
+            'u': user.pk,
+            'n': user.username,
+            's': list(scopes or ()),
+            'e': int(time.time() + lifetime),
+            'j': uuid.uuid4().hex,
+        }, separators=(',', ':')))
+        return '%s.%s' % (payload, self._signature(key_id, payload))
+    
+    def verify_token(self, token, check_revoked=True):
+        """
+        Returns the claims of ``token`` if it's genuine, unexpired & not
+        revoked, ``None`` otherwise.
+        """
+        try:
+            payload, signature = token.split('.')
+            claims = simplejson.loads(self._decode(payload))
+            key_id = claims['k']
+            expires = int(claims['e'])
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+        
+        if key_id not in self.key_ids:
+            return None
+        
+        if not constant_time_compare(signature, self._signature(key_id, payload)):
+            return None
+        
+        if expires <= time.time():
+            return None
+        
+        if check_revoked and self.is_revoked(claims.get('j')):
+            return None
+        
+        return claims
+    
+    def revocation_cache_key(self, token_id):
+        return 'tastypie_revoked_token:%s' % token_id
+    
+    def is_revoked(self, token_id):
+        """
+        Returns whether the token with the id ``token_id`` has been revoked.
+        """
+        if not self.check_revocation:
+            return False
+        
+        return cache.get(self.revocation_cache_key(token_id)) is not None
+    
+    def revoke_token(self, token):
+        """
+        Revokes ``token`` until it expires.
+        
+        Each revocation gets its own cache key, so concurrent ones can't undo
+        each other. Returns ``False`` if the token wasn't valid to begin with.
+        """
+        claims = self.verify_token(token, check_revoked=False)
+        
+        if claims is None:
+            return False
+        
+        cache.add(self.revocation_cache_key(claims['j']), True, max(int(claims['e'] - time.time()), 1))
+        return True
+    
+    def is_authenticated(self, request, **kwargs):
+        """
+        Checks the bearer token, along with its scopes.
+        
+        Should return either ``True`` if allowed, ``False`` if not or an
+        ``HttpResponse`` if you need something custom.
+        """
+        try:
+            (auth_type, token) = request.META['HTTP_AUTHORIZATION'].split()
+        except (KeyError, ValueError):
+            return self._unauthorized()
+        
+        if auth_type != 'Bearer':
+            return self._unauthorized()
+        
+        claims = self.verify_token(token)
+        
+        if claims is None:
+            return self._unauthorized()
+        
+        for scope in self.scopes:
+            if scope not in claims.get('s', ()):
+                return self._unauthorized()
+        
+        request.auth_token = claims
+        request.user = SimpleLazyObject(lambda: self.get_user(claims['u']))
+        return True
+    
+    def get_user(self, user_id):
+        from django.contrib.auth.models import AnonymousUser, User
+        
+        try:
+            return User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return AnonymousUser()
+    
+    @property
+    def urls(self):
+        """
+        The URLconf for the ``exchange`` view, at ``token/``.
+        """
+        return patterns('',
+            url(r"^token%s$" % trailing_slash(), self.exchange, name="api_token_exchange"),
+        )
+    
+    @csrf_exempt
+    def exchange(self, request):
+        """
+        A view exchanging a username & API key (``POST``ed, along with the
+        space-separated ``scopes`` wanted) for a token.
+        
+        Exempt from CSRF checks, as clients send credentials rather than
+        cookies.
+        """
+        if request.method != 'POST':
+            return HttpMethodNotAllowed()
+        
+        scopes = request.POST.get('scopes', '').split()
+        
+        if self.allowed_scopes is not None:
+            for scope in scopes:
+                if scope not in self.allowed_scopes:
+                    return HttpBadRequest("The '%s' scope can't be granted." % scope)
+        
+        user = ApiKeyAuthentication().get_user(request.POST.get('username', ''), request.POST.get('api_key', ''))
+        
+        if user is None:
+            return HttpUnauthorized()
+        
+        token = self.issue_token(user, scopes)
+        data = {
+            'token': token,
+            'expires': self.verify_token(token, check_revoked=False)['e'],
+            'scopes': scopes,
+        }
+        return HttpResponse(simplejson.dumps(data), content_type='application/json')
+    
+    def get_identifier(self, request):
+        """
+        Provides a unique string identifier for the requestor.
+        
+        This implementation returns the username the token was issued to.
+        """
+        if hasattr(request, 'auth_token'):
+            return request.auth_token['n']
+        
+        return 'nouser'
@@ -1,5 +1,127 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
 
+
+PERMISSIONS_VERSION_CACHE_KEY = 'tastypie_permissions_version'
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+class AuthorizationContext(object):
+    """
+    Memoizes permission checks & authorization limits for the length of a
+    request, as the same ones tend to be made several times (updates, related
+    resources and so on).
+    
+    Use ``AuthorizationContext.for_request`` to get the one for a request.
+    
+    With the default ``ModelBackend``, the user's permissions are all loaded
+    in a single query on the first check. They can also be cached across
+    requests for ``TASTYPIE_PERMISSION_CACHE_TIMEOUT`` seconds, until any
+    user's or group's permissions change.
+    """
+    def __init__(self, user, cache_timeout=None):
+        if cache_timeout is None:
+            cache_timeout = getattr(settings, 'TASTYPIE_PERMISSION_CACHE_TIMEOUT', 0)
+        
+        self.user = user
+        self.cache_timeout = cache_timeout
+        self._permissions = None
+        self._checked = {}
+        self._limits = {}
+    
+    @classmethod
+    def for_request(cls, request):
+        """
+        Returns the context of ``request``, creating it if needed (or if the
+        user has changed since).
+        """
+        user = getattr(request, 'user', None)
+        context = getattr(request, '_authorization_context', None)
+        
+        if context is None or context.user is not user:
+            context = cls(user)
+            request._authorization_context = context
+        
+        return context
+    
+    def has_perm(self, permission_code):
+        """
+        Checks whether the user has the permission, like ``User.has_perm``.
+        """
+        if permission_code not in self._checked:
+            self._checked[permission_code] = self._has_perm(permission_code)
+        
+        return self._checked[permission_code]
+    
+    def _has_perm(self, permission_code):
+        if self.user is None:
+            return False
+        
+        if not self.user.is_active:
+            return False
+        
+        if self.user.is_superuser:
+            return True
+        
+        if list(getattr(settings, 'AUTHENTICATION_BACKENDS', [MODEL_BACKEND])) != [MODEL_BACKEND] or not getattr(self.user, 'pk', None):
+            # Other backends may grant permissions their own way.
+            return self.user.has_perm(permission_code)
+        
+        return permission_code in self.permissions()
+    
+    def permissions(self):
+        """
+        Returns the user's permissions (including their groups'), as
+        ``app_label.codename`` strings.
+        """
+        if self._permissions is None:
+            cache_key = 'tastypie_permissions:%s' % self.user.pk
+            version = None
+            
+            if self.cache_timeout:
+                cached = cache.get_many([PERMISSIONS_VERSION_CACHE_KEY, cache_key])
+                version = cached.get(PERMISSIONS_VERSION_CACHE_KEY)
+                
+                if version is not None and cached.get(cache_key, (None, None))[0] == version:
+                    self._permissions = cached[cache_key][1]
+                    return self._permissions
+            
+            from django.contrib.auth.models import Permission
+            
+            permissions = Permission.objects.filter(Q(user=self.user) | Q(group__user=self.user))
+            self._permissions = frozenset(['%s.%s' % (app_label, codename) for app_label, codename in permissions.values_list('content_type__app_label', 'codename').distinct()])
+            
+            if self.cache_timeout:
+                if version is None:
+                    version = permissions_changed()
+                
+                cache.set(cache_key, (version, self._permissions), self.cache_timeout)
+        
+        return self._permissions
+    
+    def limits(self, key, compute):
+        """
+        Returns the limits stored under ``key``, calling ``compute`` to get
+        them the first time.
+        """
+        if key not in self._limits:
+            self._limits[key] = compute()
+        
+        return self._limits[key]
+
+
+def permissions_changed(*args, **kwargs):
+    """
+    A signal for invalidating the permissions cached by
+    ``AuthorizationContext``. Returns the new version.
+    """
+    version = uuid.uuid4().hex
+    cache.set(PERMISSIONS_VERSION_CACHE_KEY, version, 7 * 24 * 3600)
+    return version
+
+
 class Authorization(object):
     """
     A base class that provides no permissions checking.
@@ -89,7 +211,13 @@ class DjangoAuthorization(Authorization):
                 del permission_codes[key]
     
     def get_limits(self, request, _and, _or):
-        return self.is_authorized(self, request) is True
+        result = self.is_authorized(request)
+        
+        # Pass through if there's no permission to check.
+        if result is None:
+            return None
+        
+        return result is True
     
     def is_authorized(self, request, object=None):
         # cannot map request method to permission code name, so pass through
@@ -111,9 +239,26 @@ class DjangoAuthorization(Authorization):
         if not hasattr(request, 'user'):
             return False
 
-        return request.user.has_perm(permission_code)
+        return AuthorizationContext.for_request(request).has_perm(permission_code)
 
 class OwnerDjangoAuthorization(DjangoAuthorization):
+    """
+    Only lets users change the objects they own, as given by the
+    ``owner_field`` (a ``ForeignKey`` to ``User``) of the model.
+    
+    Ownership is checked in the database, as a filter on the objects being
+    updated or deleted, so whole lists are authorized in the same query. The
+    per-object check (for objects that didn't come from the database) only
+    compares ids, without loading the owner.
+    """
+    def __init__(self, owner_field='user', permission_codes=None):
+        super(OwnerDjangoAuthorization, self).__init__(permission_codes)
+        self.owner_field = owner_field
+    
+    def get_owner_field(self):
+        klass = self.resource_meta.object_class
+        return getattr(klass, 'owner_field', self.owner_field)
+    
     def get_limits(self, request, _and, _or):
         # Pass through GET
         if request.method == 'GET':
@@ -125,22 +270,16 @@ class OwnerDjangoAuthorization(DjangoAuthorization):
         if not klass:
             return None
         
-        meta = klass.meta
-        owner_field = getattr(meta, 'owner_field', 'user')
-        
         # user must be logged in to check permissions
         # authentication backend must set request.user
-        if not hasattr(request, 'user'):
-            return None
-        
-        kwargs = { owner_field: request.user }
+        user_id = getattr(getattr(request, 'user', None), 'pk', None)
         
-        return None, Q(*kwargs)
+        if user_id is None:
+            return False
         
-    """
-    Uses permission checking from ``django.contrib.auth`` to map ``POST``,
-    ``PUT``, and ``DELETE`` to their equivalent django auth permissions.
-    """
+        # Every object must be owned by the user.
+        return Q(**{'%s__pk' % self.get_owner_field(): user_id}), None
+    
     def is_authorized(self, request, object=None):
         # Pass through if no object is received
         if not object:
@@ -156,12 +295,11 @@ class OwnerDjangoAuthorization(DjangoAuthorization):
         if not klass:
             return None
         
-        meta = klass.meta
-        owner_field = getattr(meta, 'owner_field', 'user')
-
-        owner = getattr(object, owner_field, None)
+        # Compare ids, rather than loading the owner.
+        owner_field = klass._meta.get_field(self.get_owner_field())
+        owner_id = getattr(object, owner_field.attname, None)
 
-        if not owner:
+        if owner_id is None:
             return None
 
         # user must be logged in to check permissions
@@ -169,4 +307,4 @@ class OwnerDjangoAuthorization(DjangoAuthorization):
         if not hasattr(request, 'user'):
             return None
 
-        return request.user.id == owner.id
+        return request.user.pk == owner_id
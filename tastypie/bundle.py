@@ -14,6 +14,10 @@ class Bundle(object):
         self.obj = obj
         self.data = data or {}
         self.request = request or HttpRequest()
+        # The resumable uploads used while hydrating (& the files opened for
+        # them), discarded once saved.
+        self.uploads = []
+        self.upload_files = []
     
     def __repr__(self):
         return "<Bundle for obj: '%s' and with data: '%s'>" % (self.obj, self.data)
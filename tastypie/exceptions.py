@@ -85,6 +85,19 @@ class UnsupportedFormat(TastypieError):
     """
     status_code = httplib.NOT_ACCEPTABLE
 
+class UnsupportedEncoding(TastypieError):
+    """
+    Raised when the request body uses a ``Content-Encoding`` that can't be
+    decoded.
+    """
+    status_code = httplib.UNSUPPORTED_MEDIA_TYPE
+
+class RequestEntityTooLarge(TastypieError):
+    """
+    Raised when the (decoded) request body exceeds the configured size limit.
+    """
+    status_code = httplib.REQUEST_ENTITY_TOO_LARGE
+
 class BadRequest(TastypieError):
     """
     A generalized exception for indicating incorrect request parameters.
@@ -3,9 +3,11 @@ from dateutil.parser import parse
 from decimal import Decimal
 import re
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db.models.fields import FieldDoesNotExist
 from django.utils import datetime_safe, importlib
 from tastypie.bundle import Bundle
-from tastypie.exceptions import ApiFieldError, NotFound
+from tastypie.exceptions import ApiFieldError, BadRequest, NotFound
+from tastypie.uploads import upload_owner
 from tastypie.utils import dict_strip_unicode_keys
 
 
@@ -205,6 +207,23 @@ class AttachmentFileField(FileField):
         {
             'attachment': 'field_name' 
         }
+    
+    Completed resumable uploads (see ``Meta.upload_store``) can be referenced
+    by their id:
+    
+        {
+            'upload': 'upload_id'
+        }
+    
+    If the model field uses a ``ContentAddressedStorage``, files that the
+    requester already uploaded can be referenced by the SHA-256 hash of their
+    content (and optionally their name, for the extension), skipping the
+    upload:
+    
+        {
+            'hash': 'hex_digest',
+            'name': 'cat.jpg'
+        }
     """
         
     def hydrate(self, obj, request):
@@ -214,7 +233,15 @@ class AttachmentFileField(FileField):
             if getattr(value, 'get', None):
                 field = value.get('attachment', None)
                 if field and request:
-                    return request.FILES.get(field, None)
+                    return self.note_owner(request.FILES.get(field, None), request)
+                
+                upload_id = value.get('upload', None)
+                if upload_id:
+                    return self.hydrate_upload(upload_id, request, bundle=obj)
+                
+                content_hash = value.get('hash', None)
+                if content_hash:
+                    return self.hydrate_hash(content_hash, value.get('name', ''), request)
                 
                 # Otherwise see if it has a url string 
                 return value.get('url', None)
@@ -222,6 +249,81 @@ class AttachmentFileField(FileField):
                 return value
         else:
             return None
+    
+    def hydrate_upload(self, upload_id, request, bundle=None):
+        """
+        Returns the content of a complete resumable upload made by the same
+        requester, as a ``File``.
+        
+        The upload (& the file opened for it) is noted on the ``bundle``, so it
+        can be closed & discarded once the object has been saved (see
+        ``Resource.discard_uploads``).
+        """
+        meta = self._resource._meta
+        
+        if meta.upload_store is None:
+            raise ApiFieldError("The '%s' field was given an upload, but the resource has no 'upload_store'." % self.instance_name)
+        
+        session = meta.upload_store.get(upload_id, owner=upload_owner(request, meta.authentication))
+        
+        if not session.complete:
+            raise BadRequest("The upload '%s' is incomplete: %s of %s bytes have been received." % (upload_id, session.offset, session.size))
+        
+        upload_file = self.note_owner(meta.upload_store.open(session), request)
+        
+        if bundle is not None:
+            bundle.upload_files.append(upload_file)
+            
+            if not session.id in [upload.id for upload in bundle.uploads]:
+                bundle.uploads.append(session)
+        
+        return upload_file
+    
+    def hydrate_hash(self, content_hash, name='', request=None):
+        """
+        Returns a reference to a file already stored, given the hash of its
+        content.
+        
+        With a ``request``, only files uploaded by the same requester can be
+        referenced, so knowing a hash doesn't give access to the file.
+        """
+        storage = self.get_storage()
+        
+        if not hasattr(storage, 'reference'):
+            raise ApiFieldError("The '%s' field was given a hash, but its storage isn't content-addressed." % self.instance_name)
+        
+        owner = None
+        
+        if request is not None:
+            owner = upload_owner(request, self._resource._meta.authentication)
+        
+        reference = storage.reference(content_hash, name, owner=owner)
+        
+        if reference is None:
+            raise BadRequest("No file with the hash '%s' is stored for the '%s' field. Please upload it instead." % (content_hash, self.instance_name))
+        
+        return reference
+    
+    def note_owner(self, uploaded_file, request):
+        """
+        Marks ``uploaded_file`` as uploaded by the requester, for
+        ``ContentAddressedStorage`` to remember.
+        """
+        if uploaded_file is not None and request is not None:
+            uploaded_file.uploaded_by = upload_owner(request, self._resource._meta.authentication)
+        
+        return uploaded_file
+    
+    def get_storage(self):
+        """
+        Returns the storage of the model field behind this field, if any.
+        """
+        object_class = getattr(self._resource._meta, 'object_class', None)
+        
+        try:
+            return object_class._meta.get_field(self.attribute).storage
+        except (AttributeError, FieldDoesNotExist):
+            return None
 
 class IntegerField(ApiField):
     """
@@ -1,27 +1,139 @@
+import datetime
+from optparse import make_option
 from django.contrib.auth.models import User
-from django.core.management.base import NoArgsCommand
-from tastypie.models import ApiKey
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, transaction, IntegrityError, DEFAULT_DB_ALIAS
+from tastypie.models import ApiKey, api_key_filter
 
 
 class Command(NoArgsCommand):
     help = "Goes through all users and adds API keys for any that don't have one."
-    
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+            help='The number of keys created (or generated) at once, each batch in its own transaction. Defaults to 1000.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help="Only count the users needing a key, without creating any."),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='The database to use. Defaults to the "default" database.'),
+    )
+
     def handle_noargs(self, **options):
         """Goes through all users and adds API keys for any that don't have one."""
         self.verbosity = int(options.get('verbosity', 1))
-        
-        for user in User.objects.all().iterator():
+        self.batch_size = int(options.get('batch_size') or 1000)
+        self.using = options.get('database') or DEFAULT_DB_ALIAS
+
+        if self.batch_size <= 0:
+            raise CommandError("'--batch-size' must be positive.")
+
+        if options.get('dry_run'):
+            if self.verbosity >= 1:
+                print u"%d users have no key." % self.users_without_keys().count()
+                print u"%d keys are blank." % self.blank_keys().count()
+
+            return
+
+        created = self.create_keys()
+        generated = self.generate_keys()
+
+        if created or generated:
+            # Raw inserts & updates don't send the signals the filter relies on.
+            api_key_filter.changed()
+
+        if self.verbosity >= 1:
+            print u"Created %d new keys." % created
+            print u"Generated %d blank keys." % generated
+
+    def users_without_keys(self):
+        # A ``LEFT OUTER JOIN`` on the keys, rather than a query per user.
+        return User.objects.using(self.using).filter(api_key__isnull=True)
+
+    def blank_keys(self):
+        return ApiKey.objects.using(self.using).filter(key='')
+
+    def create_keys(self):
+        """
+        Creates keys for the users without one, a batch at a time.
+        """
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)' % (
+            qn(ApiKey._meta.db_table),
+            qn(ApiKey._meta.get_field('user').column),
+            qn(ApiKey._meta.get_field('key').column),
+            qn(ApiKey._meta.get_field('created').column),
+        )
+        last_id = 0
+        created = 0
+
+        while True:
+            user_ids = list(self.users_without_keys().filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+
+            if not user_ids:
+                break
+
+            last_id = user_ids[-1]
+
             try:
-                api_key = ApiKey.objects.get(user=user)
-                
-                if not api_key.key:
-                    # Autogenerate the key.
-                    api_key.save()
-                    
-                    if self.verbosity >= 1:
-                        print u"Generated a new key for '%s'" % user.username
-            except ApiKey.DoesNotExist:
-                api_key = ApiKey.objects.create(user=user)
-                
-                if self.verbosity >= 1:
-                    print u"Created a new key for '%s'" % user.username
+                created += self.insert(sql, user_ids)
+            except IntegrityError:
+                # Some got a key in the meantime. Skip those & try again.
+                created += self.insert(sql, list(self.users_without_keys().filter(pk__in=user_ids).values_list('pk', flat=True)))
+
+        return created
+
+    def insert(self, sql, user_ids):
+        if not user_ids:
+            return 0
+
+        connection = connections[self.using]
+        now = connection.ops.value_to_db_datetime(datetime.datetime.now())
+        rows = [(user_id, ApiKey().generate_key(), now) for user_id in user_ids]
+        self.execute_many(sql, rows)
+        return len(rows)
+
+    def generate_keys(self):
+        """
+        Fills in the keys left blank, a batch at a time.
+        """
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s = %%s WHERE %s = %%s AND %s = %%s' % (
+            qn(ApiKey._meta.db_table),
+            qn(ApiKey._meta.get_field('key').column),
+            qn(ApiKey._meta.pk.column),
+            qn(ApiKey._meta.get_field('key').column),
+        )
+        last_id = 0
+        generated = 0
+
+        while True:
+            key_ids = list(self.blank_keys().filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+
+            if not key_ids:
+                break
+
+            last_id = key_ids[-1]
+            self.execute_many(sql, [(ApiKey().generate_key(), key_id, '') for key_id in key_ids])
+            generated += len(key_ids)
+
+        return generated
+
+    def execute_many(self, sql, rows):
+        """
+        Runs ``sql`` for each of ``rows`` in a single round trip & transaction.
+
+        Django 1.3 has no ``bulk_create``, so this goes through the cursor.
+        """
+        transaction.enter_transaction_management(using=self.using)
+        transaction.managed(True, using=self.using)
+
+        try:
+            cursor = connections[self.using].cursor()
+            cursor.executemany(sql, rows)
+            transaction.commit(using=self.using)
+        except:
+            transaction.rollback(using=self.using)
+            raise
+        finally:
+            transaction.leave_transaction_management(using=self.using)
@@ -0,0 +1,137 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import F, Max, Min
+from tastypie.models import ApiAccess, ApiAccessRollup
+
+
+class Command(NoArgsCommand):
+    help = "Counts API accesses into rollups by identifier, url, request method & period, then prunes the old accesses."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--period', action='store', type='int', dest='period', default=3600,
+            help='The length (in seconds) of the periods accesses are counted by. Defaults to an hour.'),
+        make_option('--retention', action='store', type='int', dest='retention', default=7 * 24 * 3600,
+            help='How long (in seconds) accesses are kept for once counted. Defaults to a week. Use 0 to keep them all.'),
+        make_option('--lag', action='store', type='int', dest='lag', default=300,
+            help='How old (in seconds) accesses must be to be counted or pruned, so ones still being written are left for a later run. Defaults to 5 minutes.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=10000,
+            help='The number of accesses read (or deleted) at once. Defaults to 10000.'),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='The database to use. Defaults to the "default" database.'),
+    )
+
+    def handle_noargs(self, **options):
+        """Counts API accesses into rollups, then prunes the old accesses."""
+        self.verbosity = int(options.get('verbosity', 1))
+        self.period = int(options.get('period') or 3600)
+        self.batch_size = int(options.get('batch_size') or 10000)
+        self.using = options.get('database') or DEFAULT_DB_ALIAS
+        retention = options.get('retention')
+        lag = options.get('lag')
+
+        if lag is None:
+            lag = 300
+
+        # Accesses can be committed out of order (& a buffered logger writes
+        # them a while after the fact), so only those older than this are
+        # trusted to all be there.
+        self.cutoff = int(time.time()) - max(int(lag), 0)
+
+        if self.period <= 0 or self.batch_size <= 0:
+            raise CommandError("'--period' & '--batch-size' must be positive.")
+
+        counted = self.rollup()
+
+        if self.verbosity >= 1:
+            print u"Counted %d accesses." % counted
+
+        if retention:
+            pruned = self.prune(min(int(time.time()) - int(retention), self.cutoff))
+
+            if self.verbosity >= 1:
+                print u"Pruned %d accesses." % pruned
+
+    def last_counted(self):
+        return ApiAccessRollup.objects.using(self.using).aggregate(last=Max('last_access_id'))['last'] or 0
+
+    def rollup(self):
+        """
+        Counts the accesses not counted yet, a batch at a time, each in its own
+        transaction.
+
+        Stops short of the first access made after the cutoff: accesses with
+        lower ids may not have been committed yet, & nothing below the mark
+        left by a run is read again.
+        """
+        last_id = self.last_counted()
+        uncounted = ApiAccess.objects.using(self.using).filter(pk__gt=last_id)
+        stop = uncounted.filter(accessed__gte=self.cutoff).aggregate(stop=Min('pk'))['stop']
+
+        if stop is not None:
+            uncounted = uncounted.filter(pk__lt=stop)
+
+        counted = 0
+
+        while True:
+            accesses = list(uncounted.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'identifier', 'url', 'request_method', 'accessed')[:self.batch_size])
+
+            if not accesses:
+                break
+
+            last_id = accesses[-1][0]
+            self.count(accesses, last_id)
+            counted += len(accesses)
+
+        return counted
+
+    def count(self, accesses, last_id):
+        counts = {}
+
+        for pk, identifier, url, request_method, accessed in accesses:
+            key = (identifier, url, request_method, accessed - accessed % self.period)
+            counts[key] = counts.get(key, 0) + 1
+
+        transaction.enter_transaction_management(using=self.using)
+        transaction.managed(True, using=self.using)
+
+        try:
+            for (identifier, url, request_method, period_start), count in counts.items():
+                rollups = ApiAccessRollup.objects.using(self.using).filter(identifier=identifier, url=url, request_method=request_method, period_start=period_start, period_length=self.period)
+
+                if not rollups.update(count=F('count') + count, last_access_id=last_id):
+                    ApiAccessRollup.objects.using(self.using).create(identifier=identifier, url=url, request_method=request_method, period_start=period_start, period_length=self.period, count=count, last_access_id=last_id)
+
+            transaction.commit(using=self.using)
+        except:
+            transaction.rollback(using=self.using)
+            raise
+        finally:
+            transaction.leave_transaction_management(using=self.using)
+
+    def prune(self, before):
+        """
+        Deletes the accesses made ``before`` a timestamp (no later than the
+        cutoff) that have been counted, a batch at a time.
+        """
+        last_id = self.last_counted()
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        table = qn(ApiAccess._meta.db_table)
+        pk = qn(ApiAccess._meta.pk.column)
+        accessed = qn(ApiAccess._meta.get_field('accessed').column)
+        pruned = 0
+
+        while True:
+            ids = list(ApiAccess.objects.using(self.using).filter(pk__lte=last_id, accessed__lt=before).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+
+            if not ids:
+                break
+
+            # A plain ``DELETE``, as there's nothing to cascade to.
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM %s WHERE %s >= %%s AND %s <= %%s AND %s < %%s' % (table, pk, pk, accessed), [ids[0], ids[-1], before])
+            transaction.commit_unless_managed(using=self.using)
+            pruned += len(ids)
+
+        return pruned
@@ -2,7 +2,10 @@ import datetime
 import hmac
 import time
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.utils.encoding import smart_str
+from tastypie.utils.bloom import BloomFilter
 try:
     from hashlib import sha1
 except ImportError:
@@ -25,14 +28,60 @@ class ApiAccess(models.Model):
         return super(ApiAccess, self).save(*args, **kwargs)
 
 
+class ApiAccessRollupManager(models.Manager):
+    def usage(self, identifier=None, since=None, until=None):
+        """
+        Returns the number of accesses (optionally by ``identifier``, from
+        ``since`` & until ``until``, as timestamps), broken down by url &
+        request method.
+        """
+        rollups = self.get_query_set()
+        
+        if identifier is not None:
+            rollups = rollups.filter(identifier=identifier)
+        
+        if since is not None:
+            rollups = rollups.filter(period_start__gte=since)
+        
+        if until is not None:
+            rollups = rollups.filter(period_start__lt=until)
+        
+        return rollups.values('url', 'request_method').annotate(accesses=models.Sum('count')).order_by('url', 'request_method')
+
+
+class ApiAccessRollup(models.Model):
+    """
+    The number of ``ApiAccess`` records for an identifier, url & request
+    method within a period of time. Built by the ``rollup_api_accesses``
+    command, so usage can be queried without going through every access.
+    """
+    identifier = models.CharField(max_length=255, db_index=True)
+    url = models.CharField(max_length=255, blank=True, default='')
+    request_method = models.CharField(max_length=10, blank=True, default='')
+    period_start = models.PositiveIntegerField(db_index=True)
+    period_length = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    # The id of the last ``ApiAccess`` counted, so accesses are only counted once.
+    last_access_id = models.PositiveIntegerField(default=0, db_index=True)
+    
+    objects = ApiAccessRollupManager()
+    
+    class Meta:
+        unique_together = ('identifier', 'url', 'request_method', 'period_start', 'period_length')
+    
+    def __unicode__(self):
+        return u"%s x %s @ %s" % (self.identifier, self.count, self.period_start)
+
+
 if 'django.contrib.auth' in settings.INSTALLED_APPS:
+    import threading
     import uuid
     from django.conf import settings
     from django.contrib.auth.models import User
     
     class ApiKey(models.Model):
         user = models.OneToOneField(User, related_name='api_key')
-        key = models.CharField(max_length=256, blank=True, default='')
+        key = models.CharField(max_length=256, blank=True, default='', db_index=True)
         created = models.DateTimeField(default=datetime.datetime.now)
         
         def __unicode__(self):
@@ -57,3 +106,216 @@ if 'django.contrib.auth' in settings.INSTALLED_APPS:
         """
         if kwargs.get('created') is True:
             ApiKey.objects.create(user=kwargs.get('instance'))
+    
+    
+    def api_key_cache_key(username):
+        """
+        The cache key ``ApiKeyAuthentication`` keeps a user's credentials under.
+        """
+        return 'tastypie_api_key:%s' % sha1(smart_str(username)).hexdigest()
+    
+    
+    def basic_auth_cache_key(username):
+        """
+        The cache key ``BasicAuthentication`` keeps a user's credentials under.
+        """
+        return 'tastypie_basic_auth:%s' % sha1(smart_str(username)).hexdigest()
+    
+    
+    def digest_cache_key(username):
+        """
+        The cache key ``DigestAuthentication`` keeps a user's partial digest
+        under.
+        """
+        return 'tastypie_digest:%s' % sha1(smart_str(username)).hexdigest()
+    
+    
+    def credential_digest(credentials):
+        """
+        What's cached in place of an API key or ``Authorization`` header, so
+        the cache never holds anything a client could authenticate with.
+        """
+        return hmac.new(smart_str(settings.SECRET_KEY), smart_str(credentials), sha1).hexdigest()
+    
+    
+    def clear_api_key_cache(sender, instance, **kwargs):
+        """
+        A signal for dropping the cached credentials of a user when either
+        their ``User`` or ``ApiKey`` changes.
+        """
+        if isinstance(instance, ApiKey):
+            try:
+                instance = instance.user
+            except User.DoesNotExist:
+                return
+        
+        cache.delete_many([api_key_cache_key(instance.username), digest_cache_key(instance.username)])
+    
+    
+    def clear_basic_auth_cache(sender, instance, **kwargs):
+        """
+        A signal for dropping the cached Basic auth credentials of a user when
+        their ``User`` (and so possibly their password) changes.
+        """
+        cache.delete(basic_auth_cache_key(instance.username))
+    
+    
+    class ApiKeyFilter(object):
+        """
+        A per-process Bloom filter of the API keys, and of the usernames of
+        the users with one, so requests with unknown ones can be turned away
+        without a query.
+        
+        Built from the database on first use, then rebuilt every
+        ``rebuild_interval`` seconds & whenever another process has added a
+        key since (which it notes in the cache). Rebuilds happen at most once
+        every ``min_rebuild_interval`` seconds & by one thread at a time;
+        until then, a stale filter lets unknown items through to the database
+        rather than scanning the keys again.
+        """
+        version_cache_key = 'tastypie_api_key_filter_version'
+        rebuild_interval = 300
+        min_rebuild_interval = 10
+        error_rate = 0.001
+        
+        def __init__(self):
+            self.filter = None
+            self.version = None
+            self.built = None
+            self._lock = threading.Lock()
+        
+        def current_version(self):
+            version = cache.get(self.version_cache_key)
+            
+            if version is None:
+                cache.add(self.version_cache_key, uuid.uuid4().hex, 7 * 24 * 3600)
+                version = cache.get(self.version_cache_key)
+            
+            return version
+        
+        def is_current(self, version=None):
+            if self.filter is None or time.time() - self.built >= self.rebuild_interval:
+                return False
+            
+            if version is None:
+                version = self.current_version()
+            
+            return version == self.version
+        
+        def rebuild(self, blocking=True):
+            """
+            Builds the filter from the database, unless another thread did
+            while this one waited for the lock.
+            
+            With ``blocking=False``, gives up if another thread is already
+            building it. Returns whether the filter is now current.
+            """
+            if not self._lock.acquire(blocking):
+                return False
+            
+            try:
+                version = self.current_version()
+                
+                if self.is_current(version):
+                    return True
+                
+                keys = ApiKey.objects.all()
+                bloom = BloomFilter(max(keys.count() * 2, 1000), self.error_rate)
+                
+                for key, username in keys.values_list('key', 'user__username').iterator():
+                    bloom.add('key:%s' % key)
+                    bloom.add('user:%s' % username)
+                
+                self.filter, self.version, self.built = bloom, version, time.time()
+                return True
+            finally:
+                self._lock.release()
+        
+        def add(self, api_key):
+            """
+            Adds a new key, and tells the other processes to rebuild.
+            """
+            if self.filter is None:
+                self.changed()
+                return
+            
+            self.filter.add('key:%s' % api_key.key)
+            self.filter.add('user:%s' % api_key.user.username)
+            
+            # This process already has the key, so only needs to rebuild if it
+            # had missed some other change.
+            up_to_date = cache.get(self.version_cache_key) == self.version
+            version = self.bump_version()
+            
+            if up_to_date:
+                self.version = version
+        
+        def changed(self):
+            """
+            Tells every process (this one included) to rebuild, for keys added
+            without signals.
+            """
+            self.bump_version()
+            self.built = 0
+        
+        def bump_version(self):
+            version = uuid.uuid4().hex
+            cache.set(self.version_cache_key, version, 7 * 24 * 3600)
+            return version
+        
+        def might_contain(self, item):
+            if self.filter is None:
+                self.rebuild()
+            elif time.time() - self.built >= self.rebuild_interval:
+                self.rebuild(blocking=False)
+            
+            if item in self.filter:
+                return True
+            
+            # Only unknown items pay for checking whether the filter is stale.
+            if self.current_version() == self.version:
+                return False
+            
+            if time.time() - self.built >= self.min_rebuild_interval and self.rebuild(blocking=False):
+                return item in self.filter
+            
+            # Stale, but rebuilt too recently (or being rebuilt). Let the
+            # database decide.
+            return True
+        
+        def might_contain_key(self, api_key):
+            return self.might_contain('key:%s' % api_key)
+        
+        def might_contain_user(self, username):
+            return self.might_contain('user:%s' % username)
+    
+    
+    api_key_filter = ApiKeyFilter()
+    
+    
+    def add_to_api_key_filter(sender, instance, **kwargs):
+        """
+        A signal for adding new (or changed) keys to the ``ApiKeyFilter``.
+        """
+        try:
+            api_key_filter.add(instance)
+        except User.DoesNotExist:
+            pass
+    
+    
+    models.signals.post_save.connect(clear_api_key_cache, sender=ApiKey, dispatch_uid='tastypie_api_key_cache')
+    models.signals.post_delete.connect(clear_api_key_cache, sender=ApiKey, dispatch_uid='tastypie_api_key_cache')
+    models.signals.post_save.connect(clear_api_key_cache, sender=User, dispatch_uid='tastypie_api_key_cache')
+    models.signals.post_delete.connect(clear_api_key_cache, sender=User, dispatch_uid='tastypie_api_key_cache')
+    models.signals.post_save.connect(clear_basic_auth_cache, sender=User, dispatch_uid='tastypie_basic_auth_cache')
+    models.signals.post_delete.connect(clear_basic_auth_cache, sender=User, dispatch_uid='tastypie_basic_auth_cache')
+    models.signals.post_save.connect(add_to_api_key_filter, sender=ApiKey, dispatch_uid='tastypie_api_key_filter')
+    
+    from django.contrib.auth.models import Group, Permission
+    from tastypie.authorization import permissions_changed
+    
+    for through in (User.user_permissions.through, User.groups.through, Group.permissions.through):
+        models.signals.m2m_changed.connect(permissions_changed, sender=through, dispatch_uid='tastypie_permissions')
+    
+    for sender in (Group, Permission):
+        models.signals.post_delete.connect(permissions_changed, sender=sender, dispatch_uid='tastypie_permissions')
@@ -4,21 +4,159 @@ Multipart uploads for everyone!
 @author: Michael Wu
 """
 
+import base64
+import binascii
 import cgi
 import cStringIO
+import tempfile
 
 from django.conf import settings
 from django.core.exceptions import SuspiciousOperation
 from django.http import BadHeaderError
 from django.http.multipartparser import *
-from django.http.multipartparser import LimitBytes, LazyStream, ChunkIter, Parser, RAW, FILE, FIELD, exhaust
+from django.http.multipartparser import LimitBytes, LazyStream, ChunkIter, Parser, RAW, FILE, FIELD, InterBoundaryIter, exhaust, parse_header
 from django.utils.datastructures import MultiValueDict
 from django.utils.encoding import force_unicode
 from django.utils.text import unescape_entities
 from django.core.files.uploadhandler import StopUpload, SkipFile, StopFutureHandlers
 
+
+class Base64Decoder(object):
+    """
+    Decodes base64 content handed over in arbitrarily sized chunks.
+    
+    Whitespace (line breaks, mostly) is dropped and any trailing characters
+    that don't make up a full 4-character group are held back until the next
+    chunk arrives, so each chunk can be decoded on its own.
+    """
+    def __init__(self):
+        self.remainder = ''
+    
+    def decode(self, chunk):
+        chunk = self.remainder + ''.join(chunk.split())
+        usable = len(chunk) - len(chunk) % 4
+        chunk, self.remainder = chunk[:usable], chunk[usable:]
+        
+        try:
+            return base64.b64decode(chunk)
+        except (TypeError, binascii.Error), e:
+            raise MultiPartParserError("Could not decode base64 data: %r" % e)
+    
+    def flush(self):
+        if self.remainder:
+            raise MultiPartParserError("Could not decode base64 data: %d trailing characters." % len(self.remainder))
+        
+        return ''
+
+
+def decoded_chunks(field_stream, transfer_encoding=None):
+    """
+    Yields the chunks of a part's content, decoding its
+    ``Content-Transfer-Encoding`` (only ``base64`` needs any work) on the fly.
+    """
+    if transfer_encoding != 'base64':
+        for chunk in field_stream:
+            yield chunk
+        
+        return
+    
+    decoder = Base64Decoder()
+    
+    for chunk in field_stream:
+        chunk = decoder.decode(chunk)
+        
+        if chunk:
+            yield chunk
+    
+    decoder.flush()
+
+
+# Headers whose values carry ``; key=value`` parameters.
+PARAMETERIZED_HEADERS = ('content-type', 'content-disposition', 'content-transfer-encoding')
+
+
+def parse_boundary_stream(stream, max_header_size):
+    """
+    Parses the headers of one part of a multipart body.
+    
+    Unlike Django's version, parts without a ``Content-Disposition`` (as is
+    usual in ``multipart/mixed`` bodies) still have their headers parsed and
+    stripped from the content. Only a part without any headers at all is
+    passed on verbatim.
+    
+    Returns ``None`` for what follows the closing delimiter (``--``), which
+    isn't a part at all.
+    """
+    chunk = stream.read(max_header_size)
+    
+    if chunk.startswith('--'):
+        stream.unget(chunk)
+        return None
+    
+    header_end = chunk.find('\r\n\r\n')
+    
+    if header_end == -1:
+        stream.unget(chunk)
+        return (RAW, {}, stream)
+    
+    stream.unget(chunk[header_end + 4:])
+    item_type = RAW
+    meta_data = {}
+    
+    for line in chunk[:header_end].split('\r\n'):
+        try:
+            name, value = line.split(':', 1)
+        except ValueError:
+            continue
+        
+        name = name.strip().lower()
+        
+        if name in PARAMETERIZED_HEADERS:
+            value, params = parse_header(value)
+        else:
+            # Leave the likes of ``Content-Location`` & ``Content-ID`` alone.
+            value, params = value.strip(), {}
+        
+        if name == 'content-disposition':
+            item_type = FIELD
+            
+            if params.get('filename'):
+                item_type = FILE
+        
+        meta_data[name] = value, params
+    
+    return (item_type, meta_data, stream)
+
+
+class MixedParser(Parser):
+    """
+    A ``Parser`` that understands the headers of ``multipart/mixed`` parts.
+    """
+    def __iter__(self):
+        for sub_stream in InterBoundaryIter(self._stream, self._separator):
+            part = parse_boundary_stream(sub_stream, 1024)
+            
+            if part is None:
+                exhaust(sub_stream)
+                break
+            
+            yield part
+
+
 class HTTPAttachment(object):
-    def __init__(self, content=None, headers=None):
+    """
+    A part of a multipart request body that isn't a form field or a file
+    upload, exposed as a read-only, file-like object along with its headers.
+    
+    The content lives in ``file``, which the parser spools to disk once it
+    grows past ``FILE_UPLOAD_MAX_MEMORY_SIZE``. Prefer ``read`` or ``chunks``
+    over ``content``, which loads the whole thing into memory.
+    
+    ``META`` maps the headers of the part the same way ``request.META`` does
+    (``CONTENT_TYPE``, ``CONTENT_LENGTH`` & ``HTTP_*``), so attachments can be
+    handed to the parsers just like requests.
+    """
+    def __init__(self, content=None, headers=None, file=None, size=None):
         # _headers is a mapping of the lower-case name to the original case of
         # the header (required for working with legacy systems) and the header
         # value.  Both the name of the header and its value are ASCII strings.
@@ -26,31 +164,43 @@ class HTTPAttachment(object):
         
         if headers:
             for header, value in headers.items():
-                header, value = self._convert_header(header, value)
-                self._headers[header.lower()] = (header, value)
+                self[header] = value
         
         self._charset = settings.DEFAULT_CHARSET
+        self.has_content_body = content is not None or file is not None
         
-        self.has_content_body = content is not None
-        self.raw_content = content
-        self._file = cStringIO.StringIO(content)
-        self.remaining = len(content)
-
-        print "Headers"
-        print headers
- 
+        if file is None:
+            self.content = content
+        else:
+            self.file = file
+            self.size = size
+            
+            if size is None:
+                file.seek(0, 2)
+                self.size = file.tell()
+            
+            file.seek(0)
+    
     def __str__(self):
         """HTTP attachment headers only."""
         return '\n'.join(['%s: %s' % (key, value)
             for key, value in self._headers.values()]) \
             + '\n\n' + unicode(self.content)
-            
+    
+    def __repr__(self):
+        return '<HTTPAttachment: %s (%s bytes)>' % (self.get('content-type', 'no content type'), self.size)
+    
     def _convert_header(self, *values):
         """
         Converts all values to ascii strings and replace dashes with underscores
         to reflect Django's META attribute
         """
         for value in values:
+            if isinstance(value, tuple):
+                # ``(value, params)``, as parsed from a multipart body.
+                value, params = value
+                value = value + ''.join(['; %s=%s' % (key, param) for key, param in params.items()])
+            
             if isinstance(value, unicode):
                 try:
                     value = value.encode('us-ascii')
@@ -63,60 +213,117 @@ class HTTPAttachment(object):
                 raise BadHeaderError("Header values can't contain newlines (got %r)" % (value))
             value.replace('-', '_')
             yield value
-
+    
     def __setitem__(self, header, value):
         header, value = self._convert_header(header, value)
         self._headers[header.lower()] = (header, value)
-
+    
     def __delitem__(self, header):
         try:
             del self._headers[header.lower()]
         except KeyError:
             pass
-
+    
     def __getitem__(self, header):
         return self._headers[header.lower()][1]
-
+    
     def has_header(self, header):
         """Case-insensitive check for a header."""
         return self._headers.has_key(header.lower())
-
+    
     __contains__ = has_header
-
+    
     def items(self):
         return self._headers.values()
-
+    
     def get(self, header, alternate):
         return self._headers.get(header.lower(), (None, alternate))[1]
     
     @property
     def META(self):
-        return self._headers
-
+        meta = {}
+        
+        for header, value in self._headers.values():
+            key = header.upper().replace('-', '_')
+            
+            if not key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            
+            meta[key] = value
+        
+        return meta
+    
     def _get_content(self):
-        return self.raw_content
-
+        position = self.file.tell()
+        self.file.seek(0)
+        
+        try:
+            return self.file.read()
+        finally:
+            self.file.seek(position)
+    
     def _set_content(self, content):
         self.has_content_body = content is not None
-        self.raw_content = content
-        self._file = cStringIO.StringIO(content)
-        self.remaining = len(content)
-
+        content = content or ''
+        
+        if isinstance(content, unicode):
+            content = content.encode(self._charset)
+        
+        self.file = cStringIO.StringIO(content)
+        self.size = len(content)
+    
     content = property(_get_content, _set_content)
+    raw_content = property(_get_content, _set_content)
+    
+    @property
+    def remaining(self):
+        return self.size - self.file.tell()
     
     def read(self, num_bytes=None):
         """
         Read data from the attachment.
         """
-        if num_bytes is None:
-            num_bytes = self.remaining
-        else:
-            num_bytes = min(num_bytes, self.remaining)
-        self.remaining -= num_bytes
+        if num_bytes is None or num_bytes < 0:
+            return self.file.read()
         
-        return self._file.read(num_bytes)
+        return self.file.read(num_bytes)
+    
+    def readline(self, *args):
+        return self.file.readline(*args)
+    
+    def seek(self, *args):
+        return self.file.seek(*args)
+    
+    def tell(self):
+        return self.file.tell()
+    
+    def chunks(self, chunk_size=64 * 1024):
+        """
+        Yields the content from the start, ``chunk_size`` bytes at a time.
+        """
+        self.file.seek(0)
+        
+        while True:
+            chunk = self.file.read(chunk_size)
+            
+            if not chunk:
+                break
+            
+            yield chunk
+    
+    def close(self):
+        self.file.close()
 
 class MultiPartMixedParser(MultiPartParser):
+    """
+    Parses ``multipart/*`` bodies into form fields, uploaded files and a list
+    of ``HTTPAttachment`` for everything else.
+    
+    The body is streamed through a chunk at a time: attachments are spooled
+    to temporary files once they outgrow ``FILE_UPLOAD_MAX_MEMORY_SIZE`` and
+    ``base64`` content is decoded as it goes, so large uploads are never held
+    in memory in full.
+    """
     def parse(self):
         """
         Parse the POST data and break it into a FILES MultiValueDict, a POST
@@ -128,14 +335,11 @@ class MultiPartMixedParser(MultiPartParser):
         # We have to import QueryDict down here to avoid a circular import.
         from django.http import QueryDict
         
-        print "MULTIMIXED PARSING"
-
         encoding = self._encoding
         handlers = self._upload_handlers
         
         limited_input_data = LimitBytes(self._input_data, self._content_length)
         
-
         # See if the handler will want to take care of the parsing.
         # This allows overriding everything if somebody wants it.
         for handler in handlers:
@@ -159,23 +363,8 @@ class MultiPartMixedParser(MultiPartParser):
         old_field_name = None
         counters = [0] * len(handlers)
 
-        print "EACH ONE"
-        count = 0
-
         try:
-            for item_type, meta_data, field_stream in Parser(stream, self._boundary):
-                count += 1
-                print "ITEM " + str(count)
-                print item_type
-                print meta_data
-                
-                data = field_stream.read()
-                if len(data) < 1000:
-                    print "DATA"
-                    print data
-                
-                field_stream = cStringIO.StringIO(data)
-                
+            for item_type, meta_data, field_stream in MixedParser(stream, self._boundary):
                 if old_field_name:
                     # We run this at the beginning of the next loop
                     # since we cannot be sure a file is complete until
@@ -191,53 +380,26 @@ class MultiPartMixedParser(MultiPartParser):
 
                 transfer_encoding = meta_data.get('content-transfer-encoding')
                 
+                if transfer_encoding is not None:
+                    transfer_encoding = transfer_encoding[0].strip().lower()
+                
                 if field_name:
                     field_name = force_unicode(field_name, encoding, errors='replace')
 
-                if item_type == FIELD:
-                    print "FIELD"
-                    if field_name is None:
-                        """
-                        Add to DATA array
-                        """
-                        if transfer_encoding == 'base64':
-                            raw_data = field_stream.read()
-                            try:
-                                data = str(raw_data).decode('base64')
-                            except:
-                                data = raw_data
-                        else:
-                            data = field_stream.read()
-                        
-                        if len(meta_data) and not data or len(data.strip()) == 0:
-                            continue
-                        
-                        # Provide the meta data so we can figure out what it was later
-                        wrapped_data = HTTPAttachment(data, meta_data)
-                        
-                        self._data.append(wrapped_data)
-                        continue
-                    
+                if item_type == FIELD and field_name is not None:
                     # This is a post field, we can just set it in the post
-                    if transfer_encoding == 'base64':
-                        raw_data = field_stream.read()
-                        try:
-                            data = str(raw_data).decode('base64')
-                        except:
-                            data = raw_data
-                    else:
-                        data = field_stream.read()
-
+                    data = ''.join(decoded_chunks(field_stream, transfer_encoding))
                     self._post.appendlist(field_name,
                                           force_unicode(data, encoding, errors='replace'))
                 elif item_type == FILE:
-                    print "FILE"
                     if field_name is None:
+                        exhaust(field_stream)
                         continue
                     
                     # This is a file, use the handler...
                     file_name = disposition.get('filename')
                     if not file_name:
+                        exhaust(field_stream)
                         continue
                     file_name = force_unicode(file_name, encoding, errors='replace')
                     file_name = self.IE_sanitize(unescape_entities(file_name))
@@ -263,15 +425,7 @@ class MultiPartMixedParser(MultiPartParser):
                             except StopFutureHandlers:
                                 break
 
-                        for chunk in field_stream:
-                            if transfer_encoding == 'base64':
-                                # We only special-case base64 transfer encoding
-                                try:
-                                    chunk = str(chunk).decode('base64')
-                                except Exception, e:
-                                    # Since this is only a chunk, any error is an unfixable error.
-                                    raise MultiPartParserError("Could not decode base64 data: %r" % e)
-
+                        for chunk in decoded_chunks(field_stream, transfer_encoding):
                             for i, handler in enumerate(handlers):
                                 chunk_length = len(chunk)
                                 chunk = handler.receive_data_chunk(chunk,
@@ -288,23 +442,13 @@ class MultiPartMixedParser(MultiPartParser):
                         # Handle file upload completions on next iteration.
                         old_field_name = field_name
                 else:
-                    print "RAW?"
-                    # If this is neither a FIELD or a FILE, add it to the DATA array
-                    if transfer_encoding == 'base64':
-                        raw_data = field_stream.read()
-                        try:
-                            data = str(raw_data).decode('base64')
-                        except:
-                            data = raw_data
-                    else:
-                        data = field_stream.read()
-                    
-                    if len(meta_data) and not data or len(data.strip()) == 0:
-                        continue
+                    # If this is neither a named FIELD nor a FILE, add it to
+                    # the DATA array, along with its headers so we can figure
+                    # out what it was later.
+                    attachment = self.spool_attachment(field_stream, meta_data, transfer_encoding)
                     
-                    # Provide the meta data so we can figure out what it was later
-                    wrapped_data = HTTPAttachment(data, meta_data)
-                    self._data.append(wrapped_data)
+                    if attachment is not None:
+                        self._data.append(attachment)
                     
         except StopUpload, e:
             if not e.connection_reset:
@@ -319,20 +463,35 @@ class MultiPartMixedParser(MultiPartParser):
             if retval:
                 break
 
-        print "FINAL DATA"
-        print self._data
-
         if len(self._data) == 0:
             data = None
         elif len(self._data) == 1:
             data = self._data[0]
         else:
             data = self._data
+        
+        return data, self._post, self._files
+    
+    def spool_attachment(self, field_stream, meta_data, transfer_encoding=None):
+        """
+        Copies the content of a part into a ``SpooledTemporaryFile``, chunk
+        by chunk, and wraps it in an ``HTTPAttachment``.
+        
+        Returns ``None`` for parts with no content (or only whitespace).
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE, dir=settings.FILE_UPLOAD_TEMP_DIR)
+        size = 0
+        blank = True
+        
+        for chunk in decoded_chunks(field_stream, transfer_encoding):
+            if blank and chunk.strip():
+                blank = False
             
-        for item in data:
-            print "headers"
-            print item._headers
-            print "content"
-            print item.raw_content
+            spool.write(chunk)
+            size += len(chunk)
+        
+        if blank:
+            spool.close()
+            return None
         
-        return data, self._post, self._files
\ No newline at end of file
+        return HTTPAttachment(headers=meta_data, file=spool, size=size)
@@ -32,12 +32,16 @@ class Paginator(object):
         
         Optionally accepts an ``offset`` argument, which specifies where in
         the ``objects`` to start displaying results from. Defaults to 0.
+        
+        If the number of ``objects`` is already known, it can be set as
+        ``count``, which saves ``get_count`` a query.
         """
         self.request_data = request_data
         self.objects = objects
         self.limit = limit
         self.offset = offset
         self.resource_uri = resource_uri
+        self.count = None
     
     def get_limit(self):
         """
@@ -106,6 +110,9 @@ class Paginator(object):
         """
         Returns a count of the total number of objects seen.
         """
+        if getattr(self, 'count', None) is not None:
+            return self.count
+        
         try:
             return self.objects.count()
         except (AttributeError, TypeError):
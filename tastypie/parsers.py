@@ -26,7 +26,8 @@ from tastypie.exceptions import BadRequest
 try:
     import lxml
     from lxml.etree import parse as parse_xml
-    from lxml.etree import Element, tostring
+    from lxml.etree import Element, XMLSyntaxError, tostring
+    from lxml.etree import XMLParser as XMLTreeParser
 except ImportError:
     lxml = None
 try:
@@ -40,7 +41,9 @@ except ImportError:
     biplist = None
 
 from tastypie.response import ErrorResponse
-from tastypie.utils.mime import media_type_matches
+from tastypie.utils import LRUCache
+from tastypie.utils.jsonstream import JSONArrayReader
+from tastypie.utils.mime import bare_media_type, media_type_matches
 
 
 __all__ = (
@@ -49,6 +52,11 @@ __all__ = (
     'PlainTextParser',
     'FormParser',
     'YAMLParser',
+    'XMLParser',
+    'PListParser',
+    'ParserRegistry',
+    'DEFAULT_PARSERS',
+    'DEFAULT_PARSER_REGISTRY',
 )
 
 
@@ -80,6 +88,22 @@ class BaseParser(object):
         """
         raise NotImplementedError("BaseParser.parse() Must be overridden to be implemented.")
 
+    def iterparse(self, content, key='objects', content_type=None, request=None):
+        """
+        Returns an iterator over the items of the list found under *key* in
+        the deserialized content, raising :exc:`BadRequest` if there isn't one.
+        
+        The default implementation parses the whole of *content* up front.
+        Parsers that can do better (see :class:`JSONParser`) override this to
+        produce each item as soon as it has been read.
+        """
+        data = self.parse(content, content_type=content_type, request=request)
+        
+        if not hasattr(data, 'get') or not key in data:
+            raise BadRequest("Invalid data sent.")
+        
+        return iter(data[key])
+
 
 class JSONParser(BaseParser):
     """
@@ -93,12 +117,10 @@ class JSONParser(BaseParser):
         Returns deserialized json content.
         
         `data` will be an object which is the parsed content of the response.
-        """
-        print "CONTENT"
-        content = content.read()
-        print content
-        print "end content"
         
+        Streams (including requests whose body is decoded from a
+        ``Content-Encoding`` on the fly) are read directly.
+        """
         try:
             if getattr(content, 'read', None):
                 return json.load(content)
@@ -107,6 +129,21 @@ class JSONParser(BaseParser):
         except ValueError, exc:
             raise BadRequest('JSON parse error - %s' % unicode(exc))
 
+    def iterparse(self, content, key='objects', content_type=None, request=None):
+        """
+        Incrementally parses the list under *key*, yielding each item as soon
+        as it has been read, so only one item is held in memory at a time.
+        
+        The stream is read up to the opening bracket of the list right away,
+        so a missing *key* is reported before any item is handed out.
+        """
+        if isinstance(content, basestring):
+            content = StringIO(content)
+        
+        reader = JSONArrayReader(content, key=key)
+        reader.open()
+        return iter(reader)
+
 if yaml:
     class YAMLParser(BaseParser):
         """
@@ -123,7 +160,7 @@ if yaml:
             """
             try:
                 return yaml.safe_load(content)
-            except ValueError, exc:
+            except yaml.YAMLError, exc:
                 raise BadRequest('YAML parse error - %s' % unicode(exc))
 else:
     YAMLParser = None
@@ -189,8 +226,22 @@ if lxml:
             if isinstance(content, basestring):
                 content = StringIO(content)
             
-            data = parse_xml(content).getroot()
+            # Entities are left alone, so a body can't pull in local files or
+            # make the server fetch URLs.
+            parser = XMLTreeParser(resolve_entities=False, no_network=True)
+            
+            try:
+                data = parse_xml(content, parser).getroot()
+            except XMLSyntaxError, exc:
+                raise BadRequest('XML parse error - %s' % unicode(exc))
             
+            return self.from_etree(data)
+        
+        def from_etree(self, data):
+            """
+            Converts an ``etree.Element`` (as written by
+            ``Serializer.to_etree``) back into Python data.
+            """
             if data.tag == 'request':
                 # if "object" or "objects" exists, return deserialized forms.
                 elements = data.getchildren()
@@ -234,16 +285,113 @@ else:
     PListParser = None
 
 
-DEFAULT_PARSERS = ( JSONParser, )
-
-if YAMLParser:
-    DEFAULT_PARSERS += ( YAMLParser, )
+class ParserRegistry(object):
+    """
+    An ordered collection of parser instances that resolves a request's
+    content type to the parser which should handle it.
+    
+    Parsers are consulted in the order they were registered and the first one
+    whose ``can_handle_request`` accepts the content type wins. Resolutions
+    (including misses) are cached by media type, so each one is only matched
+    against the parsers once. Parameters (such as a ``multipart/form-data``
+    boundary, which differs with every request) are left out.
+    
+    Accepts either parser classes or instances. Classes are instantiated once,
+    on registration.
+    """
+    cache_size = 128
+    
+    def __init__(self, parsers=None):
+        self._parsers = []
+        self._cache = LRUCache(self.cache_size)
+        
+        for parser in parsers or ():
+            self.register(parser)
+    
+    def __iter__(self):
+        return iter(self._parsers)
+    
+    def __len__(self):
+        return len(self._parsers)
+    
+    def __repr__(self):
+        return '<ParserRegistry: %s>' % ', '.join([parser.__class__.__name__ for parser in self._parsers])
+    
+    def register(self, parser, first=False):
+        """
+        Adds a parser (class or instance) to the registry.
+        
+        By default, the parser has the lowest precedence. Pass ``first=True``
+        to have it consulted before all the others.
+        """
+        if isinstance(parser, type):
+            parser = parser()
+        
+        if first:
+            self._parsers.insert(0, parser)
+        else:
+            self._parsers.append(parser)
+        
+        self._cache.clear()
+        return parser
+    
+    def unregister(self, parser_class):
+        """
+        Removes all parsers of the given class from the registry.
+        """
+        self._parsers = [parser for parser in self._parsers if not parser.__class__ is parser_class]
+        self._cache.clear()
+    
+    def extend(self, *parsers, **kwargs):
+        """
+        Returns a new registry holding the current parsers plus the provided
+        ones, leaving this registry untouched. Useful for adding a parser to
+        the defaults on a single resource::
+        
+            class Meta:
+                parsers = DEFAULT_PARSER_REGISTRY.extend(CSVParser)
+        
+        Pass ``first=True`` to give the new parsers precedence over the
+        existing ones.
+        """
+        first = kwargs.get('first', False)
+        
+        if first:
+            registry = ParserRegistry(list(parsers) + self._parsers)
+        else:
+            registry = ParserRegistry(self._parsers + list(parsers))
+        
+        return registry
+    
+    def resolve(self, content_type):
+        """
+        Returns the parser instance that handles ``content_type``, or
+        ``None`` if none of them do.
+        """
+        media_type = bare_media_type(content_type)
+        
+        try:
+            return self._cache[media_type]
+        except KeyError:
+            pass
+        
+        resolved = None
+        
+        for parser in self._parsers:
+            if parser.can_handle_request(media_type):
+                resolved = parser
+                break
+        
+        self._cache[media_type] = resolved
+        return resolved
 
-if XMLParser:
-    DEFAULT_PARSERS += ( YAMLParser, )
 
-if PListParser:
-    DEFAULT_PARSERS += ( PListParser, )
-    
-DEFAULT_PARSERS += ( FormParser, )
+DEFAULT_PARSERS = tuple([parser_class for parser_class in (
+    JSONParser,
+    YAMLParser,
+    XMLParser,
+    PListParser,
+    FormParser,
+) if parser_class is not None])
 
+DEFAULT_PARSER_REGISTRY = ParserRegistry(DEFAULT_PARSERS)
@@ -8,8 +8,10 @@ import cStringIO
 from pprint import pformat
 import sys
 
+from django.conf import settings
 from django.http import HttpRequest, QueryDict, MultiValueDict, ImmutableList
 from tastypie.multipart import MultiPartMixedParser
+from tastypie.utils.compression import DecompressingStream
 from tastypie.utils.mime import media_type_matches
 
 class TastypieHTTPRequest(HttpRequest):
@@ -21,7 +23,7 @@ class TastypieHTTPRequest(HttpRequest):
         """
         Init when monkey patching classes
         """
-        pass
+        self._decode_content()
 
     @property
     def content_type(self):
@@ -58,7 +60,8 @@ class TastypieHTTPRequest(HttpRequest):
     def DATA(self):
         """
         Parses the request body and returns the data. For multipart requests,
-        will come back as an array???
+        this is the ``HTTPAttachment`` (or list of them) for the parts that
+        aren't form fields or file uploads.
 
         Similar to ``request.POST``, except that it handles arbitrary parsers,
         and also works on methods other than POST (eg PUT).
@@ -85,24 +88,68 @@ class TastypieHTTPRequest(HttpRequest):
         """
         self._content_type = self.META.get('HTTP_CONTENT_TYPE', self.META.get('CONTENT_TYPE', ''))
 
+    @property
+    def content_encoding(self):
+        """
+        Returns the lowercased ``Content-Encoding`` of the request body, or an
+        empty string if the body isn't encoded.
+        """
+        encoding = self.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+
+        if encoding == 'identity':
+            return ''
+
+        return encoding
+
     def _get_stream(self):
         """
         Returns an object that may be used to stream the request content.
+
+        Bodies sent with ``Content-Encoding: gzip`` or ``deflate`` are inflated
+        on the fly as they're read, up to ``TASTYPIE_MAX_DECODED_BODY_SIZE``
+        bytes.
         """
-        request = self.request
+        if hasattr(self, '_raw_post_data'):
+            stream = cStringIO.StringIO(self._raw_post_data)
+        else:
+            stream = getattr(self, '_stream', None)
 
-        try:
-            content_length = int(request.META.get('CONTENT_LENGTH', request.META.get('HTTP_CONTENT_LENGTH')))
-        except (ValueError, TypeError):
-            content_length = 0
-
-        # TODO: Add 1.3's LimitedStream to compat and use that.
-        # NOTE: Currently only supports parsing request body as a stream with 1.3
-        if content_length == 0:
-            return None
-        elif hasattr(request, 'read'):
-             return request
-        return cStringIO.StringIO(request.raw_post_data)
+        if stream is None or not self.content_encoding:
+            return stream
+
+        max_length = getattr(settings, 'TASTYPIE_MAX_DECODED_BODY_SIZE', 32 * 1024 * 1024)
+        return DecompressingStream(stream, self.content_encoding, max_length=max_length)
+
+    def _decode_content(self):
+        """
+        Swaps the request's stream for one that decodes the
+        ``Content-Encoding`` of the body, so that ``read()``,
+        ``raw_post_data`` and the parsers all see the decoded content.
+        """
+        if not self.content_encoding or getattr(self, '_content_decoded', False):
+            return
+
+        if getattr(self, '_read_started', False) and not hasattr(self, '_raw_post_data'):
+            # Somebody already consumed part of the body. Nothing we can do.
+            return
+
+        stream = self._get_stream()
+        self._content_decoded = True
+
+        if stream is None:
+            return
+
+        if hasattr(self, '_raw_post_data'):
+            self._raw_post_data = stream.read()
+            self._stream = cStringIO.StringIO(self._raw_post_data)
+        else:
+            self._stream = stream
+
+        # ``CONTENT_LENGTH`` is the length on the wire. The decoded length
+        # isn't known until the stream is exhausted, so let readers go as far
+        # as the decoding limit (which the stream enforces itself).
+        self._encoded_content_length = self.META.get('CONTENT_LENGTH')
+        self.META['CONTENT_LENGTH'] = str(getattr(stream, 'max_length', None) or '')
 
     def _mark_post_parse_error(self):
         self._data = []
@@ -127,20 +174,15 @@ class TastypieHTTPRequest(HttpRequest):
             self._load_content_type()
             
         # Populates self._post and self._files
-        if self._read_started:
+        if getattr(self, '_read_started', False):
             self._mark_post_parse_error()
             return
 
         if self.META.get('CONTENT_TYPE', '').startswith('multipart'):
             self._raw_post_data = ''
             try:
-                print "parsing file upload"
                 self._data, self._form, self._files = self.parse_file_upload(self.META, self)
-                print "parsed!"
-                print self._data
-                print self._form
-                print self._files
-            except Exception as e:
+            except:
                 # An error occured while parsing POST data.  Since when
                 # formatting the error the request handler might access
                 # self.POST, set self._post and self._file to prevent
@@ -148,13 +190,10 @@ class TastypieHTTPRequest(HttpRequest):
                 # Mark that an error occured.  This allows self.__repr__ to
                 # be explicit about it instead of simply representing an
                 # empty POST
-                print "POST PARSE ERROR???"
                 self._mark_post_parse_error()
-                print e
-                raise e
+                raise
         elif media_type_matches(self.META.get('CONTENT_TYPE', ''), 'application/x-www-form-urlencoded'):
             self._data, self._form, self._files = self, QueryDict(self.raw_post_data, self._encoding), MultiValueDict()
-            print self._form
         else:
             self._data, self._form, self._files = self, QueryDict(''), MultiValueDict()
     
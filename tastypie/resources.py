@@ -1,4 +1,8 @@
 import logging
+import math
+import mimetypes
+import re
+import time
 import warnings
 import httplib
 import inspect
@@ -10,11 +14,15 @@ from django.conf.urls.defaults import patterns, url, include
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned, ValidationError
 from django.core.urlresolvers import NoReverseMatch, reverse, resolve, Resolver404, get_script_prefix
 from django.db.models.sql.constants import QUERY_TERMS, LOOKUP_SEP
+from django.db import router, transaction
 from django.db.models import Q
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.http import HttpResponse, HttpResponseNotFound, BadHeaderError
 from django.utils.cache import patch_cache_control
+from django.utils.encoding import smart_str
+from django.utils.http import http_date, urlquote
 from tastypie.authentication import Authentication
-from tastypie.authorization import ReadOnlyAuthorization
+from tastypie.authorization import AuthorizationContext, ReadOnlyAuthorization
 from tastypie.bundle import Bundle
 from tastypie.cache import NoCache
 from tastypie.constants import ALL, ALL_WITH_RELATIONS
@@ -22,13 +30,17 @@ from tastypie.exceptions import *
 from tastypie.fields import *
 from tastypie.http import *
 from tastypie.paginator import Paginator
-from tastypie.parsers import DEFAULT_PARSERS
+from tastypie.parsers import DEFAULT_PARSER_REGISTRY, ParserRegistry
 from tastypie.request import TastypieHTTPRequest
 from tastypie.response import Response, ErrorResponse
 from tastypie.serializers import Serializer
 from tastypie.throttle import BaseThrottle
-from tastypie.utils import as_tuple, cached_function, cached_property, is_valid_jsonp_callback_value, dict_strip_unicode_keys, trailing_slash
-from tastypie.utils.mime import determine_format, build_content_type
+from tastypie.uploads import parse_content_range, upload_owner
+from tastypie.utils import as_tuple, cached_function, cached_property, is_valid_jsonp_callback_value, dict_strip_unicode_keys, trailing_slash, LRUCache
+from tastypie.utils.caching import content_etag, static_response
+from tastypie.utils.compression import compress_response
+from tastypie.utils.files import UnsatisfiableRange, check_preconditions, content_disposition, file_etag, file_range_iterator, parse_byte_range, range_applies
+from tastypie.utils.mime import determine_format, build_content_type, media_type_matches
 from tastypie.validation import Validation
 try:
     set
@@ -70,7 +82,7 @@ class ResourceOptions(object):
     Provides sane defaults and the logic needed to augment these settings with
     the internal ``class Meta`` used on ``Resource`` subclasses.
     """
-    parsers = DEFAULT_PARSERS
+    parsers = DEFAULT_PARSER_REGISTRY
     serializer = Serializer()
     authentication = Authentication()
     authorization = ReadOnlyAuthorization()
@@ -98,6 +110,15 @@ class ResourceOptions(object):
     always_return_data = False
     set_url = True
     detail_url = True
+    compression_encodings = getattr(settings, 'TASTYPIE_COMPRESSION_ENCODINGS', ('gzip', 'deflate'))
+    compression_min_length = getattr(settings, 'TASTYPIE_COMPRESSION_MIN_LENGTH', 1024)
+    incremental_parsing = getattr(settings, 'TASTYPIE_INCREMENTAL_PARSING', False)
+    batch_writes = False
+    upload_store = None
+    file_downloads = False
+    sendfile_header = getattr(settings, 'TASTYPIE_SENDFILE_HEADER', None)
+    sendfile_prefix = getattr(settings, 'TASTYPIE_SENDFILE_PREFIX', '/protected/')
+    throttle_costs = {}
     
     def __new__(cls, meta=None):
         overrides = {}
@@ -123,6 +144,10 @@ class ResourceOptions(object):
         if overrides.get('related_detail_allowed_methods', None) is None:
             overrides['related_detail_allowed_methods'] = overrides['detail_allowed_methods']
         
+        # Allow a plain list/tuple of parsers, but resolve through a registry.
+        if overrides.get('parsers', None) is not None and not isinstance(overrides['parsers'], ParserRegistry):
+            overrides['parsers'] = ParserRegistry(as_tuple(overrides['parsers']))
+        
         return object.__new__(type('ResourceOptions', (cls,), overrides))
 
 class DeclarativeMetaclass(type):
@@ -250,7 +275,7 @@ class Resource(object):
         for (key, val) in response.items():
             resp[key] = val
 
-        return resp
+        return self.compress_response(request, resp)
     
     def format_error(self, e):
         """
@@ -415,6 +440,10 @@ class Resource(object):
         urls.extend(as_tuple(self.list_url()))
         
         urls.append(self.url(r"/schema", self.wrap_view('get_schema'), name="api_get_schema"))
+        
+        if self._meta.upload_store is not None:
+            urls.append(self.url(r"/uploads", self.wrap_view('dispatch_upload'), name="api_dispatch_upload_list"))
+            urls.append(self.url(r"/uploads/(?P<upload_id>[0-9a-f]{32})", self.wrap_view('dispatch_upload'), name="api_dispatch_upload"))
  
         if self._meta.detail_url:
             urls.extend(self.nest(r"/(?P<pk>\w[\w-]*)", self.wrap_view('dispatch_detail'), name="api_dispatch_detail"))
@@ -446,7 +475,21 @@ class Resource(object):
         """
         Function collecting nested urls under the detail view together
         """
-        return patterns('', *(self.related_urls() + self.detail_actions()))
+        return patterns('', *(self.related_urls() + self.download_urls() + self.detail_actions()))
+    
+    def download_urls(self):
+        """
+        Download urls for the file fields, if ``Meta.file_downloads`` is set.
+        """
+        if not self._meta.file_downloads:
+            return []
+        
+        names = [re.escape(name) for name, field in self.fields.items() if isinstance(field, FileField)]
+        
+        if not names:
+            return []
+        
+        return [self.url(r"(?P<file_field>%s)/download" % '|'.join(names), self.wrap_view('dispatch_download'), name="api_dispatch_download")]
 
     def override_urls(self):
         """
@@ -489,6 +532,138 @@ class Resource(object):
         
         return self.dispatch('related_%s' % type, request, related_field=related_field, obj=obj, **kwargs)
     
+    def dispatch_download(self, request, file_field, **kwargs):
+        """
+        A view for downloading the file held in a file field of a single
+        resource. Only responds to HTTP GET & HEAD.
+        
+        Relies on ``serve_file`` for the heavy-lifting.
+        """
+        self.method_check(request, allowed=['get', 'head'], action='download')
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        
+        try:
+            obj = self.cached_obj_get(request=request, **self.remove_api_resource_names(kwargs))
+        except ObjectDoesNotExist:
+            return HttpNotFound()
+        except MultipleObjectsReturned:
+            return HttpMultipleChoices("More than one resource is found at this URI.")
+        
+        field = self.fields[file_field]
+        field_file = field.attribute and getattr(obj, field.attribute, None)
+        
+        if not field_file:
+            return HttpNotFound()
+        
+        response = self.serve_file(request, field_file)
+        self.log_throttled_access(request)
+        return response
+    
+    def serve_file(self, request, field_file):
+        """
+        Builds the response for a download of a stored file.
+        
+        Answers conditional requests (``If-None-Match``, ``If-Modified-Since``
+        & friends) with ``304``/``412`` responses, based on an ``ETag`` and
+        ``Last-Modified`` date derived from the file's name, size &
+        modification time, so the file itself is never read to do so.
+        
+        If ``Meta.sendfile_header`` is set, the transfer is handed over to the
+        front-end server, which also takes care of ``Range`` requests:
+        ``X-Accel-Redirect`` (nginx) gets ``Meta.sendfile_prefix`` followed by
+        the name of the file in storage, other headers (``X-Sendfile`` for
+        Apache/lighttpd) get its path on disk. Otherwise, the file (or the
+        requested range of it) is streamed.
+        """
+        storage = field_file.storage
+        name = field_file.name
+        
+        try:
+            size = field_file.size
+        except (IOError, OSError):
+            return HttpNotFound()
+        
+        try:
+            modified = time.mktime(storage.modified_time(name).timetuple())
+        except (NotImplementedError, IOError, OSError):
+            modified = None
+        
+        etag = file_etag(name, size, modified)
+        status = check_preconditions(request, etag, modified)
+        
+        if status == httplib.NOT_MODIFIED:
+            response = HttpNotModified()
+        elif status is not None:
+            response = HttpResponse(status=status)
+        else:
+            response = None
+        
+        if response is None:
+            response = self.file_response(request, field_file, size, etag, modified)
+        
+        response['ETag'] = etag
+        
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+        
+        return response
+    
+    def file_response(self, request, field_file, size, etag, modified):
+        """
+        Builds the response carrying the content (or a range of it) of a
+        stored file, or delegating it to the front-end server.
+        """
+        storage = field_file.storage
+        name = field_file.name
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        sendfile_header = self._meta.sendfile_header
+        sendfile_value = None
+        
+        if sendfile_header:
+            if sendfile_header.lower() == 'x-accel-redirect':
+                sendfile_value = '%s/%s' % (self._meta.sendfile_prefix.rstrip('/'), urlquote(name))
+            else:
+                try:
+                    sendfile_value = smart_str(storage.path(name))
+                except NotImplementedError:
+                    # Not on the local filesystem. Nothing to hand over.
+                    sendfile_value = None
+        
+        if sendfile_value is not None:
+            response = HttpResponse('', content_type=content_type)
+            response[sendfile_header] = sendfile_value
+        else:
+            try:
+                if range_applies(request, etag, modified):
+                    byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), size)
+                else:
+                    byte_range = None
+            except UnsatisfiableRange:
+                response = HttpResponse(status=httplib.REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = 'bytes */%d' % size
+                return response
+            
+            if byte_range is None:
+                start, length, status = 0, size, httplib.OK
+            else:
+                start, length, status = byte_range[0], byte_range[1] - byte_range[0] + 1, httplib.PARTIAL_CONTENT
+            
+            if request.method == 'HEAD' or length == 0:
+                content = ''
+            else:
+                content = file_range_iterator(storage.open(name, 'rb'), start, length)
+            
+            response = HttpResponse(content, content_type=content_type, status=status)
+            response['Content-Length'] = str(length)
+            
+            if byte_range is not None:
+                response['Content-Range'] = 'bytes %d-%d/%d' % (byte_range[0], byte_range[1], size)
+        
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = content_disposition(name)
+        return response
+    
     def get_related_detail(self, request, related_field, obj, **kwargs):
         """
         Get a single related object
@@ -571,6 +746,15 @@ class Resource(object):
         
         return self._meta.serializer.serialize(data, format, options)
     
+    def determine_parser(self, content_type):
+        """
+        Used to determine the parser for a given content type.
+        
+        Relies on the ``ParserRegistry`` in ``Resource._meta.parsers``, which
+        caches the resolution, but here as a point of extension.
+        """
+        return self._meta.parsers.resolve(content_type)
+    
     def deserialize(self, request):
         """
         Given a request, data and a format, deserializes the given data.
@@ -578,22 +762,42 @@ class Resource(object):
         It relies on the request properly sending a ``CONTENT_TYPE`` header,
         falling back to ``application/json`` if not provided.
         
-        Mostly a hook, this uses the ``Serializer`` from ``Resource._meta``.
+        Mostly a hook, this uses the parsers from ``Resource._meta``.
         """
-        print "deserialize"
-        print request.DATA
         data = as_tuple(request.DATA or request)
-
+        content_type = request.META.get('CONTENT_TYPE', 'application/json')
+        
         for item in data:
             content_type = item.META.get('CONTENT_TYPE', 'application/json')
+            parser = self.determine_parser(content_type)
+            
+            if parser is not None:
+                return parser.parse(item, request=request)
         
-            parsers = as_tuple(self._meta.parsers)            
+        raise UnsupportedFormat("The format indicated '%s' had no available parser. Please check ``parsers`` in your Resource." % content_type)
+    
+    def deserialize_list(self, request, key='objects'):
+        """
+        Given a request, returns an iterator over the items of the list found
+        under ``key`` in its body.
+        
+        Parsers capable of it (such as the ``JSONParser``) produce each item
+        as soon as it has been read from the body, rather than parsing the
+        whole body up front. Raises ``BadRequest`` if the body holds no such
+        list.
+        
+        Mostly a hook, this uses the parsers from ``Resource._meta``.
+        """
+        data = as_tuple(request.DATA or request)
+        content_type = request.META.get('CONTENT_TYPE', 'application/json')
+        
+        for item in data:
+            content_type = item.META.get('CONTENT_TYPE', 'application/json')
+            parser = self.determine_parser(content_type)
+            
+            if parser is not None:
+                return parser.iterparse(item, key=key, request=request)
         
-            for parser_cls in parsers:
-                parser = parser_cls()
-                if parser.can_handle_request(content_type):
-                    return parser.parse(item, request=request)
-
         raise UnsupportedFormat("The format indicated '%s' had no available parser. Please check ``parsers`` in your Resource." % content_type)
     
     def alter_list_data_to_serialize(self, request, data):
@@ -681,7 +885,7 @@ class Resource(object):
         
         self.is_authenticated(request)
         #self.is_authorized(request)
-        self.throttle_check(request)
+        self.throttle_check(request, request_type)
         
         print "CONVERT"
         # All clear. Process the request.
@@ -690,7 +894,7 @@ class Resource(object):
         response = method(request, **kwargs)
         
         # Add the throttled request.
-        self.log_throttled_access(request)
+        self.log_throttled_access(request, request_type)
         
         # If what comes back isn't a ``HttpResponse``, assume that the
         # request was accepted and that some action occurred. This also
@@ -812,29 +1016,161 @@ class Resource(object):
         if not auth_result is True:
             raise ImmediateHttpResponse(response=HttpUnauthorized())
     
-    def throttle_check(self, request):
+    def throttle_check(self, request, request_type=None):
         """
         Handles checking if the user should be throttled.
         
         Mostly a hook, this uses class assigned to ``throttle`` from
-        ``Resource._meta``.
+        ``Resource._meta``, charging the request's ``throttle_cost``.
         """
         identifier = self._meta.authentication.get_identifier(request)
         
         # Check to see if they should be throttled.
-        if self._meta.throttle.should_be_throttled(identifier):
+        if self._meta.throttle.should_be_throttled(identifier, cost=self.throttle_cost(request, request_type)):
             # Throttle limit exceeded.
             raise ImmediateHttpResponse(response=HttpForbidden())
     
-    def log_throttled_access(self, request):
+    def log_throttled_access(self, request, request_type=None):
         """
         Handles the recording of the user's access for throttling purposes.
         
         Mostly a hook, this uses class assigned to ``throttle`` from
-        ``Resource._meta``.
+        ``Resource._meta``, charging the request's ``throttle_cost``.
         """
         request_method = request.method.lower()
-        self._meta.throttle.accessed(self._meta.authentication.get_identifier(request), url=request.get_full_path(), request_method=request_method)
+        self._meta.throttle.accessed(self._meta.authentication.get_identifier(request), url=request.get_full_path(), request_method=request_method, cost=self.throttle_cost(request, request_type))
+    
+    def throttle_cost(self, request, request_type=None):
+        """
+        Returns how much of the user's throttle budget a request uses up.
+        
+        Looks the cost up in ``Meta.throttle_costs``, by the name of the view
+        method (such as ``get_list`` or ``put_detail``), then by the HTTP
+        method alone. Costs are either numbers or the name of a method of the
+        resource, which is given the request & returns the cost (such as
+        ``estimate_list_cost``). Default is 1.
+        """
+        costs = self._meta.throttle_costs
+        
+        if not costs:
+            return 1
+        
+        request_method = request.method.lower()
+        cost = None
+        
+        if request_type is not None:
+            cost = costs.get("%s_%s" % (request_method, request_type))
+        
+        if cost is None:
+            cost = costs.get(request_method, 1)
+        
+        if isinstance(cost, basestring):
+            cost = getattr(self, cost)(request)
+        
+        return max(int(cost), 1)
+    
+    def estimate_list_cost(self, request):
+        """
+        Estimates the cost of a list request from the number of objects asked
+        for, relative to a page of ``Meta.limit`` objects, and the number of
+        related resources fully included with each of them.
+        
+        A default page of objects without full related resources costs 1.
+        Unbounded requests (``limit=0``) are charged for every object in the
+        list, counted with ``count_objects`` so that the paginator can reuse
+        the count.
+        """
+        try:
+            limit = int(request.GET.get('limit', self._meta.limit))
+        except (TypeError, ValueError):
+            limit = self._meta.limit
+        
+        if limit <= 0:
+            # Everything.
+            try:
+                limit = self.count_objects(request, self.obj_get_list(request=request))
+            except (NotImplementedError, AttributeError, TypeError, BadRequest):
+                limit = self._meta.limit
+        
+        page = max(int(self._meta.limit or 20), 1)
+        objects = max(limit, 1) * (1 + self.full_related_weight())
+        return max(int(math.ceil(objects / float(page))), 1)
+    
+    def count_objects(self, request, objects):
+        """
+        Returns the number of ``objects``, remembering it for the rest of the
+        request.
+        
+        Querysets are remembered by their SQL, so the same list is only
+        counted once, however many times it's asked for.
+        """
+        memo = getattr(request, '_tastypie_counts', None)
+        
+        if memo is None:
+            memo = {}
+            
+            try:
+                request._tastypie_counts = memo
+            except AttributeError:
+                pass
+        
+        key = self._count_key(objects)
+        
+        if key is not None and key in memo:
+            return memo[key]
+        
+        try:
+            count = objects.count()
+        except (AttributeError, TypeError):
+            # If it's not a QuerySet (or it's ilk), fallback to ``len``.
+            count = len(objects)
+        
+        if key is not None:
+            memo[key] = count
+        
+        return count
+    
+    def remembered_count(self, request, objects):
+        """
+        Returns the number of ``objects`` if ``count_objects`` already counted
+        them during this request, or ``None``.
+        """
+        key = self._count_key(objects)
+        
+        if key is None:
+            return None
+        
+        return getattr(request, '_tastypie_counts', {}).get(key)
+    
+    def _count_key(self, objects):
+        try:
+            return (self._meta.resource_name, str(objects.query))
+        except (AttributeError, EmptyResultSet):
+            return None
+    
+    def full_related_weight(self, depth=3):
+        """
+        Returns the number of related resources fully dehydrated along with
+        each object, following them down to ``depth`` levels of nesting.
+        """
+        weights = self.__dict__.setdefault('_full_related_weights', {})
+        
+        if depth in weights:
+            return weights[depth]
+        
+        weight = 0
+        
+        if depth > 0:
+            for field in self.fields.values():
+                if getattr(field, 'is_related', False) and getattr(field, 'full', False):
+                    weight += 1
+                    related = field.to_class
+                    
+                    if related is not None and hasattr(related, 'base_fields'):
+                        weight += related().full_related_weight(depth - 1)
+        
+        weights[depth] = weight
+        return weight
     
     def build_bundle(self, obj=None, data=None, request=None):
         """
@@ -1129,41 +1465,75 @@ class Resource(object):
     def apply_authorization_limits(self, request, object_list):
         """
         Allows the ``Authorization`` class to further limit the object list.
+        
+        The limits from ``get_limits`` are only worked out once per request,
+        and are applied as a filter, so lists, updates & deletes are limited
+        in the same query. Any ``apply_limits`` methods are called after.
+        """
+        if request is None:
+            q = self.authorization_limits(request)
+        else:
+            q = AuthorizationContext.for_request(request).limits(id(self), lambda: self.authorization_limits(request))
+        
+        if q is False:
+            return object_list.none()
+        
+        if isinstance(q, Q):
+            object_list = object_list.filter(q)
+        
+        for authorizer in as_tuple(self._meta.authorization):
+            if hasattr(authorizer, 'apply_limits'):
+                object_list = authorizer.apply_limits(request, object_list)
+        
+        return object_list
+    
+    def authorization_limits(self, request):
+        """
+        Combines the limits of the ``Authorization`` classes, returning
+        ``True``/``None`` (no limits), ``False`` (nothing allowed) or a ``Q``.
+        
+        ``get_limits`` may return any of those, or an ``(and, or)`` pair of
+        them: limits every object must meet, and limits any of which will do.
         """
         authorizers = as_tuple(self._meta.authorization)
         
         _and, _or = None, None
         
         def q_and(x, y):
-            if isinstance(x, Q) and isinstance(y, Q):
-                return x & y
-            else:
-                return x or y
+            if x is None or x is True:
+                return y if y is not None else x
+            
+            if y is None or y is True:
+                return x
+            
+            if x is False or y is False:
+                return False
+            
+            return x & y
         
         def q_or(x, y):
-            if isinstance(x, Q) and isinstance(y, Q):
-                return x | y
-            else:
-                return x or y
+            if x is None or x is False:
+                return y if y is not None else x
+            
+            if y is None or y is False:
+                return x
+            
+            if x is True or y is True:
+                return True
+            
+            return x | y
         
         for authorizer in authorizers:
             if hasattr(authorizer, 'get_limits'):
                 limits = authorizer.get_limits(request, _and, _or)
-                if not hasattr(limits, '_iter_'):
+                
+                if not isinstance(limits, tuple):
                     limits = (limits, limits)
+                
                 auth_and, auth_or = limits
                 _and, _or = q_and(_and, auth_and), q_or(_or, auth_or) 
         
-        q = q_and(_and, _or)
-        
-        if q is False:
-            return object_list.none()    
-        elif q is True or q is None:
-            return object_list
-        else:
-            return object_list.get(q)
-        
-        return object_list.get(q)
+        return q_and(_and, _or)
     
     def can_create(self):
         """
@@ -1303,7 +1673,19 @@ class Resource(object):
         """
         desired_format = self.determine_format(request)
         serialized = self.serialize(request, data, desired_format)
-        return response_class(content=serialized, content_type=build_content_type(desired_format), **response_kwargs)
+        response = response_class(content=serialized, content_type=build_content_type(desired_format), **response_kwargs)
+        return self.compress_response(request, response)
+    
+    def compress_response(self, request, response):
+        """
+        Applies ``gzip``/``deflate`` content coding to the response, based on
+        the ``Accept-Encoding`` header of the request.
+        
+        Only bodies of at least ``Meta.compression_min_length`` bytes are
+        compressed. Set ``Meta.compression_encodings`` to an empty tuple to
+        disable compression (i.e. if a front-end server already handles it).
+        """
+        return compress_response(request, response, encodings=self._meta.compression_encodings, min_length=self._meta.compression_min_length)
     
     def is_valid(self, bundle, request=None):
         """
@@ -1357,6 +1739,8 @@ class Resource(object):
         sorted_objects = self.apply_sorting(objects, options=request.GET)
         
         paginator = self._meta.paginator_class(request.GET, sorted_objects, resource_uri=self.get_resource_list_uri(), limit=self._meta.limit)
+        # Don't count the objects again if estimating the cost already did.
+        paginator.count = self.remembered_count(request, objects)
         to_be_serialized = paginator.page()
         
         # Dehydrate the bundles in preparation for serialization.
@@ -1398,30 +1782,72 @@ class Resource(object):
         
         Return ``HttpAccepted`` (202 Accepted) if
         ``Meta.always_return_data = True``.
+        
+        If ``Meta.incremental_parsing = True``, objects are validated and
+        created as they are read from the body (see ``deserialize_list``)
+        and ``alter_deserialized_list_data`` is not called. The collection is
+        deleted before the body has been read, so if it turns out to be bad,
+        only the objects created from it can be removed (via ``rollback``).
+        ``ModelResource`` runs the whole replacement in a single database
+        transaction instead.
+        
+        If ``Meta.batch_writes = True``, ``multipart/mixed`` requests are
+        handled by ``batch_write`` instead.
         """
-        print "PUT LIST"
-        deserialized = self.deserialize(request)
-        deserialized = self.alter_deserialized_list_data(request, deserialized)
+        if self.is_batch_request(request):
+            return self.batch_write(request, **kwargs)
+        
+        return self._replace_list(request, rollback=True, **kwargs)
+    
+    def _replace_list(self, request, rollback=True, **kwargs):
+        # The bundles created are only kept if they're to be returned or
+        # ``rollback`` may need them, so incremental parsing stays in bounded
+        # memory (as long as something else, such as a transaction, cleans up).
+        keep_bundles = rollback or self._meta.always_return_data
         
-        if not 'objects' in deserialized:
-            raise BadRequest("Invalid data sent.")
+        if self._meta.incremental_parsing:
+            objects = self.deserialize_list(request)
+        else:
+            deserialized = self.deserialize(request)
+            deserialized = self.alter_deserialized_list_data(request, deserialized)
+            
+            if not 'objects' in deserialized:
+                raise BadRequest("Invalid data sent.")
+            
+            objects = deserialized['objects']
         
         self.obj_delete_list(request=request, **self.remove_api_resource_names(kwargs))
         bundles_seen = []
+        objects = iter(objects)
         
-        for object_data in deserialized['objects']:
+        while True:
+            # Attempt to be transactional, deleting any previously created
+            # objects if validation (or, when parsing incrementally, the
+            # rest of the body) fails.
+            try:
+                object_data = objects.next()
+            except StopIteration:
+                break
+            except TastypieError:
+                if rollback:
+                    self.rollback(bundles_seen)
+                
+                raise
+            
             bundle = self.build_bundle(data=dict_strip_unicode_keys(object_data), request=request)
             
-            # Attempt to be transactional, deleting any previously created
-            # objects if validation fails.
             try:
                 self.is_valid(bundle, request)
             except ImmediateHttpResponse:
-                self.rollback(bundles_seen)
+                if rollback:
+                    self.rollback(bundles_seen)
+                
                 raise
             
             self.obj_create(bundle, request=request, **self.remove_api_resource_names(kwargs))
-            bundles_seen.append(bundle)
+            
+            if keep_bundles:
+                bundles_seen.append(bundle)
         
         if not self._meta.always_return_data:
             return HttpNoContent()
@@ -1492,7 +1918,13 @@ class Resource(object):
         If a new resource is created, return ``HttpCreated`` (201 Created).
         If ``Meta.always_return_data = True``, there will be a populated body
         of serialized data.
+        
+        If ``Meta.batch_writes = True``, ``multipart/mixed`` requests are
+        handled by ``batch_write`` instead.
         """
+        if self.is_batch_request(request):
+            return self.batch_write(request, **kwargs)
+        
         deserialized = self.deserialize(request)
         deserialized = self.alter_deserialized_detail_data(request, deserialized)
         bundle = self.build_bundle(data=dict_strip_unicode_keys(deserialized), request=request)
@@ -1518,6 +1950,111 @@ class Resource(object):
         """
         raise TastypieError('Post to detail not implemented', status=httplib.NOT_IMPLEMENTED)
     
+    def is_batch_request(self, request):
+        """
+        Checks whether the request is a batch write, i.e. a ``multipart/mixed``
+        body sent to a resource with ``Meta.batch_writes = True``.
+        """
+        if not self._meta.batch_writes:
+            return False
+        
+        return media_type_matches('multipart/mixed', request.META.get('CONTENT_TYPE', ''))
+    
+    def batch_write(self, request, **kwargs):
+        """
+        Writes every part of a ``multipart/mixed`` body as an object of its
+        own, all or nothing.
+        
+        Each part is deserialized according to its own ``Content-Type`` and
+        validated, then passed to ``obj_create``. On ``PUT``, parts with a
+        ``Content-Location`` header (the URI of an existing resource) are
+        passed to ``obj_update`` instead.
+        
+        As soon as one part fails, the rest are skipped and ``rollback`` is
+        called with the bundles created so far. ``ModelResource`` also runs
+        the whole batch in a single database transaction.
+        
+        The response lists the outcome of each part, in order, under
+        ``objects``: its ``status`` (and its ``content_id`` if the part had a
+        ``Content-ID`` header), plus the ``location`` of the written object
+        or the ``message``/``errors`` explaining a failure. Parts that were
+        skipped or rolled back are reported as ``424 Failed Dependency``.
+        
+        Returns ``HttpResponse`` (200 OK) if every part was written, or a
+        response with the status of the failed part otherwise.
+        """
+        kwargs = self.remove_api_resource_names(kwargs)
+        results = []
+        bundles_created = []
+        failed = None
+        
+        for part in as_tuple(request.DATA):
+            result = {}
+            results.append(result)
+            
+            if part.has_header('content-id'):
+                result['content_id'] = part['content-id']
+            
+            if failed is not None:
+                result['status'] = httplib.FAILED_DEPENDENCY
+                continue
+            
+            try:
+                bundle = self.build_batch_bundle(request, part)
+                errors = self._meta.validation.is_valid(bundle, request)
+                
+                if errors:
+                    failed = httplib.BAD_REQUEST
+                    result.update({'status': failed, 'errors': errors})
+                    continue
+                
+                if request.method == 'PUT' and part.has_header('content-location'):
+                    bundle.obj = self.get_via_uri(part['content-location'])
+                    bundle = self.obj_update(bundle, request=request, **kwargs)
+                    result['status'] = httplib.ACCEPTED
+                else:
+                    bundle = self.obj_create(bundle, request=request, **kwargs)
+                    bundles_created.append(bundle)
+                    result['status'] = httplib.CREATED
+                
+                result['location'] = self.get_resource_uri(bundle)
+            except Exception, e:
+                error = self.handle_error(request, e)
+                
+                if error is None:
+                    self.rollback(bundles_created)
+                    raise
+                
+                failed = error.status_code
+                result.update({'status': failed, 'message': error.message})
+        
+        if failed is None:
+            return self.create_response(request, {'objects': results})
+        
+        self.rollback(bundles_created)
+        
+        for result in results:
+            if result['status'] < 400:
+                result['status'] = httplib.FAILED_DEPENDENCY
+                del(result['location'])
+        
+        return self.create_response(request, {'objects': results}, status=failed)
+    
+    def build_batch_bundle(self, request, part):
+        """
+        Given a part of a batch write, deserializes it according to its own
+        ``Content-Type`` and builds a bundle of the data.
+        """
+        content_type = part.META.get('CONTENT_TYPE', 'application/json')
+        parser = self.determine_parser(content_type)
+        
+        if parser is None:
+            raise UnsupportedFormat("The format indicated '%s' had no available parser. Please check ``parsers`` in your Resource." % content_type)
+        
+        deserialized = parser.parse(part, request=request)
+        deserialized = self.alter_deserialized_detail_data(request, deserialized)
+        return self.build_bundle(data=dict_strip_unicode_keys(deserialized), request=request)
+    
     def delete_list(self, request, **kwargs):
         """
         Destroys a collection of resources/objects.
@@ -1557,7 +2094,217 @@ class Resource(object):
         self.is_authenticated(request)
         self.throttle_check(request)
         self.log_throttled_access(request)
-        return self.create_response(request, self.build_schema())
+        
+        # The schema only changes with the code, so it's serialized once (per
+        # format) and served with an ``ETag`` & ``Cache-Control``.
+        desired_format = self.determine_format(request)
+        callback = None
+        
+        if 'text/javascript' in desired_format:
+            callback = request.GET.get('callback', 'callback')
+        
+        try:
+            serialized, etag = self._schema_responses[(desired_format, callback)]
+        except KeyError:
+            serialized = self.serialize(request, self.build_schema(), desired_format)
+            etag = content_etag(serialized)
+            self._schema_responses[(desired_format, callback)] = (serialized, etag)
+        
+        # Anything but the no-op default means the schema is per-user, as far
+        # as shared caches are concerned.
+        private = type(self._meta.authentication) is not Authentication
+        response = static_response(request, serialized, build_content_type(desired_format), etag=etag, private=private)
+        return self.compress_response(request, response)
+    
+    @cached_property
+    def _schema_responses(self):
+        return LRUCache(max_size=16)
+    
+    def dispatch_upload(self, request, upload_id=None, **kwargs):
+        """
+        A view for resumable uploads (see ``tastypie.uploads``), enabled by
+        setting ``Meta.upload_store``.
+        
+        ``POST`` to the list endpoint starts an upload. ``GET`` on an upload
+        reports how much of it has been received, ``PUT`` sends a byte range
+        of it and ``DELETE`` discards it.
+        """
+        self.wrap_request(request)
+        
+        if upload_id is None:
+            allowed = ['post']
+        else:
+            allowed = ['get', 'put', 'delete']
+        
+        request_method = self.method_check(request, allowed=allowed, action='upload')
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        owner = upload_owner(request, self._meta.authentication)
+        
+        if upload_id is None:
+            response = self.create_upload(request, owner)
+        else:
+            session = self._meta.upload_store.get(upload_id, owner=owner)
+            response = getattr(self, '%s_upload' % request_method)(request, session)
+        
+        self.log_throttled_access(request)
+        return response
+    
+    def discard_uploads(self, bundle, request=None):
+        """
+        Closes & discards the resumable uploads used by a bundle, once its
+        object has been saved (& so has its own copy of them).
+        
+        Between ``defer_upload_discards`` & ``end_upload_discards`` (such as
+        within a ``put_list`` or ``batch_write`` transaction), they're only
+        closed, then discarded at the end, so the client can retry with them
+        if the transaction is rolled back.
+        """
+        for upload_file in bundle.upload_files:
+            upload_file.close()
+        
+        deferred = getattr(request or bundle.request, '_tastypie_deferred_uploads', None)
+        
+        if deferred is None:
+            for session in bundle.uploads:
+                self._meta.upload_store.delete(session)
+        else:
+            deferred.extend(bundle.uploads)
+        
+        bundle.uploads = []
+        bundle.upload_files = []
+    
+    def defer_upload_discards(self, request):
+        """
+        Holds the uploads ``discard_uploads`` is given for ``request`` back,
+        until ``end_upload_discards``.
+        """
+        request._tastypie_deferred_uploads = []
+    
+    def end_upload_discards(self, request, discard=True):
+        """
+        Discards the uploads held back since ``defer_upload_discards`` (or,
+        with ``discard=False``, such as after a rollback, keeps them).
+        """
+        sessions = request.__dict__.pop('_tastypie_deferred_uploads', [])
+        
+        if discard:
+            for session in sessions:
+                self._meta.upload_store.delete(session)
+    
+    def get_upload_uri(self, session):
+        """
+        Returns the URI of an upload session.
+        """
+        kwargs = {
+            'resource_name': self._meta.resource_name,
+            'upload_id': session.id,
+        }
+        
+        if self._meta.api_name is not None:
+            kwargs['api_name'] = self._meta.api_name
+        
+        return self._build_reverse_url("api_dispatch_upload", kwargs=kwargs)
+    
+    def upload_response(self, request, session, response_class=HttpResponse, **response_kwargs):
+        """
+        Serializes the state of an upload session. The bytes received so far
+        are also reported in a ``Range`` header.
+        """
+        data = {
+            'id': session.id,
+            'filename': session.filename,
+            'content_type': session.content_type,
+            'size': session.size,
+            'offset': session.offset,
+            'complete': session.complete,
+            'resource_uri': self.get_upload_uri(session),
+        }
+        response = self.create_response(request, data, response_class=response_class, **response_kwargs)
+        
+        if session.offset:
+            response['Range'] = 'bytes=0-%d' % (session.offset - 1)
+        
+        return response
+    
+    def create_upload(self, request, owner):
+        """
+        Starts an upload, given the (optional) ``filename``, ``size`` and
+        ``content_type`` of the file in the body.
+        
+        Returns ``HttpCreated`` (201 Created), with the location of the upload.
+        """
+        details = {}
+        
+        if request.META.get('CONTENT_LENGTH') not in (None, '', '0'):
+            details = self.deserialize(request)
+        
+        if not isinstance(details, dict):
+            raise BadRequest("The details of an upload must be an object.")
+        
+        size = details.get('size')
+        
+        if size is not None:
+            try:
+                size = int(size)
+            except (TypeError, ValueError):
+                raise BadRequest("The size of an upload must be an integer.")
+            
+            if size < 0:
+                raise BadRequest("The size of an upload must be positive.")
+        
+        session = self._meta.upload_store.create(filename=details.get('filename', ''), size=size, content_type=details.get('content_type', ''), owner=owner)
+        return self.upload_response(request, session, response_class=HttpCreated, location=self.get_upload_uri(session))
+    
+    def get_upload(self, request, session):
+        """
+        Reports how much of an upload has been received.
+        
+        Should return a HttpResponse (200 OK).
+        """
+        return self.upload_response(request, session)
+    
+    def put_upload(self, request, session):
+        """
+        Writes the byte range given by the ``Content-Range`` header to an
+        upload. The range has to start where the upload left off.
+        
+        Returns ``HttpResponse`` (200 OK) with the new state of the upload, or
+        ``HttpConflict`` (409 Conflict) if the range doesn't start at the
+        number of bytes received so far or didn't make it in full. Either
+        way, the client should carry on from the ``offset`` reported.
+        """
+        store = self._meta.upload_store
+        start, end, total = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+        
+        if total is not None and total != session.size:
+            if session.size is not None:
+                raise BadRequest("The size of this upload is %s bytes, not %s." % (session.size, total))
+            
+            store.check_size(total)
+            session.size = total
+            store.update(session)
+        
+        if start != session.offset:
+            return self.upload_response(request, session, response_class=HttpConflict)
+        
+        session = store.write(session, start, request, end - start + 1)
+        
+        if session.offset != end + 1:
+            # Only part of the range made it (the request body was shorter
+            # than announced), or another request got there first.
+            return self.upload_response(request, session, response_class=HttpConflict)
+        
+        return self.upload_response(request, session)
+    
+    def delete_upload(self, request, session):
+        """
+        Discards an upload.
+        
+        Returns ``HttpNoContent`` (204 No Content).
+        """
+        self._meta.upload_store.delete(session)
+        return HttpNoContent()
     
     def get_multiple(self, request, **kwargs):
         """
@@ -1969,6 +2716,16 @@ class ModelResource(Resource):
         except ValueError, e:
             raise BadRequest("Invalid resource lookup data provided (mismatched type).")
     
+    def object_exists(self, **kwargs):
+        """
+        Checks whether any object matches ``kwargs``, regardless of the
+        authorization limits.
+        """
+        try:
+            return self._meta.object_class._default_manager.filter(**kwargs).exists()
+        except (ValueError, TypeError):
+            return False
+    
     def obj_create(self, bundle, request=None, **kwargs):
         """
         A ORM-specific implementation of ``obj_create``.
@@ -1989,6 +2746,7 @@ class ModelResource(Resource):
         # Now pick up the M2M bits.
         m2m_bundle = self.hydrate_m2m(bundle, request)
         self.save_m2m(m2m_bundle)
+        self.discard_uploads(bundle, request)
         return bundle
     
     def obj_update(self, bundle, request=None, **kwargs):
@@ -2023,6 +2781,12 @@ class ModelResource(Resource):
                 bundle.obj = self.obj_get(request, **lookup_kwargs)
             except ObjectDoesNotExist:
                 print "Does not exist?"
+                
+                # Hidden by the authorization limits isn't the same as missing,
+                # or ``put_detail`` would create it over someone else's object.
+                if self.object_exists(**lookup_kwargs):
+                    raise Unauthorized("You are not allowed to update this object.")
+                
                 raise NotFound("A model instance matching the provided arguments could not be found.")
         
         print "check auth"
@@ -2043,6 +2807,7 @@ class ModelResource(Resource):
         # Now pick up the M2M bits.
         m2m_bundle = self.hydrate_m2m(bundle, request)
         self.save_m2m(m2m_bundle)
+        self.discard_uploads(bundle, request)
         return bundle
     
     def obj_delete_list(self, request=None, **kwargs):
@@ -2059,7 +2824,7 @@ class ModelResource(Resource):
             authed_object_list.delete()
         else:
             for authed_obj in authed_object_list:
-                authed_object_list.delete()
+                authed_obj.delete()
     
     def obj_delete(self, request=None, **kwargs):
         """
@@ -2068,15 +2833,74 @@ class ModelResource(Resource):
         Takes optional ``kwargs``, which are used to narrow the query to find
         the instance.
         """
-        if not object:
-            try:
-                object = self.obj_get(request, **kwargs)
-            except ObjectDoesNotExist:
-                raise NotFound("A model instance matching the provided arguments could not be found.")
+        try:
+            obj = self.obj_get(request, **kwargs)
+        except ObjectDoesNotExist:
+            raise NotFound("A model instance matching the provided arguments could not be found.")
+        
+        self.is_authorized(request, obj)
+        
+        obj.delete()
+    
+    def put_list(self, request, **kwargs):
+        """
+        A ORM-specific implementation of ``put_list``, which deletes &
+        re-creates the collection in a single database transaction, so a
+        failure part-way through (such as a body that's cut short while
+        parsing incrementally) leaves it as it was.
         
-        self.is_authorized(request, object)
+        As the transaction takes care of that, the objects created aren't
+        kept around for ``rollback`` (only for ``Meta.always_return_data``).
+        """
+        if self.is_batch_request(request):
+            return self.batch_write(request, **kwargs)
+        
+        using = router.db_for_write(self._meta.object_class)
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+        self.defer_upload_discards(request)
         
-        object.delete()
+        try:
+            try:
+                response = self._replace_list(request, rollback=False, **kwargs)
+            except:
+                transaction.rollback(using=using)
+                raise
+            
+            transaction.commit(using=using)
+            self.end_upload_discards(request)
+            return response
+        finally:
+            transaction.leave_transaction_management(using=using)
+            self.end_upload_discards(request, discard=False)
+    
+    def batch_write(self, request, **kwargs):
+        """
+        A ORM-specific implementation of ``batch_write``, which runs the whole
+        batch in a single database transaction.
+        """
+        using = router.db_for_write(self._meta.object_class)
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+        self.defer_upload_discards(request)
+        
+        try:
+            try:
+                response = super(ModelResource, self).batch_write(request, **kwargs)
+            except:
+                transaction.rollback(using=using)
+                raise
+            
+            if response.status_code < 400:
+                transaction.commit(using=using)
+                self.end_upload_discards(request)
+            else:
+                transaction.rollback(using=using)
+            
+            return response
+        finally:
+            transaction.leave_transaction_management(using=using)
+            self.end_upload_discards(request, discard=False)
     
     def rollback(self, bundles):
         """
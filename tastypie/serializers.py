@@ -1,4 +1,5 @@
 import datetime
+import mimeparse
 from StringIO import StringIO
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -7,7 +8,7 @@ from django.utils import simplejson
 from django.utils.encoding import force_unicode
 from tastypie.bundle import Bundle
 from tastypie.exceptions import UnsupportedFormat
-from tastypie.utils import format_datetime, format_date, format_time
+from tastypie.utils import format_datetime, format_date, format_time, LRUCache
 try:
     import lxml
     from lxml.etree import parse as parse_xml
@@ -51,6 +52,8 @@ class Serializer(object):
         'html': 'text/html',
         'plist': 'application/x-plist',
     }
+    # How many distinct ``Accept`` headers to remember the negotiated format for.
+    negotiation_cache_size = 128
     
     def __init__(self, formats=None, content_types=None, datetime_formatting=None):
         self.supported_formats = []
@@ -70,6 +73,48 @@ class Serializer(object):
                 self.supported_formats.append(self.content_types[format])
             except KeyError:
                 raise ImproperlyConfigured("Content type for specified type '%s' not found. Please provide it at either the class level or via the arguments." % format)
+        
+        # Reverse the list, because mimeparse is weird like that. See also
+        # https://github.com/toastdriven/django-tastypie/issues#issue/12 for
+        # more information.
+        self.negotiable_formats = list(reversed(self.supported_formats))
+        self.negotiation_cache = LRUCache(self.negotiation_cache_size)
+        self.mime_formats = self.build_mime_formats()
+    
+    def build_mime_formats(self):
+        """
+        Builds the lookup table from a MIME type to the short format name
+        whose ``to_<format>`` method serializes it.
+        
+        Only formats with a ``to_<format>`` method are included.
+        """
+        mime_formats = {}
+        
+        for short_format, long_format in self.content_types.items():
+            if long_format in mime_formats:
+                continue
+            
+            if hasattr(self, "to_%s" % short_format):
+                mime_formats[long_format] = short_format
+        
+        return mime_formats
+    
+    def best_match(self, accept):
+        """
+        Given an ``Accept`` header, returns the best matching supported MIME
+        type (or an empty string if none match).
+        
+        Results are memoized, as the set of ``Accept`` headers clients send
+        is small but ``mimeparse`` is comparatively slow.
+        """
+        try:
+            return self.negotiation_cache[accept]
+        except KeyError:
+            pass
+        
+        best_format = mimeparse.best_match(self.negotiable_formats, accept)
+        self.negotiation_cache[accept] = best_format
+        return best_format
     
     def get_mime_for_format(self, format):
         """
@@ -130,13 +175,7 @@ class Serializer(object):
         Given some data and a format, calls the correct method to serialize
         the data and returns the result.
         """
-        desired_format = None
-        
-        for short_format, long_format in self.content_types.items():
-            if format == long_format:
-                if hasattr(self, "to_%s" % short_format):
-                    desired_format = short_format
-                    break
+        desired_format = self.mime_formats.get(format)
         
         if desired_format is None:
             raise UnsupportedFormat("The format indicated '%s' had no available serialization method. Please check your ``formats`` and ``content_types`` on your Serializer." % format)
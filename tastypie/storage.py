@@ -0,0 +1,357 @@
+"""
+Content-addressed, deduplicating storage for uploaded files.
+
+Files are stored under the hash of their content, so uploading the same bytes
+twice stores them once. Each stored file (a "blob") keeps a count of the
+objects referencing it and is only removed once the last of them lets go of
+it. Use it as the ``storage`` of the model fields behind your
+``AttachmentFileField`` fields::
+
+    from tastypie.storage import ContentAddressedStorage
+
+    class Photo(models.Model):
+        image = models.FileField(upload_to='photos', storage=ContentAddressedStorage())
+
+Clients that already know the hash of a file they uploaded before can then
+skip uploading it again, sending a reference instead::
+
+    {"title": "My cat", "image": {"hash": "<sha256 hex digest>", "name": "cat.jpg"}}
+
+References are released when the objects holding them are deleted or given
+another file (through the ``post_delete``/``pre_save``/``post_save`` signals).
+"""
+import errno
+import os
+import re
+import tempfile
+
+try:
+    from hashlib import sha256
+except ImportError:
+    sha256 = None
+
+from django.core.files import File, locks
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db.models import FileField, signals
+
+
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+EXTENSION_RE = re.compile(r'^\.[A-Za-z0-9]{1,16}$')
+
+
+class BlobReference(File):
+    """
+    A ``File`` standing for a blob that's already stored, given by the hash of
+    its content. Saving it only adds a reference to the blob.
+    """
+    def __init__(self, name, content_hash, size):
+        super(BlobReference, self).__init__(None, name=name)
+        self.content_hash = content_hash
+        self.size = size
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    A ``FileSystemStorage`` keeping files under the SHA-256 hash of their
+    content, as ``<hash[:2]>/<hash><extension>``, regardless of the name they
+    were uploaded with.
+
+    The hash is computed as the content is copied into place, so files are
+    only read once. If the same content is already stored, the copy is
+    discarded and the existing blob is reused.
+
+    The number of references to each blob is kept next to it, in
+    ``<hash><extension>.refs``. Saving increments it, deleting decrements it
+    and removes the blob once it reaches zero. Both happen under a lock on
+    that file, so concurrent processes can share the same ``location``.
+
+    Who uploaded each blob (the ``uploaded_by`` of the files saved, as set by
+    ``AttachmentFileField``) is kept in ``<hash><extension>.owners``, so that
+    knowing a hash isn't enough to get at someone else's file.
+    """
+    def __init__(self, location=None, base_url=None, chunk_size=64 * 1024):
+        if sha256 is None:
+            raise ImportError("ContentAddressedStorage requires 'hashlib' (Python 2.5+).")
+
+        super(ContentAddressedStorage, self).__init__(location=location, base_url=base_url)
+        self.chunk_size = chunk_size
+
+    def blob_name(self, content_hash, name=''):
+        """
+        Returns the name a blob is stored under, keeping the extension of the
+        original ``name`` so its content type can still be guessed.
+        """
+        extension = os.path.splitext(name or '')[1].lower()
+
+        if not EXTENSION_RE.match(extension):
+            extension = ''
+
+        return '%s/%s%s' % (content_hash[:2], content_hash, extension)
+
+    def reference(self, content_hash, name='', owner=None):
+        """
+        Returns a ``BlobReference`` for the blob with ``content_hash`` (and the
+        extension of ``name``), or ``None`` if no such blob is stored.
+
+        If ``owner`` is given, the blob must have been uploaded by them too.
+        """
+        content_hash = (content_hash or '').lower()
+
+        if not HASH_RE.match(content_hash):
+            return None
+
+        blob_name = self.blob_name(content_hash, name)
+
+        if not self.exists(blob_name):
+            return None
+
+        if owner is not None and not owner in self.owners(blob_name):
+            return None
+
+        return BlobReference(blob_name, content_hash, self.size(blob_name))
+
+    def owners(self, name):
+        """
+        Returns who uploaded a stored blob.
+        """
+        try:
+            return open('%s.owners' % self.path(name), 'rb').read().splitlines()
+        except IOError:
+            return []
+
+    def references(self, name):
+        """
+        Returns the number of references to a stored blob.
+        """
+        path = self.path(name)
+
+        try:
+            return int(open('%s.refs' % path, 'rb').read() or 0)
+        except (IOError, ValueError):
+            return int(os.path.exists(path))
+
+    def get_available_name(self, name):
+        # Names are derived from the content, so there's nothing to avoid.
+        return name
+
+    def _save(self, name, content):
+        content_hash = self._file_attribute(content, 'content_hash')
+        owner = self._file_attribute(content, 'uploaded_by')
+
+        if content_hash is not None:
+            blob_name = self.blob_name(content_hash, name)
+            self._add_reference(blob_name, None, owner)
+            return blob_name
+
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk. Hash it, then move it into place if it's new.
+            digest = sha256()
+
+            for chunk in content.chunks(self.chunk_size):
+                digest.update(chunk)
+
+            temp_path = content.temporary_file_path()
+        else:
+            temp_path, digest = self._spool(content)
+
+        blob_name = self.blob_name(digest.hexdigest(), name)
+
+        try:
+            self._add_reference(blob_name, temp_path, owner)
+        finally:
+            if hasattr(content, 'temporary_file_path'):
+                content.close()
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return blob_name
+
+    def _file_attribute(self, content, attribute):
+        # ``FieldFile.save`` hands the field file over, rather than the file
+        # it was given.
+        return getattr(content, attribute, None) or getattr(getattr(content, 'file', None), attribute, None)
+
+    def _spool(self, content):
+        """
+        Copies ``content`` to a temporary file in ``location``, hashing it as
+        it goes. Returns the path of the copy and the hash.
+        """
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+
+        fd, temp_path = tempfile.mkstemp(prefix='.upload-', dir=self.location)
+        digest = sha256()
+
+        try:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+
+            for chunk in content.chunks(self.chunk_size):
+                digest.update(chunk)
+                os.write(fd, chunk)
+        except:
+            os.close(fd)
+            os.remove(temp_path)
+            raise
+
+        os.close(fd)
+        return temp_path, digest
+
+    def _lock_references(self, name):
+        """
+        Opens & locks the reference count of a blob, retrying if the count
+        was removed while waiting for the lock.
+        """
+        path = '%s.refs' % self.path(name)
+        directory = os.path.dirname(path)
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        while True:
+            refs = open(path, 'a+b')
+            locks.lock(refs, locks.LOCK_EX)
+
+            try:
+                if os.fstat(refs.fileno()).st_ino == os.stat(path).st_ino:
+                    return refs
+            except OSError:
+                pass
+
+            locks.unlock(refs)
+            refs.close()
+
+    def _read_references(self, refs):
+        refs.seek(0)
+
+        try:
+            return int(refs.read() or 0)
+        except ValueError:
+            return 0
+
+    def _write_references(self, refs, count):
+        refs.seek(0)
+        refs.truncate()
+        refs.write(str(count))
+        refs.flush()
+
+    def _add_reference(self, name, temp_path, owner=None):
+        """
+        Adds a reference to the blob ``name``, moving the file at
+        ``temp_path`` into place first if the blob isn't stored yet, and
+        noting ``owner`` as one of its uploaders.
+        """
+        path = self.path(name)
+        refs = self._lock_references(name)
+
+        try:
+            count = self._read_references(refs)
+
+            if not os.path.exists(path):
+                if temp_path is None:
+                    raise IOError("The blob '%s' is no longer stored." % name)
+
+                file_move_safe(temp_path, path)
+                count = 0
+            elif count == 0:
+                # Stored before reference counts were kept.
+                count = 1
+
+            self._write_references(refs, count + 1)
+
+            if owner is not None and not owner in self.owners(name):
+                owners = open('%s.owners' % path, 'ab')
+                owners.write('%s\n' % owner)
+                owners.close()
+        finally:
+            locks.unlock(refs)
+            refs.close()
+
+    def delete(self, name):
+        """
+        Drops a reference to the blob ``name``, removing it once nothing
+        references it anymore.
+        """
+        path = self.path(name)
+
+        if not os.path.exists(path):
+            return
+
+        refs = self._lock_references(name)
+
+        try:
+            count = self._read_references(refs) - 1
+
+            if count > 0:
+                self._write_references(refs, count)
+            else:
+                for path in (path, '%s.refs' % path, '%s.owners' % path):
+                    if os.path.exists(path):
+                        os.remove(path)
+        finally:
+            locks.unlock(refs)
+            refs.close()
+
+
+def content_addressed_fields(model):
+    """
+    Returns the ``FileField`` fields of ``model`` that use a
+    ``ContentAddressedStorage``.
+    """
+    return [field for field in model._meta.fields if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)]
+
+
+def note_replaced_files(sender, instance, raw=False, **kwargs):
+    """
+    A signal noting the blobs an object is about to let go of, as it's saved
+    with other files (or new references to the same ones).
+    """
+    fields = content_addressed_fields(sender)
+
+    if raw or not fields or instance.pk is None:
+        return
+
+    current = sender._default_manager.filter(pk=instance.pk).values_list(*[field.attname for field in fields])
+
+    if not current:
+        return
+
+    replaced = []
+
+    for field, old_name in zip(fields, current[0]):
+        new_file = getattr(instance, field.attname)
+
+        if old_name and (new_file.name != old_name or not getattr(new_file, '_committed', True)):
+            replaced.append((field.storage, old_name))
+
+    instance._replaced_blobs = replaced
+
+
+def release_replaced_files(sender, instance, **kwargs):
+    """
+    A signal releasing the blobs noted by ``note_replaced_files``, once the
+    object has been saved.
+    """
+    for storage, name in instance.__dict__.pop('_replaced_blobs', []):
+        storage.delete(name)
+
+
+def release_deleted_files(sender, instance, **kwargs):
+    """
+    A signal releasing the blobs referenced by a deleted object.
+    """
+    for field in content_addressed_fields(sender):
+        name = getattr(instance, field.attname).name
+
+        if name:
+            field.storage.delete(name)
+
+
+signals.pre_save.connect(note_replaced_files, dispatch_uid='tastypie_content_addressed_storage')
+signals.post_save.connect(release_replaced_files, dispatch_uid='tastypie_content_addressed_storage')
+signals.post_delete.connect(release_deleted_files, dispatch_uid='tastypie_content_addressed_storage')
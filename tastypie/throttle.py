@@ -1,5 +1,26 @@
+import atexit
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
 import time
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
 
 
 class BaseThrottle(object):
@@ -18,6 +39,9 @@ class BaseThrottle(object):
           1 hour).
         * ``expiration`` - the length of time to retain the times the user
           has accessed the api in the cache. Default is 604800 (1 week).
+    
+    Both ``should_be_throttled`` & ``accessed`` may be given a ``cost``, the
+    number of requests a single (expensive) request counts as. Default is 1.
     """
     def __init__(self, throttle_at=150, timeframe=3600, expiration=None):
         self.throttle_at = throttle_at
@@ -86,7 +110,7 @@ class CacheThrottle(BaseThrottle):
         times_accessed = [access for access in cache.get(key) if access >= minimum_time]
         cache.set(key, times_accessed, self.expiration)
         
-        if len(times_accessed) >= int(self.throttle_at):
+        if len(times_accessed) + int(kwargs.get('cost', 1)) > int(self.throttle_at):
             # Throttle them.
             return True
         
@@ -97,14 +121,675 @@ class CacheThrottle(BaseThrottle):
         """
         Handles recording the user's access.
         
-        Stores the current timestamp in the "accesses" list within the cache.
+        Stores the current timestamp in the "accesses" list within the cache,
+        once per unit of ``cost``.
         """
         key = self.convert_identifier_to_key(identifier)
         times_accessed = cache.get(key, [])
-        times_accessed.append(int(time.time()))
+        times_accessed.extend([int(time.time())] * int(kwargs.get('cost', 1)))
         cache.set(key, times_accessed, self.expiration)
 
 
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    A throttling mechanism that uses counters in the cache, estimating the
+    number of accesses over a sliding window.
+    
+    Accesses are counted in buckets, one per ``timeframe``, using the cache's
+    atomic ``incr``. The accesses over the last ``timeframe`` are estimated
+    from the current bucket plus the share of the previous one that still
+    falls within the window. Unlike ``CacheThrottle``, the cost of this
+    doesn't grow with ``throttle_at`` & concurrent requests can't overwrite
+    each other's accesses.
+    
+    The access is recorded while checking it, in a single round trip to the
+    cache. The previous bucket can no longer change, so it's only fetched
+    once per ``timeframe`` & remembered. Throttled requests aren't counted.
+    
+    Use a cache backend with atomic increments (such as memcached) if the API
+    is served by more than one process.
+    """
+    # Caps the number of previous buckets remembered per process.
+    max_remembered = 10000
+    
+    def __init__(self, throttle_at=150, timeframe=3600, expiration=None):
+        super(SlidingWindowThrottle, self).__init__(throttle_at=throttle_at, timeframe=timeframe, expiration=expiration)
+        self._previous_counts = {}
+    
+    def bucket_key(self, key, bucket):
+        return "%s_%d" % (key, bucket)
+    
+    def increment(self, key, delta=1):
+        """
+        Atomically increments a bucket counter, creating it if needed, and
+        returns its new value.
+        """
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            # Buckets are no use once the next one is over.
+            if cache.add(key, delta, int(self.timeframe) * 2):
+                return delta
+            
+            # Someone else got there first.
+            return cache.incr(key, delta)
+    
+    def previous_count(self, key, bucket):
+        """
+        Returns the number of accesses in the bucket before ``bucket``.
+        """
+        remembered = self._previous_counts.get(key)
+        
+        if remembered is not None and remembered[0] == bucket:
+            return remembered[1]
+        
+        count = cache.get(self.bucket_key(key, bucket - 1)) or 0
+        
+        if len(self._previous_counts) >= self.max_remembered:
+            self._previous_counts.clear()
+        
+        self._previous_counts[key] = (bucket, count)
+        return count
+    
+    def should_be_throttled(self, identifier, **kwargs):
+        """
+        Returns whether or not the user has exceeded their throttle limit,
+        recording the access if they haven't.
+        
+        Returns ``False`` if the user should NOT be throttled or ``True`` if
+        the user should be throttled.
+        """
+        key = self.convert_identifier_to_key(identifier)
+        timeframe = int(self.timeframe)
+        now = time.time()
+        bucket = int(now // timeframe)
+        current_key = self.bucket_key(key, bucket)
+        cost = int(kwargs.get('cost', 1))
+        current = self.increment(current_key, cost)
+        
+        # The share of the previous bucket still within the window.
+        overlap = 1 - (now % timeframe) / float(timeframe)
+        estimate = current + self.previous_count(key, bucket) * overlap
+        
+        if estimate > int(self.throttle_at):
+            # Throttle them, without counting the rejected request.
+            try:
+                cache.decr(current_key, cost)
+            except ValueError:
+                pass
+            
+            return True
+        
+        # Let them through.
+        return False
+
+
+class LeasedCacheThrottle(BaseThrottle):
+    """
+    A throttling mechanism that uses counters in the cache, but only goes to
+    the cache once every ``lease_size`` requests per identifier & process.
+    
+    Accesses are allowed per fixed window of ``timeframe`` seconds. Rather
+    than counting each request in the cache, each process leases a block of
+    ``lease_size`` tokens from the window's counter (with a single atomic
+    ``incr``) & spends them locally. Once the whole window has been leased,
+    processes stop asking until the next one.
+    
+    Accuracy guarantees, for a given identifier & window:
+    
+        * No more than ``throttle_at`` requests are ever let through. Tokens
+          are reserved before being spent, so there's no over-admission.
+        * Requests may be throttled early, as tokens leased by other processes
+          can't be spent by this one: at worst, by ``(processes - 1) *
+          (lease_size - 1)`` requests.
+        * As with any fixed window, up to twice ``throttle_at`` requests may
+          get through around the boundary between two windows.
+    
+    Accepts one more optional kwarg::
+    
+        * ``lease_size`` - the number of tokens leased at once. Default is
+          10, capped at ``throttle_at``.
+    
+    Use a cache backend with atomic increments (such as memcached) if the API
+    is served by more than one process.
+    """
+    # Caps the number of leases held per process.
+    max_leases = 10000
+    
+    def __init__(self, throttle_at=150, timeframe=3600, expiration=None, lease_size=10):
+        super(LeasedCacheThrottle, self).__init__(throttle_at=throttle_at, timeframe=timeframe, expiration=expiration)
+        self.lease_size = max(min(int(lease_size), int(throttle_at)), 1)
+        self._leases = {}
+        self._lock = threading.Lock()
+    
+    def lease(self, key, amount=None):
+        """
+        Leases up to ``amount`` tokens (default is ``lease_size``) from the
+        counter at ``key``. Returns the number of tokens granted, zero once
+        the window is used up.
+        """
+        if amount is None:
+            amount = self.lease_size
+        
+        try:
+            reserved = cache.incr(key, amount)
+        except ValueError:
+            # Counters are no use once their window is over.
+            if cache.add(key, amount, int(self.timeframe) * 2):
+                reserved = amount
+            else:
+                reserved = cache.incr(key, amount)
+        
+        available = int(self.throttle_at) - (reserved - amount)
+        return max(min(available, amount), 0)
+    
+    def should_be_throttled(self, identifier, **kwargs):
+        """
+        Returns whether or not the user has exceeded their throttle limit,
+        spending ``cost`` of their tokens if they haven't.
+        
+        Returns ``False`` if the user should NOT be throttled or ``True`` if
+        the user should be throttled.
+        """
+        key = self.convert_identifier_to_key(identifier)
+        window = int(time.time() // int(self.timeframe))
+        cost = int(kwargs.get('cost', 1))
+        
+        self._lock.acquire()
+        
+        try:
+            lease = self._leases.get(key)
+            
+            if lease is None or lease[0] != window:
+                lease = None
+            elif lease[1] >= cost:
+                lease[1] -= cost
+                return False
+            elif lease[2]:
+                # The whole window has been leased.
+                return True
+            
+            needed = cost - (lease and lease[1] or 0)
+        finally:
+            self._lock.release()
+        
+        # Costly requests lease what they need at once.
+        amount = max(self.lease_size, needed)
+        granted = self.lease("%s_%d" % (key, window), amount)
+        
+        self._lock.acquire()
+        
+        try:
+            if len(self._leases) >= self.max_leases:
+                self._leases.clear()
+            
+            lease = self._leases.get(key)
+            
+            # Keeping any tokens leased by another thread meanwhile.
+            if lease is None or lease[0] != window:
+                lease = self._leases[key] = [window, 0, False]
+            
+            lease[1] += granted
+            
+            # A short lease means there's nothing left to lease.
+            if granted < amount:
+                lease[2] = True
+            
+            if lease[1] >= cost:
+                lease[1] -= cost
+                return False
+            
+            # Whatever was granted is kept for cheaper requests.
+            return True
+        finally:
+            self._lock.release()
+
+
+class SharedTable(object):
+    """
+    A memory-mapped throttle table, as opened by this process.
+    
+    ``fcntl`` locks belong to the process (so don't keep its threads apart) &
+    are all dropped as soon as any of its descriptors for the file is closed.
+    So every ``SharedMemoryThrottle`` using a file shares one of these: a
+    single descriptor, mapping & thread lock, closed along with the last of
+    them.
+    """
+    def __init__(self, path, fd, table_map, layout):
+        self.path = path
+        self.fd = fd
+        self.map = table_map
+        self.layout = layout
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+# The tables opened by this process, by (real) path.
+_shared_tables = {}
+_shared_tables_lock = threading.Lock()
+
+
+class SharedMemoryThrottle(BaseThrottle):
+    """
+    A throttling mechanism that keeps counters in a memory-mapped file, shared
+    by all the processes on a single host. No network round trips, & exact
+    counts across prefork workers.
+    
+    Like ``SlidingWindowThrottle``, it counts accesses per ``timeframe`` &
+    estimates those over the last ``timeframe`` from the current & previous
+    counts. Throttled requests aren't counted.
+    
+    The counters live in a fixed-size hash table, split into sets of ``ways``
+    slots. An identifier can only use the slots of one set (picked by its
+    hash), evicting the least recently used one when they're all taken. Each
+    set is locked (with ``fcntl``) while it's updated.
+    
+    Accepts a number of optional kwargs::
+    
+        * ``path`` - the file holding the table. It's created if needed, but
+          never resized, so a file laid out for a different number of
+          ``slots`` or ``ways`` raises ``ImproperlyConfigured``. Default is
+          ``settings.TASTYPIE_THROTTLE_FILE`` or
+          ``tastypie-throttle-<slots>-<ways>.mmap`` in the system's temporary
+          directory.
+        * ``slots`` - the number of counters in the table, so the number of
+          identifiers tracked at once. Default is 65536 (a 2 megabyte file).
+        * ``ways`` - the number of slots per set. Default is 8.
+    
+    Only available where ``fcntl`` is (not on Windows).
+    """
+    MAGIC = 'TPTHROT1'
+    # Magic, number of slots & ways.
+    HEADER = struct.Struct('<8sII')
+    HEADER_SIZE = 64
+    # Key hash, last use (in milliseconds), window, count in the window &
+    # count in the previous window.
+    SLOT = struct.Struct('<QQIII4x')
+    
+    def __init__(self, throttle_at=150, timeframe=3600, expiration=None, path=None, slots=65536, ways=8):
+        if fcntl is None:
+            raise ImportError("SharedMemoryThrottle requires 'fcntl', which isn't available on this platform.")
+        
+        super(SharedMemoryThrottle, self).__init__(throttle_at=throttle_at, timeframe=timeframe, expiration=expiration)
+        self.ways = max(int(ways), 1)
+        self.sets = max(int(slots) // self.ways, 1)
+        self.slots = self.sets * self.ways
+        
+        if path is None:
+            # Only looked up here, so the settings aren't needed at import.
+            from django.conf import settings
+            path = getattr(settings, 'TASTYPIE_THROTTLE_FILE', None) or os.path.join(tempfile.gettempdir(), 'tastypie-throttle-%d-%d.mmap' % (self.slots, self.ways))
+        
+        self.path = path
+        self._table = None
+    
+    @property
+    def size(self):
+        return self.HEADER_SIZE + self.slots * self.SLOT.size
+    
+    def open(self):
+        """
+        Returns the ``SharedTable`` for ``path``, opening (& if need be,
+        creating) the file the first time it's used in this process.
+        """
+        if self._table is not None:
+            return self._table
+        
+        path = os.path.realpath(self.path)
+        _shared_tables_lock.acquire()
+        
+        try:
+            table = _shared_tables.get(path)
+            
+            if table is None:
+                fd, table_map = self.map_file(path)
+                table = _shared_tables[path] = SharedTable(path, fd, table_map, (self.slots, self.ways))
+            elif table.layout != (self.slots, self.ways):
+                raise ImproperlyConfigured("The throttle file '%s' is in use with %d slots & %d ways. Use another path for a different layout." % (self.path, table.layout[0], table.layout[1]))
+            
+            table.users += 1
+        finally:
+            _shared_tables_lock.release()
+        
+        self._table = table
+        return table
+    
+    def map_file(self, path):
+        """
+        Opens & maps the file at ``path``, laying it out if it's new.
+        
+        A file laid out differently is left alone, as other processes may
+        have it mapped: shrinking it under them would crash them, & wiping
+        it would reset their counts.
+        """
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            
+            try:
+                header = os.read(fd, self.HEADER.size)
+                
+                if not header.strip('\0'):
+                    # New (or never finished), so nobody's using it yet.
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                    
+                    os.lseek(fd, 0, 0)
+                    os.write(fd, self.HEADER.pack(self.MAGIC, self.slots, self.ways))
+                elif len(header) != self.HEADER.size or self.HEADER.unpack(header) != (self.MAGIC, self.slots, self.ways) or os.fstat(fd).st_size < self.size:
+                    raise ImproperlyConfigured("The throttle file '%s' isn't laid out for %d slots & %d ways. Use another path, or remove it once nothing uses it." % (self.path, self.slots, self.ways))
+                
+                return fd, mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+        except:
+            os.close(fd)
+            raise
+    
+    def close(self):
+        if self._table is None:
+            return
+        
+        table, self._table = self._table, None
+        _shared_tables_lock.acquire()
+        
+        try:
+            table.users -= 1
+            
+            if table.users == 0:
+                del _shared_tables[table.path]
+                table.map.close()
+                os.close(table.fd)
+        finally:
+            _shared_tables_lock.release()
+    
+    def key_hash(self, key):
+        # Zero marks an empty slot.
+        return struct.unpack('<Q', md5(key).digest()[:8])[0] or 1
+    
+    def should_be_throttled(self, identifier, **kwargs):
+        """
+        Returns whether or not the user has exceeded their throttle limit,
+        recording the access if they haven't.
+        
+        Returns ``False`` if the user should NOT be throttled or ``True`` if
+        the user should be throttled.
+        """
+        key_hash = self.key_hash(self.convert_identifier_to_key(identifier))
+        timeframe = int(self.timeframe)
+        now = time.time()
+        window = int(now // timeframe)
+        overlap = 1 - (now % timeframe) / float(timeframe)
+        start = self.HEADER_SIZE + (key_hash % self.sets) * self.ways * self.SLOT.size
+        length = self.ways * self.SLOT.size
+        
+        shared = self.open()
+        table = shared.map
+        shared.lock.acquire()
+        
+        try:
+            fcntl.lockf(shared.fd, fcntl.LOCK_EX, length, start)
+            
+            try:
+                offset = self.find_slot(table, start, key_hash)
+                slot_hash, last_used, slot_window, count, previous = self.SLOT.unpack_from(table, offset)
+                
+                if slot_hash != key_hash:
+                    # Evicting whoever was here.
+                    slot_window, count, previous = window, 0, 0
+                elif slot_window != window:
+                    if slot_window == window - 1:
+                        previous = count
+                    else:
+                        previous = 0
+                    
+                    slot_window, count = window, 0
+                
+                cost = int(kwargs.get('cost', 1))
+                throttled = count + cost + previous * overlap > int(self.throttle_at)
+                
+                if not throttled:
+                    count += cost
+                
+                self.SLOT.pack_into(table, offset, key_hash, int(now * 1000), slot_window, count, previous)
+                return throttled
+            finally:
+                fcntl.lockf(shared.fd, fcntl.LOCK_UN, length, start)
+        finally:
+            shared.lock.release()
+    
+    def find_slot(self, table, start, key_hash):
+        """
+        Returns the offset of the slot for ``key_hash`` within the set at
+        ``start``: its own, an empty one or the least recently used one.
+        """
+        candidate = None
+        candidate_used = None
+        
+        for way in range(self.ways):
+            offset = start + way * self.SLOT.size
+            slot_hash, last_used = self.SLOT.unpack_from(table, offset)[:2]
+            
+            if slot_hash == key_hash:
+                return offset
+            
+            if slot_hash == 0:
+                last_used = -1
+            
+            if candidate is None or last_used < candidate_used:
+                candidate, candidate_used = offset, last_used
+        
+        return candidate
+
+
+class ApiAccessLogger(object):
+    """
+    Writes API accesses to the database, using the ``ApiAccess`` model, as
+    they happen.
+    """
+    def log(self, identifier, url='', request_method='', accessed=None):
+        # Do the import here, instead of top-level, so that the model is
+        # only required when logging accesses.
+        from tastypie.models import ApiAccess
+        ApiAccess.objects.create(
+            identifier=identifier,
+            url=url,
+            request_method=request_method
+        )
+    
+    def flush(self):
+        pass
+
+
+class BufferedApiAccessLogger(ApiAccessLogger):
+    """
+    Collects API accesses in memory & writes them to the database in batches,
+    using multi-row ``INSERT`` statements, rather than one ``INSERT`` per
+    request.
+    
+    Accepts a number of optional kwargs::
+    
+        * ``batch_size`` - the number of accesses written at once. Collecting
+          that many triggers a write. Default is 500.
+        * ``flush_interval`` - the number of seconds after which collected
+          accesses are written, however few of them there are. Writes happen
+          in a background thread. ``None`` disables the thread, leaving writes
+          to whichever request fills a batch. Default is 5 seconds.
+        * ``max_queued`` - the number of accesses kept waiting to be written,
+          should the database fall behind. Beyond that, accesses are dropped
+          (& counted in ``dropped``). Default is 10000.
+        * ``drop_oldest`` - whether the oldest accesses are dropped to make
+          room for new ones, rather than the new ones being dropped. Default
+          is ``False``.
+        * ``using`` - the database alias to write to. Default is the default
+          database.
+    
+    Whatever is left is written when the process exits.
+    """
+    # Keeps statements within the bind parameter limits of SQLite.
+    max_rows_per_insert = 200
+    
+    def __init__(self, batch_size=500, flush_interval=5, max_queued=10000, drop_oldest=False, using=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self.drop_oldest = drop_oldest
+        self.using = using or DEFAULT_DB_ALIAS
+        self.dropped = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        atexit.register(self.close)
+    
+    def log(self, identifier, url='', request_method='', accessed=None):
+        if accessed is None:
+            accessed = int(time.time())
+        
+        record = (identifier[:255], (url or '')[:255], (request_method or '')[:10], accessed)
+        
+        self._lock.acquire()
+        
+        try:
+            if len(self._queue) >= self.max_queued:
+                self.dropped += 1
+                
+                if not self.drop_oldest:
+                    return
+                
+                self._queue.popleft()
+            
+            self._queue.append(record)
+            queued = len(self._queue)
+        finally:
+            self._lock.release()
+        
+        if self.flush_interval is None or self._closed:
+            if queued >= self.batch_size:
+                self.flush()
+        else:
+            self._ensure_thread()
+            
+            if queued >= self.batch_size:
+                self._wakeup.set()
+    
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so each process starts its own.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.isAlive():
+            return
+        
+        self._lock.acquire()
+        
+        try:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.isAlive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='tastypie-access-logger')
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+    
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger('tastypie.throttle').exception("Unable to write API accesses.")
+    
+    def _take(self, count):
+        self._lock.acquire()
+        
+        try:
+            return [self._queue.popleft() for i in range(min(count, len(self._queue)))]
+        finally:
+            self._lock.release()
+    
+    def flush(self):
+        """
+        Writes out everything collected so far, a batch at a time.
+        """
+        self._flush_lock.acquire()
+        
+        try:
+            while True:
+                records = self._take(self.batch_size)
+                
+                if not records:
+                    break
+                
+                try:
+                    self.write(records)
+                except:
+                    self._requeue(records)
+                    raise
+        finally:
+            self._flush_lock.release()
+    
+    def _requeue(self, records):
+        """
+        Puts records that couldn't be written back in front of the queue, as
+        far as there's room.
+        """
+        self._lock.acquire()
+        
+        try:
+            room = max(self.max_queued - len(self._queue), 0)
+            self.dropped += max(len(records) - room, 0)
+            self._queue.extendleft(reversed(records[:room]))
+        finally:
+            self._lock.release()
+    
+    def write(self, records):
+        """
+        Inserts ``records`` (tuples of identifier, url, request method &
+        timestamp) into the ``ApiAccess`` table.
+        """
+        from tastypie.models import ApiAccess
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        opts = ApiAccess._meta
+        columns = ', '.join([qn(opts.get_field(name).column) for name in ('identifier', 'url', 'request_method', 'accessed')])
+        sql = 'INSERT INTO %s (%s) VALUES ' % (qn(opts.db_table), columns)
+        cursor = connection.cursor()
+        
+        if connection.vendor == 'oracle':
+            # No multi-row ``VALUES`` there.
+            cursor.executemany(sql + '(%s, %s, %s, %s)', records)
+        else:
+            for start in range(0, len(records), self.max_rows_per_insert):
+                rows = records[start:start + self.max_rows_per_insert]
+                params = []
+                
+                for row in rows:
+                    params.extend(row)
+                
+                cursor.execute(sql + ', '.join(['(%s, %s, %s, %s)'] * len(rows)), params)
+        
+        transaction.commit_unless_managed(using=self.using)
+    
+    def close(self):
+        """
+        Stops the background thread & writes out whatever is left.
+        """
+        self._closed = True
+        self._wakeup.set()
+        
+        if self._thread is not None and self._thread.isAlive() and self._thread is not threading.currentThread():
+            self._thread.join(self.flush_interval)
+        
+        try:
+            self.flush()
+        except Exception:
+            logging.getLogger('tastypie.throttle').exception("Unable to write %d API accesses." % len(self._queue))
+
+
 class CacheDBThrottle(CacheThrottle):
     """
     A throttling mechanism that uses the cache for actual throttling but
@@ -112,7 +797,19 @@ class CacheDBThrottle(CacheThrottle):
     
     This is useful for tracking/aggregating usage through time, to possibly
     build a statistics interface or a billing mechanism.
+    
+    Optionally accepts an ``access_logger``, which writes the accesses out.
+    Default is an ``ApiAccessLogger``, writing each access as it happens. Use
+    a ``BufferedApiAccessLogger`` to write them in batches instead.
     """
+    def __init__(self, throttle_at=150, timeframe=3600, expiration=None, access_logger=None):
+        super(CacheDBThrottle, self).__init__(throttle_at=throttle_at, timeframe=timeframe, expiration=expiration)
+        
+        if access_logger is None:
+            access_logger = ApiAccessLogger()
+        
+        self.access_logger = access_logger
+    
     def accessed(self, identifier, **kwargs):
         """
         Handles recording the user's access.
@@ -120,13 +817,6 @@ class CacheDBThrottle(CacheThrottle):
         Does everything the ``CacheThrottle`` class does, plus logs the
         access within the database using the ``ApiAccess`` model.
         """
-        # Do the import here, instead of top-level, so that the model is
-        # only required when using this throttling mechanism.
-        from tastypie.models import ApiAccess
         super(CacheDBThrottle, self).accessed(identifier, **kwargs)
         # Write out the access to the DB for logging purposes.
-        ApiAccess.objects.create(
-            identifier=identifier,
-            url=kwargs.get('url', ''),
-            request_method=kwargs.get('request_method', '')
-        )
+        self.access_logger.log(identifier, url=kwargs.get('url', ''), request_method=kwargs.get('request_method', ''))
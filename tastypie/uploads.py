@@ -0,0 +1,327 @@
+"""
+Resumable, chunked uploads.
+
+Rather than sending a whole file in a single request, a client creates an
+upload session, then sends the file as a series of byte ranges. Should the
+connection drop, it asks for the number of bytes received so far and carries
+on from there. Once complete, the upload is attached to an object by
+referencing it from an ``AttachmentFileField``::
+
+    POST /api/v1/photos/uploads/
+    {"filename": "cat.jpg", "size": 1048576}
+    --> 201 Created, Location: /api/v1/photos/uploads/<id>/
+
+    PUT /api/v1/photos/uploads/<id>/
+    Content-Range: bytes 0-524287/1048576
+    --> 200 OK, {"offset": 524288, ...}
+
+    GET /api/v1/photos/uploads/<id>/
+    --> 200 OK, {"offset": 524288, ...}
+
+    POST /api/v1/photos/
+    {"title": "My cat", "image": {"upload": "<id>"}}
+"""
+import os
+import re
+import time
+import uuid
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import simplejson as json
+from tastypie.exceptions import BadRequest, NotFound, RequestEntityTooLarge
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes\s+(\d+)-(\d+)/(\d+|\*)$')
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def parse_content_range(header):
+    """
+    Parses a ``Content-Range: bytes <start>-<end>/<total>`` header.
+
+    Returns a ``(start, end, total)`` tuple, where ``end`` is inclusive and
+    ``total`` is ``None`` if unknown (``*``).
+    """
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+
+    if match is None:
+        raise BadRequest("Invalid or missing 'Content-Range' header. Please provide one in the form 'bytes <start>-<end>/<total>'.")
+
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+
+    if total == '*':
+        total = None
+    else:
+        total = int(total)
+
+    if end < start or (total is not None and end >= total):
+        raise BadRequest("Invalid 'Content-Range' header: %s." % header)
+
+    return start, end, total
+
+
+def upload_owner(request, authentication):
+    """
+    Returns who the upload sessions started by ``request`` belong to: the
+    authenticated user if there is one (so an upload can be resumed from
+    another address), the ``authentication``'s identifier otherwise.
+    """
+    user = getattr(request, 'user', None)
+
+    if user is not None and user.is_authenticated():
+        return 'user:%s' % user.pk
+
+    return authentication.get_identifier(request)
+
+
+class UploadSession(object):
+    """
+    The state of a single resumable upload.
+
+    ``offset`` is the number of bytes received so far. ``size`` is the total
+    size of the file, which may be ``None`` until the client sends it.
+    """
+    def __init__(self, id, filename='', size=None, content_type='', owner=None, created=None, offset=0):
+        self.id = id
+        self.filename = filename
+        self.size = size
+        self.content_type = content_type
+        self.owner = owner
+        self.created = created or time.time()
+        self.offset = offset
+
+    def __repr__(self):
+        return '<UploadSession: %s (%s of %s bytes)>' % (self.id, self.offset, self.size)
+
+    @property
+    def complete(self):
+        return self.size is not None and self.offset >= self.size
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'content_type': self.content_type,
+            'owner': self.owner,
+            'created': self.created,
+        }
+
+
+class BaseUploadStore(object):
+    """
+    Keeps track of resumable upload sessions and the bytes received for them.
+
+    Subclasses must implement ``create``, ``get``, ``update``, ``write``,
+    ``open`` and ``delete``.
+    """
+    def __init__(self, max_size=None, expires=24 * 60 * 60):
+        """
+        Optionally accepts a ``max_size`` (in bytes) for any single upload.
+        Defaults to ``None``, meaning no limit.
+
+        Optionally accepts an ``expires``, the number of seconds an upload
+        session is kept for after it was last written to. Defaults to a day.
+        """
+        self.max_size = max_size
+        self.expires = expires
+
+    def check_size(self, size):
+        if self.max_size is not None and size is not None and size > self.max_size:
+            raise RequestEntityTooLarge("Uploads are limited to %s bytes." % self.max_size)
+
+    def create(self, filename='', size=None, content_type='', owner=None):
+        """
+        Starts a new upload session and returns it.
+        """
+        raise NotImplementedError()
+
+    def get(self, upload_id, owner=None):
+        """
+        Returns the session for ``upload_id``. Raises ``NotFound`` if there is
+        no such session (or it has expired), or if it belongs to another
+        ``owner``.
+        """
+        raise NotImplementedError()
+
+    def update(self, session):
+        """
+        Saves changes to the details (such as the ``size``) of a session.
+        """
+        raise NotImplementedError()
+
+    def write(self, session, offset, stream, length):
+        """
+        Copies up to ``length`` bytes from ``stream`` into the upload, starting
+        at ``offset``, and returns the session with its new ``offset``.
+
+        The bytes must be copied as they're read, so that whatever was
+        received before a dropped connection is kept.
+        """
+        raise NotImplementedError()
+
+    def open(self, session):
+        """
+        Returns a ``File`` with the content of a complete upload.
+        """
+        raise NotImplementedError()
+
+    def delete(self, session):
+        """
+        Discards an upload session & everything received for it.
+        """
+        raise NotImplementedError()
+
+
+class FileUploadStore(BaseUploadStore):
+    """
+    Keeps upload sessions on the filesystem, in ``directory``: the bytes
+    received in ``<id>.part`` and the details of the session in
+    ``<id>.json``.
+
+    The number of bytes received is simply the size of the ``.part`` file, so
+    nothing needs updating as chunks come in. Chunks are written straight to
+    disk as they're read from the request.
+
+    ``directory`` defaults to ``settings.TASTYPIE_UPLOAD_DIR``, falling back
+    to ``settings.FILE_UPLOAD_TEMP_DIR`` & then the system's temporary
+    directory. It must be shared by all the processes serving the API.
+    """
+    def __init__(self, directory=None, max_size=None, expires=24 * 60 * 60, chunk_size=64 * 1024):
+        super(FileUploadStore, self).__init__(max_size=max_size, expires=expires)
+        self._directory = directory
+        self.chunk_size = chunk_size
+
+    @property
+    def directory(self):
+        directory = self._directory or getattr(settings, 'TASTYPIE_UPLOAD_DIR', None) or settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        return directory
+
+    def path(self, upload_id, extension):
+        if not UPLOAD_ID_RE.match(upload_id):
+            raise NotFound("Invalid upload id '%s'." % upload_id)
+
+        return os.path.join(self.directory, '%s.%s' % (upload_id, extension))
+
+    def create(self, filename='', size=None, content_type='', owner=None):
+        self.check_size(size)
+        self.cleanup()
+        session = UploadSession(uuid.uuid4().hex, filename=filename, size=size, content_type=content_type, owner=owner)
+        open(self.path(session.id, 'part'), 'wb').close()
+        self.update(session)
+        return session
+
+    def get(self, upload_id, owner=None):
+        try:
+            details = json.load(open(self.path(upload_id, 'json'), 'rb'))
+            offset = os.path.getsize(self.path(upload_id, 'part'))
+        except (IOError, OSError, ValueError):
+            raise NotFound("No upload '%s' could be found." % upload_id)
+
+        session = UploadSession(offset=offset, **dict([(str(key), value) for key, value in details.items()]))
+
+        if session.owner != owner or self.last_active(upload_id) + self.expires < time.time():
+            raise NotFound("No upload '%s' could be found." % upload_id)
+
+        return session
+
+    def update(self, session):
+        path = self.path(session.id, 'json')
+        temp_path = '%s.%s' % (path, uuid.uuid4().hex)
+        details = open(temp_path, 'wb')
+
+        try:
+            json.dump(session.to_dict(), details)
+        finally:
+            details.close()
+
+        os.rename(temp_path, path)
+
+    def write(self, session, offset, stream, length):
+        if session.size is not None and offset + length > session.size:
+            raise BadRequest("The range sent goes beyond the size of the upload (%s bytes)." % session.size)
+
+        self.check_size(offset + length)
+        part = open(self.path(session.id, 'part'), 'r+b')
+
+        try:
+            if fcntl is not None:
+                # Guard against two requests writing the same upload at once.
+                fcntl.flock(part.fileno(), fcntl.LOCK_EX)
+
+            part.seek(0, 2)
+            session.offset = part.tell()
+
+            if session.offset != offset:
+                return session
+
+            remaining = length
+
+            try:
+                while remaining > 0:
+                    chunk = stream.read(min(self.chunk_size, remaining))
+
+                    if not chunk:
+                        break
+
+                    part.write(chunk)
+                    remaining -= len(chunk)
+            finally:
+                part.flush()
+                session.offset = part.tell()
+        finally:
+            part.close()
+
+        return session
+
+    def open(self, session):
+        return File(open(self.path(session.id, 'part'), 'rb'), name=session.filename or session.id)
+
+    def delete(self, session):
+        for extension in ('json', 'part'):
+            try:
+                os.remove(self.path(session.id, extension))
+            except OSError:
+                pass
+
+    def last_active(self, upload_id):
+        """
+        Returns when a chunk was last written to an upload (or its details
+        were changed), as a timestamp.
+        """
+        times = [0]
+
+        for extension in ('json', 'part'):
+            try:
+                times.append(os.path.getmtime(self.path(upload_id, extension)))
+            except OSError:
+                pass
+
+        return max(times)
+
+    def cleanup(self):
+        """
+        Discards the sessions that have expired.
+        """
+        cutoff = time.time() - self.expires
+
+        for filename in os.listdir(self.directory):
+            upload_id, extension = os.path.splitext(filename)
+
+            if extension != '.json' or not UPLOAD_ID_RE.match(upload_id):
+                continue
+
+            if self.last_active(upload_id) < cutoff:
+                self.delete(UploadSession(upload_id))
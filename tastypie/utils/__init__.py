@@ -1,5 +1,6 @@
 from tastypie.utils.dict import dict_strip_unicode_keys
 from tastypie.utils.formatting import mk_datetime, format_datetime, format_date, format_time
+from tastypie.utils.lru import LRUCache
 from tastypie.utils.urls import trailing_slash
 from tastypie.utils.validate_jsonp import is_valid_jsonp_callback_value
 
@@ -0,0 +1,46 @@
+import math
+import struct
+from array import array
+from django.utils.encoding import smart_str
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+
+class BloomFilter(object):
+    """
+    A compact, in-process set that can only answer "definitely not in it" or
+    "probably in it". Items can't be removed.
+
+    Sized for ``capacity`` items at a false positive rate of ``error_rate``;
+    adding more items than that raises the rate.
+    """
+    def __init__(self, capacity=10000, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(int(round(self.size / float(capacity) * math.log(2))), 1)
+        self.bits = array('B', [0]) * ((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, item):
+        # Double hashing, from a single digest.
+        first, second = struct.unpack('<QQ', md5(smart_str(item)).digest())
+        return [(first + i * second) % self.size for i in xrange(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
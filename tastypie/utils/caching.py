@@ -0,0 +1,55 @@
+"""
+Helpers for serving responses that only change when the code does (the
+top-level & schema views), with an ``ETag`` & ``Cache-Control``.
+"""
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from tastypie.http import HttpNotModified
+from tastypie.utils.files import etag_matches
+
+
+def content_etag(content):
+    """
+    Builds a (quoted) ``ETag`` from the content of a response.
+    """
+    return '"%s"' % md5(content).hexdigest()
+
+
+def static_response(request, content, content_type, etag=None, max_age=None, private=False):
+    """
+    Returns a response for ``content``, or a ``304`` if the client already has
+    it, with an ``ETag`` & a ``Cache-Control`` ``max-age`` (by default, the
+    ``TASTYPIE_SCHEMA_MAX_AGE`` setting).
+
+    The ``ETag`` is weak, since the body may yet be compressed (which changes
+    its bytes but not its meaning). Pass ``private=True`` for responses that
+    needed authentication, so that shared caches won't hand them out.
+    """
+    if etag is None:
+        etag = content_etag(content)
+
+    if max_age is None:
+        max_age = getattr(settings, 'TASTYPIE_SCHEMA_MAX_AGE', 3600)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if if_none_match and etag_matches(etag, if_none_match):
+        response = HttpNotModified()
+    else:
+        response = HttpResponse(content=content, content_type=content_type)
+
+    response['ETag'] = 'W/%s' % etag
+
+    if private:
+        patch_cache_control(response, private=True, max_age=max_age)
+    else:
+        patch_cache_control(response, max_age=max_age)
+
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
@@ -0,0 +1,279 @@
+"""
+Negotiation and application of HTTP content codings (``gzip``/``deflate``),
+as found in the ``Accept-Encoding`` and ``Content-Encoding`` headers.
+
+See http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.3
+"""
+import zlib
+
+from django.utils.cache import patch_vary_headers
+from tastypie.exceptions import BadRequest, UnsupportedEncoding, RequestEntityTooLarge
+
+
+# ``wbits`` values understood by ``zlib`` for each content coding. ``gzip``
+# adds the gzip header/trailer, ``deflate`` is the zlib format (RFC 1950) that
+# HTTP actually means by "deflate".
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+DEFLATE_WBITS = zlib.MAX_WBITS
+
+CODING_WBITS = {
+    'gzip': GZIP_WBITS,
+    'x-gzip': GZIP_WBITS,
+    'deflate': DEFLATE_WBITS,
+}
+
+# Status codes that must not (or never usefully) carry an encoded body.
+UNCOMPRESSIBLE_STATUS_CODES = (204, 206, 304)
+
+
+def parse_accept_encoding(header):
+    """
+    Parses an ``Accept-Encoding`` header into a dictionary of lowercased
+    content codings and their quality values.
+
+    Malformed quality values are treated as ``1.0``, as most clients never
+    send them at all.
+    """
+    codings = {}
+
+    for bit in (header or '').split(','):
+        bit = bit.strip()
+
+        if not bit:
+            continue
+
+        params = bit.split(';')
+        coding = params.pop(0).strip().lower()
+        quality = 1.0
+
+        for param in params:
+            key, _, value = param.partition('=')
+
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 1.0
+
+        codings[coding] = quality
+
+    return codings
+
+
+def determine_encoding(request, encodings=('gzip', 'deflate')):
+    """
+    Picks the content coding to use for the response, given the
+    ``Accept-Encoding`` header of the ``request`` and the codings the server
+    is willing to produce (in order of preference).
+
+    Returns ``None`` if the response should be sent as-is.
+    """
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    if not accepted:
+        return None
+
+    best_coding, best_quality = None, 0.0
+
+    for coding in encodings:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+
+        # Strictly greater, so that server preference breaks ties.
+        if quality > best_quality:
+            best_coding, best_quality = coding, quality
+
+    return best_coding
+
+
+def compress_string(content, encoding='gzip', level=6):
+    """
+    Compresses a whole string with the given content coding.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, CODING_WBITS[encoding])
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_sequence(sequence, encoding='gzip', level=6):
+    """
+    Lazily compresses an iterable of strings with the given content coding.
+
+    Each chunk is flushed as it is produced, so that a streamed response keeps
+    streaming rather than being buffered until the end.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, CODING_WBITS[encoding])
+
+    for chunk in sequence:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def compress_response(request, response, encodings=('gzip', 'deflate'), min_length=1024, level=6):
+    """
+    Compresses the body of ``response`` in place if the client accepts one of
+    ``encodings``.
+
+    String bodies shorter than ``min_length`` bytes are left alone, as the
+    compression overhead outweighs the savings. Iterator bodies (streamed
+    responses) are compressed on the fly, since their length isn't known up
+    front.
+
+    ``Vary: Accept-Encoding`` is added to every response that could have been
+    compressed, so that caches don't hand a gzipped body to a client that
+    can't read it (or vice versa).
+    """
+    if not encodings:
+        return response
+
+    if response.status_code in UNCOMPRESSIBLE_STATUS_CODES:
+        return response
+
+    # Somebody (possibly a middleware or the view) already encoded it.
+    if response.has_header('Content-Encoding'):
+        return response
+
+    is_string = getattr(response, '_is_string', True)
+
+    if is_string and len(response.content) < min_length:
+        if len(response.content):
+            patch_vary_headers(response, ('Accept-Encoding',))
+
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = determine_encoding(request, encodings)
+
+    if encoding is None:
+        return response
+
+    if is_string:
+        compressed = compress_string(response.content, encoding, level)
+
+        # Incompressible (already compressed, random, etc.) content.
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+    else:
+        response._container = compress_sequence(response._container, encoding, level)
+        del(response['Content-Length'])
+
+    response['Content-Encoding'] = encoding
+    return response
+
+
+class DecompressingStream(object):
+    """
+    A read-only, file-like wrapper that inflates a ``gzip``/``deflate``
+    encoded ``stream`` as it is read.
+
+    At most ``chunk_size`` compressed bytes are pulled from the underlying
+    stream at a time, and each of those is inflated ``chunk_size`` bytes at a
+    time, so memory use stays bounded regardless of the compression ratio.
+    Once more than ``max_length`` bytes have been inflated,
+    ``RequestEntityTooLarge`` is raised, which guards against decompression
+    bombs.
+    """
+    def __init__(self, stream, encoding, max_length=None, chunk_size=64 * 1024):
+        encoding = encoding.strip().lower()
+
+        if not encoding in CODING_WBITS:
+            raise UnsupportedEncoding("The content encoding '%s' is not supported. Please use one of: %s." % (encoding, ', '.join(sorted(CODING_WBITS.keys()))))
+
+        self.stream = stream
+        self.encoding = encoding
+        self.max_length = max_length
+        self.chunk_size = chunk_size
+        self.wbits = CODING_WBITS[encoding]
+        self.decompressor = zlib.decompressobj(self.wbits)
+        self.inflated = 0
+        self.finished = False
+        self._buffer = ''
+        self._pending = ''
+
+    def _fill(self, size=None):
+        """
+        Inflates data into the buffer until it holds at least ``size`` bytes
+        or the underlying stream is exhausted.
+        """
+        while not self.finished and (size is None or len(self._buffer) < size):
+            data = self._pending or self.stream.read(self.chunk_size)
+            self._pending = ''
+
+            if not data:
+                self._append(self.decompressor.flush())
+                self.finished = True
+                break
+
+            try:
+                inflated = self.decompressor.decompress(data, self.chunk_size)
+            except zlib.error, e:
+                # Plenty of clients send a raw deflate stream (no zlib
+                # header) as "deflate". Give that a shot before giving up.
+                if self.wbits == DEFLATE_WBITS and self.inflated == 0:
+                    self.wbits = -zlib.MAX_WBITS
+                    self.decompressor = zlib.decompressobj(self.wbits)
+                    self._pending = data
+                    continue
+
+                raise BadRequest("Could not decode the '%s' request body: %s" % (self.encoding, e))
+
+            self._pending = self.decompressor.unconsumed_tail
+            self._append(inflated)
+
+    def _append(self, inflated):
+        self.inflated += len(inflated)
+
+        if self.max_length is not None and self.inflated > self.max_length:
+            raise RequestEntityTooLarge("The decoded request body exceeds the limit of %s bytes." % self.max_length)
+
+        self._buffer += inflated
+
+    def read(self, size=None):
+        if size is not None and size < 0:
+            size = None
+
+        self._fill(size)
+
+        if size is None:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
+
+    def readline(self, size=None):
+        while not '\n' in self._buffer and not self.finished:
+            if size is not None and len(self._buffer) >= size:
+                break
+
+            self._fill(len(self._buffer) + self.chunk_size)
+
+        end = self._buffer.find('\n') + 1 or len(self._buffer)
+
+        if size is not None and size >= 0:
+            end = min(end, size)
+
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+    def xreadlines(self):
+        while True:
+            line = self.readline()
+
+            if not line:
+                break
+
+            yield line
+
+    __iter__ = xreadlines
+
+    def readlines(self):
+        return list(self)
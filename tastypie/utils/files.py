@@ -0,0 +1,186 @@
+"""
+Helpers for serving files: byte ranges, validators (``ETag`` &
+``Last-Modified``) and conditional requests.
+
+See http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.35
+"""
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+import os
+import unicodedata
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.http import parse_etags, parse_http_date_safe, urlquote
+
+
+class UnsatisfiableRange(ValueError):
+    """
+    Raised when none of the requested byte ranges overlap the file.
+    """
+    pass
+
+
+def file_etag(name, size, modified=None):
+    """
+    Builds a (quoted) ``ETag`` for a stored file from its name, size and
+    modification time, so the file itself never has to be read.
+    """
+    return '"%s"' % md5(smart_str('%s:%s:%s' % (name, size, modified))).hexdigest()
+
+
+def content_disposition(name, disposition='attachment'):
+    """
+    Builds a ``Content-Disposition`` header for the file ``name``.
+
+    Headers have to be ASCII, so non-ASCII names get a ``filename`` fallback
+    (accents stripped) & the exact name as an RFC 5987 ``filename*``.
+    """
+    filename = force_unicode(os.path.basename(name))
+
+    for character in '"\\\r\n':
+        filename = filename.replace(character, '')
+
+    fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore')
+    value = '%s; filename="%s"' % (disposition, fallback or 'download')
+
+    if fallback != filename:
+        value += "; filename*=UTF-8''%s" % urlquote(filename, safe='')
+
+    return value
+
+
+def etag_matches(etag, header):
+    """
+    Checks an ``If-Match``/``If-None-Match`` header against ``etag``.
+    """
+    if header.strip() == '*':
+        return True
+
+    return etag.strip('"') in parse_etags(header)
+
+
+def parse_byte_range(header, size):
+    """
+    Parses a ``Range`` header against a file of ``size`` bytes.
+
+    Returns an inclusive ``(start, end)`` tuple, or ``None`` if the whole file
+    should be sent instead: no (or a malformed) header, or a request for
+    several ranges, which are rare enough not to be worth a multipart
+    response. Raises ``UnsatisfiableRange`` if the range lies past the end
+    of the file.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = header[len('bytes='):].split(',')
+
+    if len(ranges) != 1:
+        return None
+
+    start, sep, end = ranges[0].strip().partition('-')
+
+    if not start:
+        # The last ``end`` bytes.
+        try:
+            length = int(end)
+        except ValueError:
+            return None
+
+        if length == 0:
+            raise UnsatisfiableRange(header)
+
+        return max(size - length, 0), size - 1
+
+    try:
+        start = int(start)
+
+        if end:
+            end = int(end)
+        else:
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise UnsatisfiableRange(header)
+
+    if end < start:
+        return None
+
+    return start, min(end, size - 1)
+
+
+def check_preconditions(request, etag, modified=None):
+    """
+    Evaluates the conditional headers of ``request`` against the validators
+    of a file.
+
+    Returns ``304`` (Not Modified) or ``412`` (Precondition Failed) if the
+    request shouldn't be served as usual, ``None`` otherwise.
+    """
+    if_match = request.META.get('HTTP_IF_MATCH')
+
+    if if_match and not etag_matches(etag, if_match):
+        return 412
+
+    if_unmodified_since = parse_http_date_safe(request.META.get('HTTP_IF_UNMODIFIED_SINCE', ''))
+
+    if if_unmodified_since is not None and modified is not None and int(modified) > if_unmodified_since:
+        return 412
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if if_none_match:
+        if etag_matches(etag, if_none_match):
+            return 304
+
+        return None
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+
+    if if_modified_since is not None and modified is not None and int(modified) <= if_modified_since:
+        return 304
+
+    return None
+
+
+def range_applies(request, etag, modified=None):
+    """
+    Checks the ``If-Range`` header, which makes a ``Range`` request conditional
+    on the file being unchanged.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+
+    if not if_range:
+        return True
+
+    if if_range.strip().startswith('"') or if_range.strip().startswith('W/'):
+        return if_range.strip() == etag
+
+    date = parse_http_date_safe(if_range)
+    return date is not None and modified is not None and int(modified) <= date
+
+
+def file_range_iterator(file, start=0, length=None, chunk_size=64 * 1024):
+    """
+    Yields ``length`` bytes of ``file`` (all of it if ``None``), starting at
+    ``start``, in ``chunk_size`` pieces. The file is closed once exhausted.
+    """
+    try:
+        file.seek(start)
+
+        while length is None or length > 0:
+            if length is None:
+                chunk = file.read(chunk_size)
+            else:
+                chunk = file.read(min(chunk_size, length))
+                length -= len(chunk)
+
+            if not chunk:
+                break
+
+            yield chunk
+    finally:
+        file.close()
@@ -0,0 +1,252 @@
+"""
+Incremental reading of large JSON documents.
+
+Rather than loading a whole request body and decoding it in one go, the
+``JSONArrayReader`` scans the stream just far enough to find the boundaries of
+the next element of a list and decodes only that element. This keeps memory
+use proportional to a single element rather than to the whole document.
+"""
+import re
+
+from django.utils import simplejson as json
+from tastypie.exceptions import BadRequest
+
+
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+STRUCTURAL = re.compile(r'[\[\]{}"]')
+STRING_SPECIAL = re.compile(r'["\\]')
+SCALAR_END = re.compile(r'[,\]}\s]')
+
+
+class JSONArrayReader(object):
+    """
+    Iterates over the elements of a JSON list as they're read from ``stream``.
+
+    If ``key`` is provided, the document is expected to be an object and the
+    list is the value of its top-level ``key`` member (e.g. ``objects``). Other
+    top-level members are skipped without being decoded. If ``key`` is
+    ``None``, the document itself is expected to be a list.
+
+    Call ``open()`` to advance the stream to the start of the list, which
+    raises ``BadRequest`` if there isn't one, then iterate to get each
+    decoded element in turn::
+
+        reader = JSONArrayReader(request, key='objects')
+        reader.open()
+
+        for obj in reader:
+            ...
+    """
+    def __init__(self, stream, key='objects', chunk_size=64 * 1024):
+        self.stream = stream
+        self.key = key
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.opened = False
+        self.finished = False
+
+    def open(self):
+        """
+        Scans forward to the opening bracket of the list.
+        """
+        if self.opened:
+            return
+
+        if self.key is None:
+            self._expect('[')
+        else:
+            self._find_key()
+
+        self.opened = True
+
+        # Deal with empty lists up front.
+        if self._peek() == ']':
+            self.pos += 1
+            self.finished = True
+
+    def __iter__(self):
+        self.open()
+
+        while not self.finished:
+            yield self._read_value()
+
+            char = self._peek()
+
+            if char == ']':
+                self.pos += 1
+                self.finished = True
+            elif char == ',':
+                self.pos += 1
+            else:
+                self._error("Expected ',' or ']'")
+
+    # Scanning.
+
+    def _more(self):
+        """
+        Reads another chunk from the stream into the buffer. Returns ``False``
+        once the stream is exhausted.
+        """
+        if self.eof:
+            return False
+
+        chunk = self.stream.read(self.chunk_size)
+
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer += chunk
+        return True
+
+    def _compact(self):
+        """
+        Drops the already consumed part of the buffer.
+        """
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+    def _peek(self):
+        """
+        Skips whitespace and returns the next character without consuming it
+        (or an empty string at the end of the stream).
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            self._compact()
+
+            if not self._more():
+                return ''
+
+    def _expect(self, expected):
+        if self._peek() != expected:
+            self._error("Expected '%s'" % expected)
+
+        self.pos += 1
+
+    def _error(self, message):
+        raise BadRequest("JSON parse error - %s at byte %d of the current chunk." % (message, self.pos))
+
+    def _find_key(self):
+        self._expect('{')
+
+        while True:
+            char = self._peek()
+
+            if char == '}' or char == '':
+                raise BadRequest("Invalid data sent. The '%s' key is missing." % self.key)
+
+            if char != '"':
+                self._error("Expected an object key")
+
+            member = self._decode(self.pos, self._scan_string(self.pos))
+            self._expect(':')
+
+            if member == self.key:
+                self._expect('[')
+                return
+
+            # Skip the value without decoding it.
+            self._peek()
+            self._compact()
+            self.pos = self._scan_value(self.pos)
+
+            if self._peek() == ',':
+                self.pos += 1
+
+    def _read_value(self):
+        self._peek()
+        self._compact()
+        end = self._scan_value(self.pos)
+        return self._decode(self.pos, end)
+
+    def _decode(self, start, end):
+        try:
+            value = json.loads(self.buffer[start:end])
+        except ValueError, e:
+            raise BadRequest('JSON parse error - %s' % unicode(e))
+
+        self.pos = end
+        return value
+
+    def _scan_value(self, start):
+        """
+        Returns the index just past the end of the value starting at
+        ``start``, reading more of the stream as needed.
+        """
+        char = self.buffer[start:start + 1]
+
+        if char == '':
+            self._error("Unexpected end of data")
+        elif char == '"':
+            return self._scan_string(start)
+        elif char in '{[':
+            return self._scan_container(start)
+
+        return self._scan_scalar(start)
+
+    def _scan_string(self, start):
+        index = start + 1
+
+        while True:
+            match = STRING_SPECIAL.search(self.buffer, index)
+
+            if match is None:
+                index = len(self.buffer)
+            elif match.group() == '"':
+                return match.end()
+            elif match.end() < len(self.buffer):
+                # Skip the escaped character.
+                index = match.end() + 1
+                continue
+            else:
+                index = match.start()
+
+            if not self._more():
+                self._error("Unterminated string")
+
+    def _scan_container(self, start):
+        depth = 0
+        index = start
+
+        while True:
+            match = STRUCTURAL.search(self.buffer, index)
+
+            if match is None:
+                index = len(self.buffer)
+
+                if not self._more():
+                    self._error("Unterminated object or list")
+
+                continue
+
+            char = match.group()
+
+            if char == '"':
+                index = self._scan_string(match.start())
+            elif char in '{[':
+                depth += 1
+                index = match.end()
+            else:
+                depth -= 1
+                index = match.end()
+
+                if depth == 0:
+                    return index
+
+    def _scan_scalar(self, start):
+        while True:
+            match = SCALAR_END.search(self.buffer, start)
+
+            if match is not None:
+                return match.start()
+
+            if not self._more():
+                return len(self.buffer)
@@ -0,0 +1,127 @@
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+
+# Indexes into the linked list nodes.
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """
+    A small, thread-safe, in-process mapping that holds at most ``max_size``
+    items, discarding the least recently used one when full.
+
+    Used to memoize cheap-to-key but relatively expensive-to-compute results
+    (content negotiation, parser resolution and the like) for the life of the
+    process.
+    """
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._data = {}
+        # Circular doubly linked list, most recently used item first.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        self._lock.acquire()
+
+        try:
+            node = self._data[key]
+            self._unlink(node)
+            self._link(node)
+            return node[VALUE]
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self._lock.acquire()
+
+        try:
+            if key in self._data:
+                node = self._data[key]
+                node[VALUE] = value
+                self._unlink(node)
+            else:
+                if len(self._data) >= self.max_size:
+                    oldest = self._root[PREV]
+                    self._unlink(oldest)
+                    del(self._data[oldest[KEY]])
+
+                node = [None, None, key, value]
+                self._data[key] = node
+
+            self._link(node)
+        finally:
+            self._lock.release()
+
+    def __delitem__(self, key):
+        self._lock.acquire()
+
+        try:
+            self._unlink(self._data.pop(key))
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default=None):
+        self._lock.acquire()
+
+        try:
+            node = self._data.pop(key, None)
+
+            if node is None:
+                return default
+
+            self._unlink(node)
+            return node[VALUE]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+
+        try:
+            self._data.clear()
+            self._root[:] = [self._root, self._root, None, None]
+        finally:
+            self._lock.release()
+
+    def keys(self):
+        """
+        Returns the keys, most recently used first.
+        """
+        self._lock.acquire()
+
+        try:
+            keys = []
+            node = self._root[NEXT]
+
+            while node is not self._root:
+                keys.append(node[KEY])
+                node = node[NEXT]
+
+            return keys
+        finally:
+            self._lock.release()
+
+    def _link(self, node):
+        first = self._root[NEXT]
+        node[PREV], node[NEXT] = self._root, first
+        first[PREV] = self._root[NEXT] = node
+
+    def _unlink(self, node):
+        node[PREV][NEXT], node[NEXT][PREV] = node[NEXT], node[PREV]
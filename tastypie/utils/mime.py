@@ -23,6 +23,18 @@ def media_type_matches(lhs, rhs):
     # Result of best match is a matching mimetype, or '' if no match is found
     return len(mimeparse.best_match([rhs], lhs)) > 0
 
+def bare_media_type(content_type):
+    """
+    Returns the media type of a ``Content-Type`` header, lowercased & without
+    its parameters (``multipart/form-data; boundary=xyz`` gives
+    ``multipart/form-data``).
+    """
+    try:
+        return ('%s/%s' % tuple(mimeparse.parse_mime_type(content_type)[:2])).lower()
+    except ValueError:
+        # Malformed. Hand it on as it is, parameters aside.
+        return content_type.split(';')[0].strip().lower()
+
 def determine_format(request, serializer, default_format='application/json'):
     """
     Tries to "smartly" determine which output format is desired.
@@ -35,24 +47,50 @@ def determine_format(request, serializer, default_format='application/json'):
     
     If still no format is found, returns the ``default_format`` (which defaults
     to ``application/json`` if not provided).
+    
+    The result is memoized on the request, as it's needed several times over
+    the course of a single request/response cycle.
     """
+    requested_format = request.GET.get('format')
+    accept = request.META.get('HTTP_ACCEPT', '*/*')
+    memo_key = (id(serializer), default_format, requested_format, 'callback' in request.GET, accept)
+    memo = getattr(request, '_tastypie_formats', None)
+    
+    if memo is None:
+        memo = {}
+        
+        try:
+            request._tastypie_formats = memo
+        except AttributeError:
+            pass
+    
+    if not memo_key in memo:
+        memo[memo_key] = _determine_format(request, serializer, default_format, requested_format, accept)
+    
+    return memo[memo_key]
+
+
+def _determine_format(request, serializer, default_format, requested_format, accept):
     # First, check if they forced the format.
-    if request.GET.get('format'):
-        if request.GET['format'] in serializer.formats:
-            return serializer.get_mime_for_format(request.GET['format'])
+    if requested_format:
+        if requested_format in serializer.formats:
+            return serializer.get_mime_for_format(requested_format)
     
     # If callback parameter is present, use JSONP.
-    if request.GET.has_key('callback'):
+    if 'callback' in request.GET:
         return serializer.get_mime_for_format('jsonp')
     
     # Try to fallback on the Accepts header.
-    if request.META.get('HTTP_ACCEPT', '*/*') != '*/*':
-        formats = list(serializer.supported_formats) or []
-        # Reverse the list, because mimeparse is weird like that. See also
-        # https://github.com/toastdriven/django-tastypie/issues#issue/12 for
-        # more information.
-        formats.reverse()
-        best_format = mimeparse.best_match(formats, request.META['HTTP_ACCEPT'])
+    if accept != '*/*':
+        if hasattr(serializer, 'best_match'):
+            best_format = serializer.best_match(accept)
+        else:
+            formats = list(serializer.supported_formats) or []
+            # Reverse the list, because mimeparse is weird like that. See also
+            # https://github.com/toastdriven/django-tastypie/issues#issue/12 for
+            # more information.
+            formats.reverse()
+            best_format = mimeparse.best_match(formats, accept)
         
         if best_format:
             return best_format
@@ -6,11 +6,16 @@ from core.tests.authentication import *
 from core.tests.authorization import *
 from core.tests.cache import *
 from core.tests.commands import *
+from core.tests.downloads import *
 from core.tests.fields import *
 from core.tests.http import *
+from core.tests.multipart import *
 from core.tests.paginator import *
+from core.tests.parsers import *
 from core.tests.resources import *
 from core.tests.serializers import *
+from core.tests.storage import *
 from core.tests.throttle import *
+from core.tests.uploads import *
 from core.tests.utils import *
 from core.tests.validation import *
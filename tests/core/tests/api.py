@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
+from django.utils import simplejson as json
 from django.http import HttpRequest
 from django.test import TestCase
 from tastypie.api import Api
+from tastypie.authentication import Authentication, BasicAuthentication
 from tastypie.exceptions import NotRegistered
 from tastypie.resources import Resource, ModelResource
 from core.models import Note
@@ -19,6 +21,25 @@ class UserResource(ModelResource):
         queryset = User.objects.all()
 
 
+class StaffAuthentication(Authentication):
+    def is_authenticated(self, request, **kwargs):
+        return getattr(request, 'is_staff', False)
+
+
+class BasicAuthNoteResource(ModelResource):
+    class Meta:
+        resource_name = 'privatenotes'
+        queryset = Note.objects.filter(is_active=True)
+        authentication = BasicAuthentication()
+
+
+class StaffUserResource(ModelResource):
+    class Meta:
+        resource_name = 'staffusers'
+        queryset = User.objects.all()
+        authentication = StaffAuthentication()
+
+
 class ApiTestCase(TestCase):
     urls = 'core.tests.api_urls'
     
@@ -122,8 +143,8 @@ class ApiTestCase(TestCase):
         api.register(UserResource())
         
         patterns = api.urls
-        self.assertEqual(len(patterns), 3)
-        self.assertEqual(sorted([pattern.name for pattern in patterns if hasattr(pattern, 'name')]), ['api_v1_top_level'])
+        self.assertEqual(len(patterns), 4)
+        self.assertEqual(sorted([pattern.name for pattern in patterns if hasattr(pattern, 'name')]), ['api_v1_schema', 'api_v1_top_level'])
         self.assertEqual([[pattern.name for pattern in include.url_patterns if hasattr(pattern, 'name')] for include in patterns if hasattr(include, 'reverse_dict')], [['api_dispatch_list', 'api_get_schema', 'api_get_multiple', 'api_dispatch_detail'], ['api_dispatch_list', 'api_get_schema', 'api_get_multiple', 'api_dispatch_detail']])
         
         api = Api(api_name='v2')
@@ -131,8 +152,8 @@ class ApiTestCase(TestCase):
         api.register(UserResource())
         
         patterns = api.urls
-        self.assertEqual(len(patterns), 3)
-        self.assertEqual(sorted([pattern.name for pattern in patterns if hasattr(pattern, 'name')]), ['api_v2_top_level'])
+        self.assertEqual(len(patterns), 4)
+        self.assertEqual(sorted([pattern.name for pattern in patterns if hasattr(pattern, 'name')]), ['api_v2_schema', 'api_v2_top_level'])
         self.assertEqual([[pattern.name for pattern in include.url_patterns if hasattr(pattern, 'name')] for include in patterns if hasattr(include, 'reverse_dict')], [['api_dispatch_list', 'api_get_schema', 'api_get_multiple', 'api_dispatch_detail'], ['api_dispatch_list', 'api_get_schema', 'api_get_multiple', 'api_dispatch_detail']])
     
     def test_top_level(self):
@@ -157,4 +178,81 @@ class ApiTestCase(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp['content-type'].split(';')[0], 'text/javascript')
         self.assertEqual(resp.content, 'foo({"notes": {"list_endpoint": "/api/v1/notes/", "schema": "/api/v1/notes/schema/"}, "users": {"list_endpoint": "/api/v1/users/", "schema": "/api/v1/users/schema/"}})')
+    
+    def test_top_level_caching(self):
+        api = Api()
+        api.register(NoteResource())
+        request = HttpRequest()
+        
+        resp = api.top_level(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['ETag'].startswith('W/"'))
+        self.assertTrue('max-age=3600' in resp['Cache-Control'])
+        etag = resp['ETag']
+        
+        # Served from the cache, until the registry changes.
+        api.build_top_level = None
+        self.assertEqual(api.top_level(request)['ETag'], etag)
+        del api.build_top_level
+        
+        request.META = {'HTTP_IF_NONE_MATCH': etag}
+        resp = api.top_level(request)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, '')
+        
+        api.register(UserResource())
+        resp = api.top_level(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        
+        # Each JSONP callback gets its own response.
+        request = HttpRequest()
+        request.META = {'HTTP_ACCEPT': 'text/javascript'}
+        request.GET = {'callback': 'bar'}
+        self.assertTrue(api.top_level(request).content.startswith('bar('))
+        request.GET = {'callback': 'baz'}
+        self.assertTrue(api.top_level(request).content.startswith('baz('))
+    
+    def test_schema(self):
+        api = Api()
+        api.register(NoteResource())
+        api.register(UserResource())
+        request = HttpRequest()
+        request.GET = {'format': 'json'}
+        request.method = 'GET'
+        
+        resp = api.schema(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.has_header('ETag'))
+        schemas = json.loads(resp.content)
+        self.assertEqual(sorted(schemas.keys()), ['notes', 'users'])
+        self.assertEqual(schemas['notes'], json.loads(api.canonical_resource_for('notes').get_schema(request).content))
+        self.assertFalse('private' in resp['Cache-Control'])
+    
+    def test_schema_authentication(self):
+        api = Api()
+        api.register(NoteResource())
+        api.register(BasicAuthNoteResource())
+        api.register(StaffUserResource())
+        request = HttpRequest()
+        request.GET = {'format': 'json'}
+        request.method = 'GET'
+        
+        # Resources the client can't authenticate with are left out.
+        resp = api.schema(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content).keys(), ['notes'])
+        self.assertFalse('private' in resp['Cache-Control'])
+        etag = resp['ETag']
+        
+        # As soon as one is included, the response is private.
+        request.is_staff = True
+        resp = api.schema(request)
+        self.assertEqual(sorted(json.loads(resp.content).keys()), ['notes', 'staffusers'])
+        self.assertTrue('private' in resp['Cache-Control'])
+        self.assertNotEqual(resp['ETag'], etag)
+        
+        # The public response is still cached separately.
+        request.is_staff = False
+        self.assertEqual(api.schema(request)['ETag'], etag)
 
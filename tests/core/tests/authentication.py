@@ -1,12 +1,18 @@
 import base64
 import python_digest
+import time
+from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.cache import cache
 from django.http import HttpRequest
 from django.test import TestCase
-from tastypie.authentication import Authentication, BasicAuthentication, ApiKeyAuthentication, DigestAuthentication
+from django.utils import simplejson
+from tastypie.authentication import Authentication, BasicAuthentication, ApiKeyAuthentication, DigestAuthentication, TokenAuthentication
+from tastypie.exceptions import Unauthorized
 from tastypie.http import HttpUnauthorized
-from tastypie.models import ApiKey, create_api_key
+from tastypie.models import ApiKey, api_key_filter, create_api_key, digest_cache_key
+from tastypie.utils.bloom import BloomFilter
 
 
 class AuthenticationTestCase(TestCase):
@@ -28,6 +34,14 @@ class AuthenticationTestCase(TestCase):
         self.assertEqual(auth.get_identifier(request), '127.0.0.1_nebula.local')
 
 
+class CountingBackend(ModelBackend):
+    calls = 0
+    
+    def authenticate(self, username=None, password=None):
+        self.calls += 1
+        return super(CountingBackend, self).authenticate(username=username, password=password)
+
+
 class BasicAuthenticationTestCase(TestCase):
     fixtures = ['note_testdata.json']
     
@@ -59,6 +73,49 @@ class BasicAuthenticationTestCase(TestCase):
         john_doe.save()
         request.META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('johndoe:pass')
         self.assertEqual(auth.is_authenticated(request), True)
+    
+    def test_cache(self):
+        cache.clear()
+        backend = CountingBackend()
+        auth = BasicAuthentication(backend=backend, cache_timeout=60)
+        john_doe = User.objects.get(username='johndoe')
+        john_doe.set_password('pass')
+        john_doe.save()
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('johndoe:pass')
+        
+        self.assertEqual(auth.is_authenticated(request), True)
+        self.assertEqual(auth.is_authenticated(request), True)
+        self.assertEqual(request.user, john_doe)
+        self.assertEqual(backend.calls, 1)
+        
+        # A wrong password isn't let through by the cache.
+        request.META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('johndoe:wrong')
+        self.assertRaises(Unauthorized, auth.is_authenticated, request)
+        self.assertEqual(backend.calls, 2)
+        
+        # Changing the password clears the cache.
+        request.META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('johndoe:pass')
+        self.assertEqual(auth.is_authenticated(request), True)
+        self.assertEqual(backend.calls, 2)
+        john_doe.set_password('new')
+        john_doe.save()
+        self.assertRaises(Unauthorized, auth.is_authenticated, request)
+        self.assertEqual(backend.calls, 3)
+        
+        # Even when it's changed without sending any signals.
+        request.META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('johndoe:new')
+        self.assertEqual(auth.is_authenticated(request), True)
+        john_doe.set_password('newer')
+        User.objects.filter(pk=john_doe.pk).update(password=john_doe.password)
+        self.assertRaises(Unauthorized, auth.is_authenticated, request)
+        
+        # Caching is off by default.
+        auth = BasicAuthentication(backend=backend)
+        request.META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('johndoe:newer')
+        self.assertEqual(auth.is_authenticated(request), True)
+        self.assertEqual(auth.is_authenticated(request), True)
+        self.assertEqual(backend.calls, 7)
 
 
 class ApiKeyAuthenticationTestCase(TestCase):
@@ -67,6 +124,7 @@ class ApiKeyAuthenticationTestCase(TestCase):
     def setUp(self):
         super(ApiKeyAuthenticationTestCase, self).setUp()
         ApiKey.objects.all().delete()
+        cache.clear()
     
     def test_is_authenticated(self):
         auth = ApiKeyAuthentication()
@@ -97,6 +155,86 @@ class ApiKeyAuthenticationTestCase(TestCase):
         request.GET['username'] = 'johndoe'
         request.GET['api_key'] = john_doe.api_key.key
         self.assertEqual(auth.is_authenticated(request), True)
+    
+    def test_cache(self):
+        auth = ApiKeyAuthentication()
+        john_doe = User.objects.get(username='johndoe')
+        api_key = ApiKey.objects.create(user=john_doe)
+        request = HttpRequest()
+        request.GET['username'] = 'johndoe'
+        request.GET['api_key'] = api_key.key
+        
+        # One query to check the key, then just the user.
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        self.assertEqual(request.user, john_doe)
+        
+        # A wrong key isn't let through by the cache.
+        request.GET['api_key'] = 'foo'
+        self.assertRaises(Unauthorized, auth.is_authenticated, request)
+        
+        # Changing the key clears the cache.
+        old_key = api_key.key
+        api_key.key = api_key.generate_key()
+        api_key.save()
+        request.GET['api_key'] = old_key
+        self.assertRaises(Unauthorized, auth.is_authenticated, request)
+        request.GET['api_key'] = api_key.key
+        self.assertEqual(auth.is_authenticated(request), True)
+        
+        # As does renaming the user.
+        john_doe.username = 'jdoe'
+        john_doe.save()
+        self.assertRaises(Unauthorized, auth.is_authenticated, request)
+        
+        # Without the cache, every request checks the key.
+        auth = ApiKeyAuthentication(cache_timeout=0)
+        request.GET['username'] = 'jdoe'
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        self.assertNumQueries(1, auth.is_authenticated, request)
+    
+    def test_filter(self):
+        api_key_filter.filter = None
+        auth = ApiKeyAuthentication(cache_timeout=0, use_filter=True)
+        john_doe = User.objects.get(username='johndoe')
+        api_key = ApiKey.objects.create(user=john_doe)
+        request = HttpRequest()
+        request.GET['username'] = 'johndoe'
+        request.GET['api_key'] = api_key.key
+        
+        # Building the filter takes two queries, then checking the key one.
+        self.assertNumQueries(3, auth.is_authenticated, request)
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        
+        # Unknown keys are turned away without any query.
+        request.GET['api_key'] = 'foo'
+        self.assertRaises(Unauthorized, self.assertNumQueries, 0, auth.is_authenticated, request)
+        
+        # Keys added by this process don't make the filter stale.
+        jane_doe = User.objects.get(username='janedoe')
+        other_key = ApiKey.objects.create(user=jane_doe)
+        self.assertRaises(Unauthorized, self.assertNumQueries, 0, auth.is_authenticated, request)
+        request.GET['username'] = 'janedoe'
+        request.GET['api_key'] = other_key.key
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        
+        # Keys added by other processes are let through to the database until
+        # the filter may be rebuilt...
+        api_key_filter.filter = BloomFilter()
+        api_key_filter.built = time.time()
+        api_key_filter.bump_version()
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        self.assertEqual(request.user, jane_doe)
+        
+        request.GET['api_key'] = 'foo'
+        self.assertRaises(Unauthorized, self.assertNumQueries, 1, auth.is_authenticated, request)
+        
+        # ...then picked up by a single rebuild.
+        api_key_filter.built -= api_key_filter.min_rebuild_interval
+        self.assertRaises(Unauthorized, self.assertNumQueries, 2, auth.is_authenticated, request)
+        self.assertRaises(Unauthorized, self.assertNumQueries, 0, auth.is_authenticated, request)
+        request.GET['api_key'] = other_key.key
+        self.assertEqual(auth.is_authenticated(request), True)
 
 
 class DigestAuthenticationTestCase(TestCase):
@@ -105,6 +243,7 @@ class DigestAuthenticationTestCase(TestCase):
     def setUp(self):
         super(DigestAuthenticationTestCase, self).setUp()
         ApiKey.objects.all().delete()
+        cache.clear()
     
     def test_is_authenticated(self):
         auth = DigestAuthentication()
@@ -151,3 +290,188 @@ class DigestAuthenticationTestCase(TestCase):
         )
         auth_request = auth.is_authenticated(request)
         self.assertEqual(auth_request, True)
+    
+    def build_request(self, auth, nonce_count, challenge, password):
+        request = HttpRequest()
+        request.method = 'GET'
+        request.META['HTTP_AUTHORIZATION'] = python_digest.build_authorization_request('johndoe', 'GET', '/', nonce_count, digest_challenge=challenge, password=password)
+        return request
+    
+    def challenge(self, auth):
+        try:
+            auth.is_authenticated(HttpRequest())
+        except Unauthorized, e:
+            return e.headers['WWW-Authenticate']
+    
+    def test_nonces(self):
+        auth = DigestAuthentication(nonce_timeout=60)
+        john_doe = User.objects.get(username='johndoe')
+        api_key = ApiKey.objects.create(user=john_doe)
+        challenge = self.challenge(auth)
+        
+        # The nonce can be reused with new nonce counts, out of order even.
+        self.assertEqual(auth.is_authenticated(self.build_request(auth, 1, challenge, api_key.key)), True)
+        self.assertEqual(auth.is_authenticated(self.build_request(auth, 3, challenge, api_key.key)), True)
+        self.assertEqual(auth.is_authenticated(self.build_request(auth, 2, challenge, api_key.key)), True)
+        
+        # But not replayed.
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.build_request(auth, 2, challenge, api_key.key))
+        
+        # Wrong keys don't use up nonce counts.
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.build_request(auth, 4, challenge, 'wrong'))
+        self.assertEqual(auth.is_authenticated(self.build_request(auth, 4, challenge, api_key.key)), True)
+        
+        # Expired nonces are stale.
+        old_time = time.time
+        
+        try:
+            time.time = lambda: old_time() + 120
+            
+            try:
+                auth.is_authenticated(self.build_request(auth, 5, challenge, api_key.key))
+                self.fail()
+            except Unauthorized, e:
+                self.assertTrue('stale="true"' in e.headers['WWW-Authenticate'])
+        finally:
+            time.time = old_time
+    
+    def test_cache(self):
+        auth = DigestAuthentication()
+        john_doe = User.objects.get(username='johndoe')
+        api_key = ApiKey.objects.create(user=john_doe)
+        challenge = self.challenge(auth)
+        
+        self.assertNumQueries(2, auth.is_authenticated, self.build_request(auth, 1, challenge, api_key.key))
+        request = self.build_request(auth, 2, challenge, api_key.key)
+        self.assertNumQueries(1, auth.is_authenticated, request)
+        self.assertEqual(request.user.pk, john_doe.pk)
+        
+        # Nothing a client could authenticate with is cached.
+        self.assertEqual(cache.get(digest_cache_key('johndoe')), john_doe.pk)
+        
+        # Changing the key clears the cache.
+        old_key = api_key.key
+        api_key.key = api_key.generate_key()
+        api_key.save()
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.build_request(auth, 3, challenge, old_key))
+        self.assertEqual(auth.is_authenticated(self.build_request(auth, 4, challenge, api_key.key)), True)
+        
+        # The cache is per realm.
+        other = DigestAuthentication(realm='other')
+        self.assertRaises(Unauthorized, other.is_authenticated, self.build_request(other, 5, challenge, api_key.key))
+    
+    def test_filter(self):
+        api_key_filter.filter = None
+        auth = DigestAuthentication(cache_timeout=0, use_filter=True)
+        challenge = self.challenge(auth)
+        
+        # johndoe has no key, so isn't looked up.
+        api_key_filter.rebuild()
+        self.assertRaises(Unauthorized, self.assertNumQueries, 0, auth.is_authenticated, self.build_request(auth, 1, challenge, 'foo'))
+        
+        api_key = ApiKey.objects.create(user=User.objects.get(username='johndoe'))
+        self.assertEqual(auth.is_authenticated(self.build_request(auth, 2, challenge, api_key.key)), True)
+
+
+class TokenAuthenticationTestCase(TestCase):
+    fixtures = ['note_testdata.json']
+    
+    def setUp(self):
+        super(TokenAuthenticationTestCase, self).setUp()
+        ApiKey.objects.all().delete()
+        cache.clear()
+        self.john_doe = User.objects.get(username='johndoe')
+    
+    def request_with(self, token):
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        return request
+    
+    def test_is_authenticated(self):
+        auth = TokenAuthentication()
+        token = auth.issue_token(self.john_doe, ['read'])
+        
+        # No token.
+        self.assertRaises(Unauthorized, auth.is_authenticated, HttpRequest())
+        
+        # Checking a token doesn't touch the database.
+        request = self.request_with(token)
+        self.assertNumQueries(0, auth.is_authenticated, request)
+        self.assertEqual(auth.get_identifier(request), 'johndoe')
+        self.assertEqual(request.user.pk, self.john_doe.pk)
+        
+        # Tampered with.
+        payload, signature = token.split('.')
+        forged = TokenAuthentication()._encode(simplejson.dumps({'k': '1', 'u': 1, 'n': 'daniel', 's': ['read'], 'e': int(time.time()) + 60, 'j': 'x'}))
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.request_with('%s.%s' % (forged, signature)))
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.request_with('garbage'))
+        
+        # Expired.
+        expired = auth.issue_token(self.john_doe, ['read'], lifetime=-1)
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.request_with(expired))
+        
+        # Scopes.
+        self.assertEqual(TokenAuthentication(scopes=['read']).is_authenticated(self.request_with(token)), True)
+        self.assertRaises(Unauthorized, TokenAuthentication(scopes=['read', 'write']).is_authenticated, self.request_with(token))
+    
+    def test_key_rotation(self):
+        old = TokenAuthentication(key_ids=['1'])
+        token = old.issue_token(self.john_doe)
+        
+        rotated = TokenAuthentication(key_ids=['2', '1'])
+        self.assertEqual(rotated.is_authenticated(self.request_with(token)), True)
+        self.assertEqual(rotated.verify_token(rotated.issue_token(self.john_doe))['k'], '2')
+        self.assertRaises(Unauthorized, old.is_authenticated, self.request_with(rotated.issue_token(self.john_doe)))
+        
+        retired = TokenAuthentication(key_ids=['2'])
+        self.assertRaises(Unauthorized, retired.is_authenticated, self.request_with(token))
+    
+    def test_revocation(self):
+        auth = TokenAuthentication()
+        token = auth.issue_token(self.john_doe)
+        other = auth.issue_token(self.john_doe)
+        self.assertEqual(auth.is_authenticated(self.request_with(token)), True)
+        
+        self.assertEqual(auth.revoke_token(token), True)
+        self.assertEqual(auth.revoke_token('garbage'), False)
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.request_with(token))
+        self.assertEqual(auth.is_authenticated(self.request_with(other)), True)
+        
+        # Revocations don't overwrite each other.
+        self.assertEqual(TokenAuthentication().revoke_token(other), True)
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.request_with(token))
+        self.assertRaises(Unauthorized, auth.is_authenticated, self.request_with(other))
+        
+        # Unless they aren't checked.
+        self.assertEqual(TokenAuthentication(check_revocation=False).is_authenticated(self.request_with(token)), True)
+    
+    def test_exchange(self):
+        auth = TokenAuthentication(allowed_scopes=['read', 'write'])
+        api_key = ApiKey.objects.create(user=self.john_doe)
+        request = HttpRequest()
+        request.method = 'POST'
+        request.POST['username'] = 'johndoe'
+        request.POST['api_key'] = api_key.key
+        request.POST['scopes'] = 'read'
+        
+        resp = auth.exchange(request)
+        self.assertEqual(resp.status_code, 200)
+        data = simplejson.loads(resp.content)
+        self.assertEqual(data['scopes'], ['read'])
+        self.assertEqual(auth.verify_token(data['token'])['s'], ['read'])
+        
+        request.POST['scopes'] = 'read admin'
+        self.assertEqual(auth.exchange(request).status_code, 400)
+        
+        request.POST['scopes'] = 'read'
+        request.POST['api_key'] = 'foo'
+        self.assertEqual(auth.exchange(request).status_code, 401)
+        
+        request.method = 'GET'
+        self.assertEqual(auth.exchange(request).status_code, 405)
+        
+        # Clients send credentials, not cookies.
+        self.assertEqual(auth.exchange.csrf_exempt, True)
+        patterns = auth.urls
+        self.assertEqual([pattern.name for pattern in patterns], ['api_token_exchange'])
+        self.assertEqual(patterns[0].resolve('token/').func, auth.exchange)
@@ -1,8 +1,12 @@
+from StringIO import StringIO
 from django.test import TestCase
 from django.http import HttpRequest
-from django.contrib.auth.models import User, Permission
+from django.contrib.auth.models import Group, User, Permission
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
 from core.models import Note
-from tastypie.authorization import Authorization, ReadOnlyAuthorization, DjangoAuthorization
+from tastypie.authorization import Authorization, AuthorizationContext, ReadOnlyAuthorization, DjangoAuthorization, OwnerDjangoAuthorization
+from tastypie.exceptions import Unauthorized
 from tastypie.resources import ModelResource
 
 
@@ -27,6 +31,28 @@ class DjangoNoteResource(ModelResource):
         authorization = DjangoAuthorization()
 
 
+class OwnerNoteResource(ModelResource):
+    class Meta:
+        resource_name = 'notes'
+        queryset = Note.objects.all()
+        authorization = OwnerDjangoAuthorization(owner_field='author')
+
+
+class CountingAuthorization(Authorization):
+    calls = 0
+    
+    def get_limits(self, request, _and, _or):
+        self.calls += 1
+        return True
+
+
+class CountingNoteResource(ModelResource):
+    class Meta:
+        resource_name = 'notes'
+        queryset = Note.objects.filter(is_active=True)
+        authorization = CountingAuthorization()
+
+
 class AuthorizationTestCase(TestCase):
     fixtures = ['note_testdata']
 
@@ -106,3 +132,134 @@ class DjangoAuthorizationTestCase(TestCase):
         for method in ('GET', 'POST', 'PUT', 'DELETE'):
             request.method = method
             self.assertTrue(DjangoNoteResource()._meta.authorization.is_authorized(request))
+
+
+class AuthorizationContextTestCase(TestCase):
+    fixtures = ['note_testdata']
+    
+    def setUp(self):
+        cache.clear()
+        self.add = Permission.objects.get_by_natural_key('add_note', 'core', 'note')
+        self.change = Permission.objects.get_by_natural_key('change_note', 'core', 'note')
+        self.user = User.objects.all()[0]
+        self.user.user_permissions.add(self.add)
+        group = Group.objects.create(name='editors')
+        group.permissions.add(self.change)
+        self.user.groups.add(group)
+    
+    def test_has_perm(self):
+        request = HttpRequest()
+        request.user = self.user
+        context = AuthorizationContext.for_request(request)
+        self.assertTrue(AuthorizationContext.for_request(request) is context)
+        
+        # All the permissions are loaded at once.
+        self.assertNumQueries(1, context.has_perm, 'core.add_note')
+        self.assertNumQueries(0, context.has_perm, 'core.change_note')
+        self.assertNumQueries(0, context.has_perm, 'core.delete_note')
+        self.assertEqual(context.permissions(), frozenset(['core.add_note', 'core.change_note']))
+        self.assertEqual(context.permissions(), self.user.get_all_permissions())
+        
+        # Superusers have them all, inactive users none.
+        self.user.is_superuser = True
+        self.assertTrue(AuthorizationContext(self.user).has_perm('core.delete_note'))
+        self.user.is_active = False
+        self.assertFalse(AuthorizationContext(self.user).has_perm('core.add_note'))
+        
+        # Changing users gets a new context.
+        request.user = User.objects.all()[1]
+        self.assertFalse(AuthorizationContext.for_request(request) is context)
+    
+    def test_cache(self):
+        self.assertNumQueries(1, AuthorizationContext(self.user, cache_timeout=60).has_perm, 'core.add_note')
+        self.assertNumQueries(0, AuthorizationContext(self.user, cache_timeout=60).has_perm, 'core.add_note')
+        
+        # Changing permissions invalidates the cache.
+        delete = Permission.objects.get_by_natural_key('delete_note', 'core', 'note')
+        self.user.user_permissions.add(delete)
+        self.assertNumQueries(1, AuthorizationContext(self.user, cache_timeout=60).has_perm, 'core.delete_note')
+        Group.objects.get(name='editors').permissions.remove(self.change)
+        self.assertFalse(AuthorizationContext(self.user, cache_timeout=60).has_perm('core.change_note'))
+    
+    def test_limits(self):
+        resource = CountingNoteResource()
+        request = HttpRequest()
+        request.method = 'GET'
+        request.user = self.user
+        
+        for i in range(3):
+            self.assertEqual(len(resource.apply_authorization_limits(request, Note.objects.all())), 6)
+        
+        self.assertEqual(resource._meta.authorization.calls, 1)
+        resource.apply_authorization_limits(HttpRequest(), Note.objects.all())
+        self.assertEqual(resource._meta.authorization.calls, 2)
+
+
+class OwnerDjangoAuthorizationTestCase(TestCase):
+    fixtures = ['note_testdata']
+    
+    def setUp(self):
+        self.johndoe = User.objects.get(username='johndoe')
+        self.janedoe = User.objects.get(username='janedoe')
+        self.resource = OwnerNoteResource()
+    
+    def build_request(self, method, user):
+        request = HttpRequest()
+        request.method = method
+        request.user = user
+        return request
+    
+    def test_limits(self):
+        notes = Note.objects.all()
+        owned = set(Note.objects.filter(author=self.johndoe).values_list('pk', flat=True))
+        self.assertTrue(owned)
+        self.assertNotEqual(len(owned), notes.count())
+        
+        # Reads aren't limited.
+        self.assertEqual(self.resource.apply_authorization_limits(self.build_request('GET', self.johndoe), notes).count(), notes.count())
+        
+        # Writes are, in the query itself.
+        limited = self.resource.apply_authorization_limits(self.build_request('PUT', self.johndoe), notes)
+        self.assertTrue('author_id' in str(limited.query))
+        self.assertEqual(set(limited.values_list('pk', flat=True)), owned)
+        
+        self.assertEqual(self.resource.apply_authorization_limits(self.build_request('DELETE', None), notes).count(), 0)
+    
+    def test_delete_list(self):
+        others = Note.objects.exclude(author=self.johndoe).count()
+        self.resource.obj_delete_list(request=self.build_request('DELETE', self.johndoe))
+        self.assertEqual(Note.objects.filter(author=self.johndoe).count(), 0)
+        self.assertEqual(Note.objects.count(), others)
+    
+    def test_is_authorized(self):
+        note = Note.objects.filter(author=self.johndoe)[0]
+        note = Note.objects.get(pk=note.pk)
+        authorization = self.resource._meta.authorization
+        
+        # Ownership is checked without loading the author.
+        self.assertNumQueries(0, authorization.is_authorized, self.build_request('PUT', self.johndoe), note)
+        self.assertTrue(authorization.is_authorized(self.build_request('PUT', self.johndoe), note))
+        self.assertFalse(authorization.is_authorized(self.build_request('PUT', self.janedoe), note))
+        self.assertEqual(authorization.is_authorized(self.build_request('GET', self.janedoe), note), None)
+    
+    def test_put_detail_not_owned(self):
+        note = Note.objects.filter(author=self.johndoe)[0]
+        count = Note.objects.count()
+        content = '{"content": "PWNED", "created": "2010-04-03 20:05:00", "is_active": true, "slug": "pwned", "title": "PWNED", "updated": "2010-04-03 20:05:00"}'
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'PUT',
+            'PATH_INFO': '/api/v1/notes/%s/' % note.pk,
+            'QUERY_STRING': 'format=json',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': StringIO(content),
+        })
+        request.user = self.janedoe
+        self.resource.wrap_request(request)
+        
+        # Someone else's object isn't "missing", so it isn't created over.
+        self.assertRaises(Unauthorized, self.resource.put_detail, request, pk=note.pk)
+        note = Note.objects.get(pk=note.pk)
+        self.assertNotEqual(note.title, 'PWNED')
+        self.assertEqual(note.author, self.johndoe)
+        self.assertEqual(Note.objects.count(), count)
@@ -1,8 +1,9 @@
+import time
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.db import models
 from django.test import TestCase
-from tastypie.models import ApiKey, create_api_key
+from tastypie.models import ApiAccess, ApiAccessRollup, ApiKey, create_api_key
 
 
 class BackfillApiKeysTestCase(TestCase):
@@ -38,3 +39,88 @@ class BackfillApiKeysTestCase(TestCase):
             api_key = ApiKey.objects.get(user=new_user)
         except ApiKey.DoesNotExist:
             self.fail("No key means the command didn't work.")
+    
+    def test_batches(self):
+        users = [User.objects.create_user(username='user_%d' % i, password='password', email='user_%d@example.com' % i) for i in range(5)]
+        ApiKey.objects.create(user=users[0])
+        blank = ApiKey.objects.create(user=users[1])
+        ApiKey.objects.filter(pk=blank.pk).update(key='')
+        
+        call_command('backfill_api_keys', verbosity=0, dry_run=True)
+        self.assertEqual(ApiKey.objects.count(), 2)
+        
+        call_command('backfill_api_keys', verbosity=0, batch_size=2)
+        self.assertEqual(ApiKey.objects.count(), 5)
+        self.assertEqual(ApiKey.objects.filter(key='').count(), 0)
+        self.assertEqual(len(set(ApiKey.objects.values_list('key', flat=True))), 5)
+        
+        for user in users:
+            self.assertEqual(len(ApiKey.objects.get(user=user).key), 40)
+        
+        # Nothing left to do.
+        call_command('backfill_api_keys', verbosity=0, batch_size=2)
+        self.assertEqual(ApiKey.objects.count(), 5)
+
+
+class RollupApiAccessesTestCase(TestCase):
+    def access(self, identifier, accessed, url='/api/v1/notes/', request_method='get'):
+        # ``ApiAccess.save`` stamps the current time.
+        access = ApiAccess.objects.create(identifier=identifier, url=url, request_method=request_method)
+        ApiAccess.objects.filter(pk=access.pk).update(accessed=accessed)
+    
+    def test_command(self):
+        now = int(time.time())
+        hour = now - now % 3600
+        old = hour - 30 * 24 * 3600
+        
+        for i in range(3):
+            self.access('daniel', old + i)
+        
+        self.access('daniel', old + 10, request_method='post')
+        self.access('daniel', hour)
+        self.access('cody', hour + 1)
+        
+        call_command('rollup_api_accesses', verbosity=0, batch_size=2, lag=0)
+        self.assertEqual(ApiAccessRollup.objects.count(), 4)
+        self.assertEqual(ApiAccessRollup.objects.get(identifier='daniel', period_start=old, request_method='get').count, 3)
+        self.assertEqual(ApiAccessRollup.objects.get(identifier='daniel', period_start=old, request_method='post').count, 1)
+        self.assertEqual(ApiAccessRollup.objects.get(identifier='cody').period_length, 3600)
+        
+        # The old accesses have been pruned.
+        self.assertEqual(ApiAccess.objects.count(), 2)
+        
+        # Accesses are only ever counted once.
+        self.access('daniel', hour + 2)
+        call_command('rollup_api_accesses', verbosity=0, lag=0)
+        self.assertEqual(ApiAccessRollup.objects.get(identifier='daniel', period_start=hour).count, 2)
+        self.assertEqual(ApiAccess.objects.count(), 3)
+        
+        usage = list(ApiAccessRollup.objects.usage(identifier='daniel'))
+        self.assertEqual(usage, [{'url': u'/api/v1/notes/', 'request_method': u'get', 'accesses': 5}, {'url': u'/api/v1/notes/', 'request_method': u'post', 'accesses': 1}])
+        usage = list(ApiAccessRollup.objects.usage(identifier='daniel', since=hour))
+        self.assertEqual(usage, [{'url': u'/api/v1/notes/', 'request_method': u'get', 'accesses': 2}])
+        
+        # Nothing's pruned without a retention.
+        call_command('rollup_api_accesses', verbosity=0, retention=0, period=60, lag=0)
+        self.assertEqual(ApiAccess.objects.count(), 3)
+    
+    def test_lag(self):
+        now = int(time.time())
+        old = now - 30 * 24 * 3600
+        
+        self.access('daniel', old)
+        self.access('daniel', now - 1)
+        # Written late (say, by a buffered logger), after a newer access.
+        self.access('cody', old)
+        
+        # Only accesses below the first recent one are counted, or pruned.
+        call_command('rollup_api_accesses', verbosity=0)
+        self.assertEqual(ApiAccessRollup.objects.get().identifier, 'daniel')
+        self.assertEqual(ApiAccessRollup.objects.get().count, 1)
+        self.assertEqual(ApiAccess.objects.count(), 2)
+        
+        # Once it's old enough, the late one is counted too.
+        call_command('rollup_api_accesses', verbosity=0, lag=0)
+        self.assertEqual(ApiAccessRollup.objects.get(identifier='daniel', period_start=(now - 1) - (now - 1) % 3600).count, 1)
+        self.assertEqual(ApiAccessRollup.objects.get(identifier='cody').count, 1)
+        self.assertEqual(ApiAccess.objects.count(), 1)
@@ -0,0 +1,182 @@
+from StringIO import StringIO
+from django.conf.urls.defaults import *
+from django.core.files.base import ContentFile
+from django.core.handlers.wsgi import WSGIRequest
+from django.test import TestCase
+from tastypie.api import Api
+from tastypie.authorization import Authorization
+from tastypie.fields import FileField
+from tastypie.resources import ModelResource
+from tastypie.utils.files import UnsatisfiableRange, check_preconditions, content_disposition, file_etag, file_range_iterator, parse_byte_range, range_applies
+from core.models import Note, MediaBit
+
+
+class DownloadMediaBitResource(ModelResource):
+    image = FileField(attribute='image', null=True)
+
+    class Meta:
+        resource_name = 'mediabits'
+        queryset = MediaBit.objects.all()
+        authorization = Authorization()
+        file_downloads = True
+
+
+api = Api(api_name='v1')
+api.register(DownloadMediaBitResource())
+
+urlpatterns = patterns('',
+    (r'^api/', include(api.urls)),
+)
+
+
+def build_request(method='GET', **meta):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': '/api/v1/mediabits/1/image/download/',
+        'QUERY_STRING': '',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': StringIO(''),
+    }
+    environ.update(meta)
+    return WSGIRequest(environ)
+
+
+class FileHelpersTestCase(TestCase):
+    def test_parse_byte_range(self):
+        self.assertEqual(parse_byte_range(None, 100), None)
+        self.assertEqual(parse_byte_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_byte_range('bytes=0-0', 100), (0, 0))
+        self.assertEqual(parse_byte_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_byte_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_byte_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_byte_range('bytes=-200', 100), (0, 99))
+        self.assertEqual(parse_byte_range('bytes=0-1,5-6', 100), None)
+        self.assertEqual(parse_byte_range('bytes=9-0', 100), None)
+        self.assertEqual(parse_byte_range('items=0-9', 100), None)
+        self.assertEqual(parse_byte_range('bytes=a-b', 100), None)
+        self.assertRaises(UnsatisfiableRange, parse_byte_range, 'bytes=100-', 100)
+        self.assertRaises(UnsatisfiableRange, parse_byte_range, 'bytes=-0', 100)
+
+    def test_preconditions(self):
+        etag = file_etag('bits/a.txt', 10, 1000000000)
+        self.assertNotEqual(etag, file_etag('bits/a.txt', 11, 1000000000))
+        self.assertEqual(check_preconditions(build_request(), etag, 1000000000), None)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_NONE_MATCH=etag), etag, 1000000000), 304)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_NONE_MATCH='"other"'), etag, 1000000000), None)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_MATCH='"other"'), etag, 1000000000), 412)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_MATCH='*'), etag, 1000000000), None)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_MODIFIED_SINCE='Sun, 09 Sep 2001 01:46:40 GMT'), etag, 1000000000), 304)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_MODIFIED_SINCE='Sun, 09 Sep 2001 01:46:39 GMT'), etag, 1000000000), None)
+        self.assertEqual(check_preconditions(build_request(HTTP_IF_UNMODIFIED_SINCE='Sun, 09 Sep 2001 01:46:39 GMT'), etag, 1000000000), 412)
+
+        self.assertTrue(range_applies(build_request(), etag, 1000000000))
+        self.assertTrue(range_applies(build_request(HTTP_IF_RANGE=etag), etag, 1000000000))
+        self.assertFalse(range_applies(build_request(HTTP_IF_RANGE='"other"'), etag, 1000000000))
+        self.assertTrue(range_applies(build_request(HTTP_IF_RANGE='Sun, 09 Sep 2001 01:46:40 GMT'), etag, 1000000000))
+        self.assertFalse(range_applies(build_request(HTTP_IF_RANGE='Sun, 09 Sep 2001 01:46:39 GMT'), etag, 1000000000))
+
+    def test_content_disposition(self):
+        self.assertEqual(content_disposition('bits/a.txt'), 'attachment; filename="a.txt"')
+        self.assertEqual(content_disposition('bits/"a"\r\n.txt'), 'attachment; filename="a.txt"')
+        self.assertEqual(content_disposition(u'bits/caf\xe9.txt'), "attachment; filename=\"cafe.txt\"; filename*=UTF-8''caf%C3%A9.txt")
+        self.assertEqual(content_disposition(u'\u732b.txt'), "attachment; filename=\".txt\"; filename*=UTF-8''%E7%8C%AB.txt")
+        self.assertEqual(content_disposition(u'\u732b'), "attachment; filename=\"download\"; filename*=UTF-8''%E7%8C%AB")
+
+    def test_file_range_iterator(self):
+        self.assertEqual(list(file_range_iterator(StringIO('abcdefghij'), chunk_size=4)), ['abcd', 'efgh', 'ij'])
+        self.assertEqual(list(file_range_iterator(StringIO('abcdefghij'), 2, 5, chunk_size=4)), ['cdef', 'g'])
+
+
+class FileDownloadTestCase(TestCase):
+    urls = 'core.tests.downloads'
+
+    def setUp(self):
+        self.resource = api.canonical_resource_for('mediabits')
+        note = Note.objects.create(title='Downloads', slug='downloads')
+        self.bit = MediaBit.objects.create(note=note, title='Text')
+        self.bit.image.save('download.txt', ContentFile('0123456789'))
+        self.pk = str(self.bit.pk)
+        self.old_sendfile_header = self.resource._meta.sendfile_header
+
+    def tearDown(self):
+        self.resource._meta.sendfile_header = self.old_sendfile_header
+        self.bit.image.delete(save=False)
+
+    def test_urls(self):
+        patterns = self.resource.nested_urls()
+        self.assertEqual([pattern.name for pattern in patterns], ['api_dispatch_download'])
+        self.assertEqual(self.resource._build_reverse_url('api_dispatch_download', kwargs={'api_name': 'v1', 'resource_name': 'mediabits', 'pk': self.pk, 'file_field': 'image'}), '/api/v1/mediabits/%s/image/download/' % self.pk)
+
+    def test_download(self):
+        resp = self.resource.dispatch_download(build_request(), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, '0123456789')
+        self.assertEqual(resp['Content-Length'], '10')
+        self.assertEqual(resp['Content-Type'], 'text/plain')
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+        self.assertTrue(resp['Content-Disposition'].startswith('attachment; filename="download'))
+        etag = resp['ETag']
+
+        resp = self.resource.dispatch_download(build_request(HTTP_IF_NONE_MATCH=etag), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+
+        resp = self.resource.dispatch_download(build_request(HTTP_RANGE='bytes=2-5'), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, '2345')
+        self.assertEqual(resp['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(resp['Content-Length'], '4')
+
+        # A stale ``If-Range`` gets the whole file.
+        resp = self.resource.dispatch_download(build_request(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"'), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, '0123456789')
+
+        resp = self.resource.dispatch_download(build_request(HTTP_RANGE='bytes=20-'), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp['Content-Range'], 'bytes */10')
+
+        resp = self.resource.dispatch_download(build_request('HEAD'), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, '')
+        self.assertEqual(resp['Content-Length'], '10')
+
+        resp = self.resource.dispatch_download(build_request(), file_field='image', pk='999')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_sendfile(self):
+        self.resource._meta.sendfile_header = 'X-Accel-Redirect'
+        resp = self.resource.dispatch_download(build_request(), file_field='image', pk=self.pk)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, '')
+        self.assertEqual(resp['X-Accel-Redirect'], '/protected/%s' % self.bit.image.name)
+
+        self.resource._meta.sendfile_header = 'X-Sendfile'
+        resp = self.resource.dispatch_download(build_request(), file_field='image', pk=self.pk)
+        self.assertEqual(resp['X-Sendfile'], self.bit.image.path)
+
+    def test_non_ascii_name(self):
+        # The file system's encoding may not cope, so the file's faked.
+        class FakeStorage(object):
+            def open(self, name, mode='rb'):
+                return StringIO('0123456789')
+
+            def path(self, name):
+                return u'/srv/media/%s' % name
+
+        class FakeFile(object):
+            name = u'bits/caf\xe9.txt'
+            storage = FakeStorage()
+
+        resp = self.resource.file_response(build_request(), FakeFile(), 10, '"etag"', None)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, '0123456789')
+        self.assertEqual(resp['Content-Disposition'], "attachment; filename=\"cafe.txt\"; filename*=UTF-8''caf%C3%A9.txt")
+
+        self.resource._meta.sendfile_header = 'X-Sendfile'
+        resp = self.resource.file_response(build_request(), FakeFile(), 10, '"etag"', None)
+        self.assertEqual(resp['X-Sendfile'], '/srv/media/bits/caf\xc3\xa9.txt')
+
+        self.resource._meta.sendfile_header = 'X-Accel-Redirect'
+        resp = self.resource.file_response(build_request(), FakeFile(), 10, '"etag"', None)
+        self.assertEqual(resp['X-Accel-Redirect'], '/protected/bits/caf%C3%A9.txt')
@@ -0,0 +1,103 @@
+import base64
+from StringIO import StringIO
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.test import TestCase
+from tastypie.multipart import Base64Decoder, HTTPAttachment, MultiPartParserError
+from tastypie.resources import Resource
+
+
+class MultipartResource(Resource):
+    class Meta:
+        resource_name = 'multipart'
+
+
+def build_request(parts, boundary='BoUnDaRy', method='POST', resource=None):
+    body = []
+
+    for headers, content in parts:
+        body.append('--%s\r\n%s\r\n\r\n%s\r\n' % (boundary, '\r\n'.join(headers), content))
+
+    body.append('--%s--\r\n' % boundary)
+    body = ''.join(body)
+    request = WSGIRequest({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': '/api/v1/multipart/',
+        'QUERY_STRING': 'format=json',
+        'CONTENT_TYPE': 'multipart/mixed; boundary=%s' % boundary,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': StringIO(body),
+    })
+    (resource or MultipartResource()).wrap_request(request)
+    return request
+
+
+class Base64DecoderTestCase(TestCase):
+    def test_decode(self):
+        content = ''.join([chr(i) for i in range(256)]) * 4
+        encoded = base64.encodestring(content)
+
+        for chunk_size in (1, 3, 5, 76, 1024):
+            decoder = Base64Decoder()
+            decoded = ''.join([decoder.decode(encoded[i:i + chunk_size]) for i in range(0, len(encoded), chunk_size)])
+            decoded += decoder.flush()
+            self.assertEqual(decoded, content)
+
+    def test_truncated(self):
+        decoder = Base64Decoder()
+        self.assertEqual(decoder.decode('aGVsbG8'), 'hel')
+        self.assertRaises(MultiPartParserError, decoder.flush)
+
+
+class HTTPAttachmentTestCase(TestCase):
+    def test_content(self):
+        attachment = HTTPAttachment('{"hello": "world"}', {'content-type': ('application/json', {'charset': 'utf-8'})})
+        self.assertEqual(attachment.size, 18)
+        self.assertEqual(attachment['Content-Type'], 'application/json; charset=utf-8')
+        self.assertEqual(attachment.META, {'CONTENT_TYPE': 'application/json; charset=utf-8'})
+        self.assertEqual(attachment.read(8), '{"hello"')
+        self.assertEqual(attachment.remaining, 10)
+        self.assertEqual(attachment.content, '{"hello": "world"}')
+        self.assertEqual(attachment.read(), ': "world"}')
+        self.assertEqual(list(attachment.chunks(10)), ['{"hello": ', '"world"}'])
+
+    def test_file(self):
+        attachment = HTTPAttachment(headers={'X-Custom': 'yes'}, file=StringIO('abc'))
+        self.assertEqual(attachment.size, 3)
+        self.assertEqual(attachment.META, {'HTTP_X_CUSTOM': 'yes'})
+        self.assertEqual(attachment.read(), 'abc')
+
+
+class MultiPartMixedParserTestCase(TestCase):
+    def setUp(self):
+        self.old_max_memory_size = settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = 1024
+
+    def tearDown(self):
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = self.old_max_memory_size
+
+    def test_parse(self):
+        large = 'x' * 4096
+        request = build_request([
+            (['Content-Type: application/json'], '{"name": "Daniel"}'),
+            (['Content-Type: text/plain', 'Content-Transfer-Encoding: base64'], base64.encodestring(large)),
+            (['Content-Type: text/plain'], '   '),
+            (['Content-Disposition: form-data; name="title"'], 'A title'),
+            (['Content-Type: text/plain', 'Content-Location: /Some/Path/'], 'Hi'),
+        ])
+
+        self.assertEqual(request.POST['title'], u'A title')
+        self.assertEqual(len(request.DATA), 3)
+        json_part, text_part, located_part = request.DATA
+        self.assertEqual(json_part.META['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(json_part.read(), '{"name": "Daniel"}')
+        # Large parts are spooled to disk, rather than held in memory.
+        self.assertEqual(text_part.size, 4096)
+        self.assertTrue(text_part.file._rolled)
+        self.assertEqual(text_part.read(), large)
+        self.assertEqual(located_part['Content-Location'], '/Some/Path/')
+
+        # Parts can go straight to the resource's parsers.
+        request = build_request([(['Content-Type: application/json'], '{"name": "Daniel"}')])
+        self.assertEqual(request.DATA.META['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(MultipartResource().deserialize(request), {'name': 'Daniel'})
@@ -0,0 +1,130 @@
+from StringIO import StringIO
+from django.test import TestCase
+from tastypie.exceptions import BadRequest
+from tastypie.parsers import BaseParser, JSONParser, FormParser, PlainTextParser, YAMLParser, XMLParser, PListParser, ParserRegistry, DEFAULT_PARSERS, DEFAULT_PARSER_REGISTRY
+from tastypie.resources import Resource
+
+
+class CSVParser(BaseParser):
+    media_type = 'text/csv'
+
+
+class CatchAllParser(BaseParser):
+    media_type = '*/*'
+
+
+class CSVResource(Resource):
+    class Meta:
+        resource_name = 'csv'
+        parsers = DEFAULT_PARSER_REGISTRY.extend(CSVParser)
+
+
+class JSONOnlyResource(Resource):
+    class Meta:
+        resource_name = 'jsononly'
+        parsers = [JSONParser]
+
+
+class ParserRegistryTestCase(TestCase):
+    def test_default_parsers(self):
+        expected = [parser for parser in (JSONParser, YAMLParser, XMLParser, PListParser, FormParser) if parser is not None]
+        self.assertEqual(list(DEFAULT_PARSERS), expected)
+        self.assertEqual([parser.__class__ for parser in DEFAULT_PARSER_REGISTRY], expected)
+    
+    def test_register(self):
+        registry = ParserRegistry([JSONParser])
+        self.assertEqual(len(registry), 1)
+        
+        # Classes are instantiated once.
+        json_parser = list(registry)[0]
+        self.assertTrue(isinstance(json_parser, JSONParser))
+        self.assertTrue(registry.resolve('application/json') is json_parser)
+        self.assertTrue(registry.resolve('application/json') is json_parser)
+        
+        self.assertEqual(registry.resolve('text/plain'), None)
+        text_parser = registry.register(PlainTextParser())
+        self.assertTrue(registry.resolve('text/plain') is text_parser)
+        
+        registry.unregister(PlainTextParser)
+        self.assertEqual(registry.resolve('text/plain'), None)
+        self.assertEqual(len(registry), 1)
+    
+    def test_resolution_order(self):
+        registry = ParserRegistry([JSONParser, CatchAllParser])
+        self.assertTrue(isinstance(registry.resolve('application/json'), JSONParser))
+        self.assertTrue(isinstance(registry.resolve('text/csv'), CatchAllParser))
+        
+        registry.register(CSVParser, first=True)
+        self.assertTrue(isinstance(registry.resolve('text/csv'), CSVParser))
+        self.assertTrue(isinstance(registry.resolve('application/json'), JSONParser))
+    
+    def test_cache_key(self):
+        registry = ParserRegistry([JSONParser, FormParser])
+        form_parser = registry.resolve('multipart/form-data; boundary=aaaa')
+        self.assertTrue(isinstance(form_parser, FormParser))
+        
+        # Each multipart request has a boundary of its own, but the same parser.
+        self.assertTrue(registry.resolve('multipart/form-data; boundary=bbbb') is form_parser)
+        self.assertTrue(registry.resolve('Multipart/Form-Data; boundary="cccc"') is form_parser)
+        self.assertTrue(isinstance(registry.resolve('application/json; charset=utf-8'), JSONParser))
+        self.assertEqual(sorted(registry._cache.keys()), ['application/json', 'multipart/form-data'])
+    
+    def test_extend(self):
+        registry = ParserRegistry([JSONParser])
+        extended = registry.extend(CSVParser)
+        self.assertEqual(len(registry), 1)
+        self.assertEqual([parser.__class__ for parser in extended], [JSONParser, CSVParser])
+        self.assertEqual(registry.resolve('text/csv'), None)
+        self.assertTrue(isinstance(extended.resolve('text/csv'), CSVParser))
+        
+        first = registry.extend(CatchAllParser, first=True)
+        self.assertEqual([parser.__class__ for parser in first], [CatchAllParser, JSONParser])
+    
+    def test_resource_parsers(self):
+        csv = CSVResource()
+        self.assertTrue(isinstance(csv._meta.parsers, ParserRegistry))
+        self.assertTrue(isinstance(csv.determine_parser('text/csv'), CSVParser))
+        self.assertTrue(isinstance(csv.determine_parser('application/json'), JSONParser))
+        
+        json_only = JSONOnlyResource()
+        self.assertTrue(isinstance(json_only._meta.parsers, ParserRegistry))
+        self.assertTrue(isinstance(json_only.determine_parser('application/json; charset=utf-8'), JSONParser))
+        self.assertEqual(json_only.determine_parser('text/csv'), None)
+
+
+class IterParseTestCase(TestCase):
+    def test_json_iterparse(self):
+        parser = JSONParser()
+        content = '{"meta": {"total_count": 2}, "objects": [{"id": 1}, {"id": 2}]}'
+        self.assertEqual(list(parser.iterparse(content)), [{'id': 1}, {'id': 2}])
+        self.assertEqual(list(parser.iterparse(StringIO(content))), [{'id': 1}, {'id': 2}])
+        self.assertRaises(BadRequest, parser.iterparse, '{"meta": {}}')
+    
+    def test_default_iterparse(self):
+        parser = PlainTextParser()
+        parser.parse = lambda content, content_type=None, request=None: {'objects': [1, 2]}
+        self.assertEqual(list(parser.iterparse('')), [1, 2])
+        self.assertRaises(BadRequest, parser.iterparse, '', key='nope')
+
+
+class ParserTestCase(TestCase):
+    def test_xml(self):
+        if XMLParser is None:
+            return
+        
+        parser = XMLParser()
+        self.assertEqual(parser.parse('<?xml version="1.0" encoding="utf-8"?><object><title>First</title><views type="integer">3</views><is_active type="boolean">True</is_active><tags type="list"><value>a</value><value>b</value></tags><parent type="null"/></object>'), {'title': 'First', 'views': 3, 'is_active': True, 'tags': ['a', 'b'], 'parent': None})
+        self.assertEqual(parser.parse('<request><objects><object><title>First</title></object></objects></request>'), [{'title': 'First'}])
+        self.assertRaises(BadRequest, parser.parse, '<object><title>')
+        
+        # External entities aren't resolved.
+        data = parser.parse('<?xml version="1.0"?><!DOCTYPE object [<!ENTITY secret SYSTEM "file:///etc/passwd">]><object><title>&secret;</title></object>')
+        self.assertFalse(data['title'])
+    
+    def test_yaml(self):
+        if YAMLParser is None:
+            return
+        
+        parser = YAMLParser()
+        self.assertEqual(parser.parse('title: First\nviews: 3\n'), {'title': 'First', 'views': 3})
+        self.assertRaises(BadRequest, parser.parse, 'title: [First\n')
@@ -1,22 +1,27 @@
 import base64
 import copy
 import datetime
+import gc
+import weakref
+import zlib
 from decimal import Decimal
+from StringIO import StringIO
 import django
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.core.exceptions import FieldError, MultipleObjectsReturned
+from django.core.handlers.wsgi import WSGIRequest
 from django.core import mail
 from django.core.urlresolvers import reverse
 from django import forms
 from django.http import HttpRequest, QueryDict
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.utils import dateformat
 from tastypie.authentication import BasicAuthentication
-from tastypie.authorization import Authorization
+from tastypie.authorization import Authorization, OpenAuthorization
 from tastypie.bundle import Bundle
-from tastypie.exceptions import InvalidFilterError, InvalidSortError, ImmediateHttpResponse, BadRequest, NotFound
+from tastypie.exceptions import InvalidFilterError, InvalidSortError, ImmediateHttpResponse, BadRequest, NotFound, RequestEntityTooLarge
 from tastypie import fields
 from tastypie.paginator import Paginator
 from tastypie.resources import Resource, ModelResource, ALL, ALL_WITH_RELATIONS
@@ -25,6 +30,7 @@ from tastypie.throttle import CacheThrottle
 from tastypie.validation import Validation, FormValidation
 from core.models import Note, Subject, MediaBit
 from core.tests.mocks import MockRequest
+from core.tests.multipart import build_request as build_multipart_request
 from core.utils import SimpleHandler
 try:
     import json
@@ -532,6 +538,42 @@ class ResourceTestCase(TestCase):
         self.assertEqual(output.status_code, 200)
         self.assertEqual(output.content, '<?xml version=\'1.0\' encoding=\'utf-8\'?>\n<response><objects type="list"><object type="hash"><abc type="integer">123</abc><hello>world</hello></object></objects><meta type="hash"><page type="integer">1</page></meta></response>')
     
+    def test_create_response_compression(self):
+        basic = BasicResource()
+        request = HttpRequest()
+        request.GET = {'format': 'json'}
+        request.META = {'HTTP_ACCEPT_ENCODING': 'gzip'}
+        
+        # Below the threshold.
+        output = basic.create_response(request, {'hello': 'world'})
+        self.assertEqual(output.content, '{"hello": "world"}')
+        self.assertFalse(output.has_header('Content-Encoding'))
+        self.assertEqual(output['Vary'], 'Accept-Encoding')
+        
+        data = {'objects': [{'hello': 'world'}] * 100}
+        output = basic.create_response(request, data)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(zlib.decompress(output.content, 16 + zlib.MAX_WBITS)), data)
+    
+    def test_deserialize_content_encoding(self):
+        basic = BasicResource()
+        content = '{"name": "Daniel", "view_count": 12}'
+        
+        for encoding in ('gzip', 'deflate'):
+            compressed = zlib.compressobj(6, zlib.DEFLATED, {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}[encoding])
+            compressed = compressed.compress(content) + compressed.flush()
+            request = WSGIRequest({
+                'REQUEST_METHOD': 'POST',
+                'PATH_INFO': '/api/v1/basic/',
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': str(len(compressed)),
+                'HTTP_CONTENT_ENCODING': encoding,
+                'wsgi.input': StringIO(compressed),
+            })
+            basic.wrap_request(request)
+            self.assertEqual(basic.deserialize(request), {'name': 'Daniel', 'view_count': 12})
+    
     def test_mangled(self):
         mangled = MangledBasicResource()
         request = HttpRequest()
@@ -590,6 +632,22 @@ class AlwaysDataNoteResource(NoteResource):
         always_return_data = True
 
 
+class IncrementalNoteResource(NoteResource):
+    class Meta:
+        resource_name = 'incrementalnotes'
+        queryset = Note.objects.filter(is_active=True)
+        authorization = OpenAuthorization()
+        incremental_parsing = True
+
+
+class BatchNoteResource(NoteResource):
+    class Meta:
+        resource_name = 'notes'
+        queryset = Note.objects.filter(is_active=True)
+        authorization = OpenAuthorization()
+        batch_writes = True
+
+
 class VeryCustomNoteResource(NoteResource):
     author = fields.CharField(attribute='author__username')
     constant = fields.IntegerField(default=20)
@@ -654,6 +712,21 @@ class ThrottledNoteResource(NoteResource):
         throttle = CacheThrottle(throttle_at=2, timeframe=5, expiration=5)
 
 
+class CostlyThrottledNoteResource(NoteResource):
+    class Meta:
+        resource_name = 'costlythrottlednotes'
+        queryset = Note.objects.filter(is_active=True)
+        limit = 2
+        filtering = {
+            'slug': ['exact'],
+        }
+        throttle = CacheThrottle(throttle_at=5, timeframe=5, expiration=5)
+        throttle_costs = {
+            'get_list': 'estimate_list_cost',
+            'post': 3,
+        }
+
+
 class BasicAuthNoteResource(NoteResource):
     class Meta:
         resource_name = 'notes'
@@ -1346,6 +1419,116 @@ class ModelResourceTestCase(TestCase):
         self.assertEqual(resp.status_code, 202)
         self.assertTrue(resp.content.startswith('{"objects": ['))
     
+    def test_put_list_incremental(self):
+        resource = IncrementalNoteResource()
+        note = '{"content": "The cat is back.", "created": "2010-04-03 20:05:00", "is_active": true, "slug": "cat-is-back-%d", "title": "The Cat Is Back", "updated": "2010-04-03 20:05:00"}'
+        
+        def build_request(content):
+            request = WSGIRequest({
+                'REQUEST_METHOD': 'PUT',
+                'PATH_INFO': '/api/v1/incrementalnotes/',
+                'QUERY_STRING': 'format=json',
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': str(len(content)),
+                'wsgi.input': StringIO(content),
+            })
+            resource.wrap_request(request)
+            return request
+        
+        self.assertEqual(Note.objects.count(), 6)
+        content = '{"meta": {}, "objects": [%s]}' % ', '.join([note % i for i in range(3)])
+        resp = resource.put_list(build_request(content))
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(Note.objects.count(), 5)
+        self.assertEqual(Note.objects.filter(is_active=True).count(), 3)
+        self.assertEqual(Note.objects.filter(slug__startswith='cat-is-back-').count(), 3)
+        
+        # A body that's cut short fails (see ``PutListTransactionTestCase``).
+        content = '{"objects": [%s, %s' % (note % 3, note % 4)
+        self.assertRaises(BadRequest, resource.put_list, build_request(content))
+        self.assertRaises(BadRequest, resource.put_list, build_request('{"meta": {}}'))
+    
+    def test_put_list_incremental_bundles(self):
+        resource = IncrementalNoteResource()
+        note = '{"content": "The cat is back.", "created": "2010-04-03 20:05:00", "is_active": true, "slug": "cat-is-back-%d", "title": "The Cat Is Back", "updated": "2010-04-03 20:05:00"}'
+        content = '{"objects": [%s]}' % ', '.join([note % i for i in range(5)])
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'PUT',
+            'PATH_INFO': '/api/v1/incrementalnotes/',
+            'QUERY_STRING': 'format=json',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': StringIO(content),
+        })
+        resource.wrap_request(request)
+        bundles = []
+        alive = []
+        build_bundle = resource.build_bundle
+        obj_create = resource.obj_create
+        
+        def tracking_build_bundle(*args, **kwargs):
+            bundle = build_bundle(*args, **kwargs)
+            bundles.append(weakref.ref(bundle))
+            return bundle
+        
+        def counting_obj_create(bundle, *args, **kwargs):
+            gc.collect()
+            alive.append(len([ref for ref in bundles if ref() is not None]))
+            return obj_create(bundle, *args, **kwargs)
+        
+        resource.build_bundle = tracking_build_bundle
+        resource.obj_create = counting_obj_create
+        
+        # The transaction cleans up after a failure, so the bundles created
+        # aren't held on to.
+        resp = resource.put_list(request)
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(Note.objects.filter(slug__startswith='cat-is-back-').count(), 5)
+        self.assertEqual(alive, [1, 1, 1, 1, 1])
+    
+    def test_batch_write(self):
+        resource = BatchNoteResource()
+        note = '{"content": "The cat is back.", "created": "2010-04-03 20:05:00", "is_active": true, "slug": "cat-is-back-%d", "title": "The Cat Is Back", "updated": "2010-04-03 20:05:00"}'
+        
+        self.assertEqual(Note.objects.count(), 6)
+        request = build_multipart_request([
+            (['Content-Type: application/json', 'Content-ID: <first>'], note % 1),
+            (['Content-Type: application/json'], note % 2),
+        ], resource=resource)
+        resp = resource.post_list(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Note.objects.count(), 8)
+        results = json.loads(resp.content)['objects']
+        self.assertEqual([result['status'] for result in results], [201, 201])
+        self.assertEqual(results[0]['content_id'], '<first>')
+        first = Note.objects.get(slug='cat-is-back-1')
+        self.assertEqual(results[0]['location'], '/api/v1/notes/%s/' % first.pk)
+        
+        # One bad part fails the whole batch.
+        request = build_multipart_request([
+            (['Content-Type: application/json'], note % 3),
+            (['Content-Type: text/csv'], 'nope'),
+            (['Content-Type: application/json'], note % 4),
+        ], resource=resource)
+        resp = resource.post_list(request)
+        self.assertEqual(resp.status_code, 406)
+        results = json.loads(resp.content)['objects']
+        self.assertEqual([result['status'] for result in results], [424, 406, 424])
+        self.assertFalse('location' in results[0])
+        self.assertEqual(Note.objects.count(), 8)
+        
+        # Updates on PUT.
+        request = build_multipart_request([
+            (['Content-Type: application/json', 'Content-Location: /api/v1/notes/%s/' % first.pk], '{"title": "Updated"}'),
+            (['Content-Type: application/json'], note % 5),
+        ], method='PUT', resource=resource)
+        resp = resource.put_list(request)
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.content)['objects']
+        self.assertEqual([result['status'] for result in results], [202, 201])
+        self.assertEqual(Note.objects.get(pk=first.pk).title, u'Updated')
+        self.assertEqual(Note.objects.count(), 9)
+    
     def test_put_detail(self):
         self.assertEqual(Note.objects.count(), 6)
         resource = NoteResource()
@@ -1648,6 +1831,45 @@ class ModelResourceTestCase(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.content, '{"default_format": "application/json", "fields": {"content": {"help_text": "Unicode string data. Ex: \\"Hello World\\"", "nullable": false, "readonly": false, "type": "string"}, "created": {"help_text": "A date & time as a string. Ex: \\"2010-11-10T03:07:43\\"", "nullable": false, "readonly": false, "type": "datetime"}, "id": {"help_text": "Unicode string data. Ex: \\"Hello World\\"", "nullable": false, "readonly": false, "type": "string"}, "is_active": {"help_text": "Boolean data. Ex: True", "nullable": false, "readonly": false, "type": "boolean"}, "resource_uri": {"help_text": "Unicode string data. Ex: \\"Hello World\\"", "nullable": false, "readonly": true, "type": "string"}, "slug": {"help_text": "Unicode string data. Ex: \\"Hello World\\"", "nullable": false, "readonly": false, "type": "string"}, "title": {"help_text": "Unicode string data. Ex: \\"Hello World\\"", "nullable": false, "readonly": false, "type": "string"}, "updated": {"help_text": "A date & time as a string. Ex: \\"2010-11-10T03:07:43\\"", "nullable": false, "readonly": false, "type": "datetime"}}, "filtering": {"content": ["startswith", "exact"], "slug": ["exact"], "title": 1}, "ordering": ["title", "slug", "resource_uri"]}')
     
+    def test_get_schema_caching(self):
+        resource = NoteResource()
+        request = HttpRequest()
+        request.GET = {'format': 'json'}
+        request.method = 'GET'
+        
+        resp = resource.get_schema(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue('max-age=3600' in resp['Cache-Control'])
+        etag = resp['ETag']
+        
+        # The schema is only built once.
+        resource.build_schema = None
+        self.assertEqual(resource.get_schema(request).content, resp.content)
+        
+        request.META = {'HTTP_IF_NONE_MATCH': etag}
+        resp = resource.get_schema(request)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+        
+        # Compression doesn't change the (weak) ``ETag``, so caches must vary
+        # on the encoding too.
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertTrue('Accept-Encoding' in resp['Vary'])
+        self.assertFalse('private' in resp['Cache-Control'])
+        
+        # Schemas behind authentication stay out of shared caches.
+        class AuthenticatedNoteResource(NoteResource):
+            class Meta(NoteResource.Meta):
+                authentication = BasicAuthentication()
+        
+        resource = AuthenticatedNoteResource()
+        resource.is_authenticated = lambda request: None
+        request.META = {}
+        resp = resource.get_schema(request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue('private' in resp['Cache-Control'])
+        self.assertTrue('max-age=3600' in resp['Cache-Control'])
+    
     def test_get_multiple(self):
         resource = NoteResource()
         request = HttpRequest()
@@ -1714,6 +1936,74 @@ class ModelResourceTestCase(TestCase):
         # Restore.
         settings.DEBUG = old_debug
     
+    def test_throttle_costs(self):
+        cache.delete('noaddr_nohost_accesses')
+        resource = CostlyThrottledNoteResource()
+        request = HttpRequest()
+        request.GET = {'format': 'json'}
+        request.method = 'GET'
+        
+        self.assertEqual(NoteResource().throttle_cost(request, 'list'), 1)
+        self.assertEqual(resource.throttle_cost(request, 'list'), 1)
+        self.assertEqual(resource.throttle_cost(request, 'detail'), 1)
+        request.GET['limit'] = '5'
+        self.assertEqual(resource.throttle_cost(request, 'list'), 3)
+        request.GET['limit'] = '0'
+        self.assertEqual(resource.throttle_cost(request, 'list'), 2)
+        request.method = 'POST'
+        self.assertEqual(resource.throttle_cost(request, 'list'), 3)
+        
+        # Fully included related resources weigh in.
+        self.assertEqual(AnotherRelatedNoteResource().full_related_weight(), 1)
+        request.GET['limit'] = '20'
+        self.assertEqual(AnotherRelatedNoteResource().estimate_list_cost(request), 2)
+        
+        request.method = 'GET'
+        request.GET['limit'] = '5'
+        resp = resource.dispatch('list', request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(cache.get('noaddr_nohost_accesses')), 3)
+        
+        # Throttled, as it would cost too much.
+        self.assertRaises(ImmediateHttpResponse, resource.dispatch, 'list', request)
+        
+        # A cheaper request still goes through.
+        request.GET['limit'] = '2'
+        resp = resource.dispatch('list', request)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(cache.get('noaddr_nohost_accesses')), 4)
+        cache.delete('noaddr_nohost_accesses')
+    
+    def test_throttle_costs_count_once(self):
+        cache.delete('noaddr_nohost_accesses')
+        resource = CostlyThrottledNoteResource()
+        request = HttpRequest()
+        request.GET = {'format': 'json', 'limit': '0'}
+        request.method = 'GET'
+        
+        # Estimating the cost & paginating share one ``COUNT`` (then there's
+        # the ``SELECT``).
+        with self.assertNumQueries(2):
+            resp = resource.dispatch('list', request)
+        
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.content)
+        self.assertEqual(data['meta']['total_count'], 4)
+        self.assertEqual(len(data['objects']), 4)
+        self.assertEqual(len(cache.get('noaddr_nohost_accesses')), 2)
+        
+        # Filtered lists are counted (& charged) as such.
+        request = HttpRequest()
+        request.GET = {'format': 'json', 'limit': '0', 'slug': 'another-post'}
+        request.method = 'GET'
+        
+        with self.assertNumQueries(2):
+            resp = resource.dispatch('list', request)
+        
+        self.assertEqual(json.loads(resp.content)['meta']['total_count'], 1)
+        self.assertEqual(len(cache.get('noaddr_nohost_accesses')), 3)
+        cache.delete('noaddr_nohost_accesses')
+    
     def test_generate_cache_key(self):
         resource = NoteResource()
         self.assertEqual(resource.generate_cache_key(), 'None:notes::')
@@ -2300,6 +2590,44 @@ class ModelResourceTestCase(TestCase):
         self.assertEqual(hydrated_2.obj.author.username, 'johndoe')
 
 
+class PutListTransactionTestCase(TransactionTestCase):
+    fixtures = ['note_testdata.json']
+    
+    def build_request(self, resource, content):
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'PUT',
+            'PATH_INFO': '/api/v1/incrementalnotes/',
+            'QUERY_STRING': 'format=json',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': StringIO(content),
+        })
+        resource.wrap_request(request)
+        return request
+    
+    def test_put_list_incremental(self):
+        resource = IncrementalNoteResource()
+        note = '{"content": "The cat is back.", "created": "2010-04-03 20:05:00", "is_active": true, "slug": "cat-is-back-%d", "title": "The Cat Is Back", "updated": "2010-04-03 20:05:00"}'
+        
+        # A body that's cut short leaves the collection as it was.
+        content = '{"objects": [%s, %s' % (note % 1, note % 2)
+        self.assertRaises(BadRequest, resource.put_list, self.build_request(resource, content))
+        self.assertEqual(Note.objects.count(), 6)
+        self.assertEqual(Note.objects.filter(is_active=True).count(), 4)
+        self.assertEqual(Note.objects.filter(slug__startswith='cat-is-back-').count(), 0)
+        
+        # As does one that turns out to be too large.
+        def deserialize_list(request):
+            yield json.loads(note % 3)
+            raise RequestEntityTooLarge("Too large.")
+        
+        resource.deserialize_list = deserialize_list
+        self.assertRaises(RequestEntityTooLarge, resource.put_list, self.build_request(resource, '{}'))
+        self.assertEqual(Note.objects.count(), 6)
+        self.assertEqual(Note.objects.filter(is_active=True).count(), 4)
+        self.assertEqual(Note.objects.filter(slug__startswith='cat-is-back-').count(), 0)
+
+
 class BasicAuthResourceTestCase(TestCase):
     fixtures = ['note_testdata.json']
     
@@ -5,6 +5,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpRequest
 from django.test import TestCase
 from tastypie import fields
+from tastypie.exceptions import UnsupportedFormat
 from tastypie.serializers import Serializer
 from tastypie.resources import ModelResource
 from core.models import Note
@@ -55,6 +56,25 @@ class SerializerTestCase(TestCase):
         self.assertEqual(serializer_4.supported_formats, ['application/x-plist', 'application/json'])
         
         self.assertRaises(ImproperlyConfigured, Serializer, formats=['json', 'xml'], content_types={'json': 'text/json'})
+    
+    def test_mime_formats(self):
+        serializer_1 = Serializer()
+        self.assertEqual(serializer_1.mime_formats, {'application/json': 'json', 'text/javascript': 'jsonp', 'application/xml': 'xml', 'text/yaml': 'yaml', 'text/html': 'html', 'application/x-plist': 'plist'})
+        self.assertEqual(serializer_1.negotiable_formats, ['application/x-plist', 'text/html', 'text/yaml', 'application/xml', 'text/javascript', 'application/json'])
+        
+        serializer_2 = Serializer(formats=['json'], content_types={'json': 'text/json', 'csv': 'text/csv'})
+        self.assertEqual(serializer_2.mime_formats, {'text/json': 'json'})
+        self.assertRaises(UnsupportedFormat, serializer_2.serialize, {}, 'text/csv')
+    
+    def test_best_match(self):
+        serializer = Serializer()
+        self.assertEqual(serializer.best_match('application/xml'), 'application/xml')
+        self.assertEqual(serializer.best_match('text/plain,application/xml,application/json;q=0.9,*/*;q=0.8'), 'application/xml')
+        self.assertEqual(serializer.best_match('image/png'), '')
+        self.assertEqual(len(serializer.negotiation_cache), 3)
+        self.assertEqual(serializer.negotiation_cache['image/png'], '')
+        self.assertEqual(serializer.best_match('image/png'), '')
+        self.assertEqual(len(serializer.negotiation_cache), 3)
 
     def get_sample1(self):
         return {
@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+from django.core.files.base import ContentFile
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.http import HttpRequest
+from django.test import TestCase
+from tastypie.authorization import Authorization
+from tastypie.bundle import Bundle
+from tastypie.exceptions import ApiFieldError, BadRequest
+from tastypie.fields import AttachmentFileField
+from tastypie.resources import ModelResource
+from tastypie.storage import ContentAddressedStorage
+from core.models import Note, MediaBit
+
+
+class StorageMediaBitResource(ModelResource):
+    image = AttachmentFileField(attribute='image', null=True)
+
+    class Meta:
+        resource_name = 'mediabits'
+        queryset = MediaBit.objects.all()
+        authorization = Authorization()
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save(self):
+        name = self.storage.save('bits/cat.TXT', ContentFile('meow'))
+        content_hash = os.path.splitext(os.path.basename(name))[0]
+        self.assertEqual(len(content_hash), 64)
+        self.assertEqual(name, '%s/%s.txt' % (content_hash[:2], content_hash))
+        self.assertEqual(self.storage.open(name).read(), 'meow')
+        self.assertEqual(self.storage.references(name), 1)
+
+        # The same content is stored once.
+        self.assertEqual(self.storage.save('other/kitten.txt', SimpleUploadedFile('kitten.txt', 'meow')), name)
+        self.assertEqual(self.storage.references(name), 2)
+
+        upload = TemporaryUploadedFile('tmp.txt', 'text/plain', 4, None)
+        upload.write('meow')
+        upload.flush()
+        temporary_path = upload.temporary_file_path()
+        self.assertEqual(self.storage.save('tmp.txt', upload), name)
+        self.assertEqual(self.storage.references(name), 3)
+        self.assertFalse(os.path.exists(temporary_path))
+
+        # Different content (or extension) is stored separately.
+        self.assertNotEqual(self.storage.save('dog.txt', ContentFile('woof')), name)
+        self.assertNotEqual(self.storage.save('cat.bin', ContentFile('meow')), name)
+
+        # No temporary copies are left behind.
+        self.assertEqual([filename for filename in os.listdir(self.directory) if filename.startswith('.upload-')], [])
+
+        self.storage.delete(name)
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.references(name), 1)
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(os.path.exists(self.storage.path(name) + '.refs'))
+
+    def test_reference(self):
+        name = self.storage.save('cat.txt', ContentFile('meow'))
+        content_hash = os.path.splitext(os.path.basename(name))[0]
+
+        reference = self.storage.reference(content_hash.upper(), 'whatever.txt')
+        self.assertEqual(reference.name, name)
+        self.assertEqual(reference.size, 4)
+        self.assertEqual(self.storage.save('whatever.txt', reference), name)
+        self.assertEqual(self.storage.references(name), 2)
+
+        self.assertEqual(self.storage.reference(content_hash, 'cat.jpg'), None)
+        self.assertEqual(self.storage.reference('0' * 64), None)
+        self.assertEqual(self.storage.reference('../../etc/passwd'), None)
+
+    def test_owners(self):
+        content = ContentFile('meow')
+        content.uploaded_by = 'user:1'
+        name = self.storage.save('cat.txt', content)
+        content_hash = os.path.splitext(os.path.basename(name))[0]
+        self.assertEqual(self.storage.owners(name), ['user:1'])
+
+        # Only those who uploaded a blob can reference it.
+        self.assertEqual(self.storage.reference(content_hash, 'cat.txt', owner='user:1').name, name)
+        self.assertEqual(self.storage.reference(content_hash, 'cat.txt', owner='user:2'), None)
+
+        content = ContentFile('meow')
+        content.uploaded_by = 'user:2'
+        self.storage.save('kitten.txt', content)
+        self.storage.save('kitten.txt', content)
+        self.assertEqual(self.storage.owners(name), ['user:1', 'user:2'])
+        self.assertEqual(self.storage.reference(content_hash, 'cat.txt', owner='user:2').name, name)
+
+        for i in range(3):
+            self.storage.delete(name)
+
+        self.assertFalse(os.path.exists(self.storage.path(name) + '.owners'))
+
+
+class HashReferenceTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.model_field = MediaBit._meta.get_field('image')
+        self.old_storage = self.model_field.storage
+        self.model_field.storage = ContentAddressedStorage(location=self.directory)
+        self.note = Note.objects.create(title='Storage', slug='storage')
+
+    def tearDown(self):
+        self.model_field.storage = self.old_storage
+        shutil.rmtree(self.directory)
+
+    def test_hash_reference(self):
+        resource = StorageMediaBitResource()
+        first = MediaBit.objects.create(note=self.note, title='First')
+        first.image.save('cat.txt', ContentFile('meow'))
+        content_hash = os.path.splitext(os.path.basename(first.image.name))[0]
+
+        bundle = resource.obj_create(Bundle(data={'title': 'Second', 'image': {'hash': content_hash, 'name': 'kitten.txt'}}), note=self.note)
+        second = MediaBit.objects.get(pk=bundle.obj.pk)
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.image.read(), 'meow')
+        self.assertEqual(self.model_field.storage.references(first.image.name), 2)
+
+        # Unknown content has to be uploaded.
+        self.assertRaises(BadRequest, resource.obj_create, Bundle(data={'title': 'Third', 'image': {'hash': '0' * 64}}), note=self.note)
+
+        # Only the requester's own uploads can be referenced.
+        request = HttpRequest()
+        request.user = User.objects.create_user('storage', 'storage@example.com')
+        self.assertRaises(BadRequest, resource.fields['image'].hydrate_hash, content_hash, 'cat.txt', request)
+        
+        content = ContentFile('meow')
+        content.uploaded_by = 'user:%s' % request.user.pk
+        self.model_field.storage.save('cat.txt', content)
+        self.assertEqual(resource.fields['image'].hydrate_hash(content_hash, 'cat.txt', request).name, first.image.name)
+        
+        # Plain storage doesn't know about hashes.
+        self.model_field.storage = self.old_storage
+        self.assertRaises(ApiFieldError, resource.fields['image'].hydrate_hash, content_hash)
+
+    def test_release(self):
+        storage = self.model_field.storage
+        first = MediaBit.objects.create(note=self.note, title='First')
+        first.image.save('cat.txt', ContentFile('meow'))
+        name = first.image.name
+        second = MediaBit.objects.create(note=self.note, title='Second')
+        second.image.save('kitten.txt', ContentFile('meow'))
+        self.assertEqual(storage.references(name), 2)
+
+        # Saving without a new file keeps the reference.
+        first.title = 'Renamed'
+        first.save()
+        self.assertEqual(storage.references(name), 2)
+
+        # Deleting an object releases its reference.
+        first.delete()
+        self.assertEqual(storage.references(name), 1)
+
+        # As does giving it another file.
+        second.image.save('dog.txt', ContentFile('woof'))
+        self.assertFalse(storage.exists(name))
+        other = second.image.name
+
+        # Deleting a whole queryset releases each reference.
+        MediaBit.objects.filter(pk=second.pk).delete()
+        self.assertFalse(storage.exists(other))
@@ -1,8 +1,13 @@
+import os
+import shutil
+import tempfile
+import threading
 import time
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from tastypie.models import ApiAccess
-from tastypie.throttle import BaseThrottle, CacheThrottle, CacheDBThrottle
+from tastypie.throttle import BaseThrottle, CacheThrottle, CacheDBThrottle, SlidingWindowThrottle, LeasedCacheThrottle, SharedMemoryThrottle, BufferedApiAccessLogger
 
 
 class NoThrottleTestCase(TestCase):
@@ -73,6 +78,252 @@ class CacheThrottleTestCase(TestCase):
         time.sleep(3)
         self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
         self.assertEqual(len(cache.get('daniel_accesses')), 0)
+    
+    def test_cost(self):
+        throttle_1 = CacheThrottle(throttle_at=5, timeframe=5, expiration=2)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=3), False)
+        throttle_1.accessed('daniel', cost=3)
+        self.assertEqual(len(cache.get('daniel_accesses')), 3)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=3), True)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=2), False)
+
+
+class SlidingWindowThrottleTestCase(TestCase):
+    def setUp(self):
+        self.old_time = time.time
+        self.now = 1000.0
+        time.time = lambda: self.now
+    
+    def tearDown(self):
+        time.time = self.old_time
+        
+        for bucket in (9, 10, 11, 12):
+            cache.delete('daniel_accesses_%d' % bucket)
+            cache.delete('cody_accesses_%d' % bucket)
+    
+    def test_throttling(self):
+        throttle_1 = SlidingWindowThrottle(throttle_at=2, timeframe=100)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 1)
+        self.assertEqual(throttle_1.accessed('daniel'), None)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 2)
+        
+        # THROTTLE'D! Without the rejected request counting.
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(cache.get('daniel_accesses_10'), 2)
+        
+        # Should be no interplay.
+        self.assertEqual(throttle_1.should_be_throttled('cody'), False)
+        
+        # Early in the next bucket, most of the previous one still counts.
+        self.now = 1110.0
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(cache.get('daniel_accesses_11'), 0)
+        
+        # Halfway, there's room for one more.
+        self.now = 1150.0
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        
+        # The previous bucket is remembered rather than fetched again.
+        cache.set('daniel_accesses_10', 100)
+        self.assertEqual(throttle_1.previous_count('daniel_accesses', 11), 2)
+        
+        # Once it's entirely out of the window, it's forgotten.
+        self.now = 1250.0
+        self.assertEqual(throttle_1.previous_count('daniel_accesses', 12), 1)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+    
+    def test_cost(self):
+        throttle_1 = SlidingWindowThrottle(throttle_at=5, timeframe=100)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=3), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 3)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=3), True)
+        self.assertEqual(cache.get('daniel_accesses_10'), 3)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=2), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 5)
+
+
+class LeasedCacheThrottleTestCase(TestCase):
+    def setUp(self):
+        self.old_time = time.time
+        self.now = 1000.0
+        time.time = lambda: self.now
+    
+    def tearDown(self):
+        time.time = self.old_time
+        
+        for window in (10, 11):
+            cache.delete('daniel_accesses_%d' % window)
+    
+    def test_throttling(self):
+        # Two processes, sharing the cache.
+        throttle_1 = LeasedCacheThrottle(throttle_at=7, timeframe=100, lease_size=3)
+        throttle_2 = LeasedCacheThrottle(throttle_at=7, timeframe=100, lease_size=3)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 3)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 3)
+        
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 6)
+        
+        # Only one token is left to lease.
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 9)
+        
+        # THROTTLE'D! Without asking the cache again.
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(cache.get('daniel_accesses_10'), 9)
+        
+        # The other process spends what it leased.
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), True)
+        
+        # Test the timeframe.
+        self.now = 1100.0
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(cache.get('daniel_accesses_11'), 3)
+        
+        # Leases are capped at the limit.
+        self.assertEqual(LeasedCacheThrottle(throttle_at=2, lease_size=10).lease_size, 2)
+    
+    def test_cost(self):
+        throttle_1 = LeasedCacheThrottle(throttle_at=10, timeframe=100, lease_size=2)
+        
+        # Costly requests lease all they need at once.
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=5), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 5)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=4), False)
+        self.assertEqual(cache.get('daniel_accesses_10'), 9)
+        
+        # Only one token was left to lease, which is kept.
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=2), True)
+        self.assertEqual(cache.get('daniel_accesses_10'), 11)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(cache.get('daniel_accesses_10'), 11)
+
+
+class SharedMemoryThrottleTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'throttle.mmap')
+        self.old_time = time.time
+        self.now = 1000.0
+        time.time = lambda: self.now
+    
+    def tearDown(self):
+        time.time = self.old_time
+        shutil.rmtree(self.directory)
+    
+    def test_throttling(self):
+        throttle_1 = SharedMemoryThrottle(throttle_at=2, timeframe=100, path=self.path, slots=16, ways=4)
+        # Another process, sharing the same file.
+        throttle_2 = SharedMemoryThrottle(throttle_at=2, timeframe=100, path=self.path, slots=16, ways=4)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.assertEqual(os.path.getsize(self.path), 64 + 16 * 32)
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        
+        # THROTTLE'D!
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), True)
+        
+        # Should be no interplay.
+        self.assertEqual(throttle_1.should_be_throttled('cody'), False)
+        
+        # Halfway through the next window, there's room for one more.
+        self.now = 1150.0
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        
+        # Test the timeframe.
+        self.now = 1300.0
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        
+        throttle_1.close()
+        throttle_2.close()
+    
+    def test_cost(self):
+        throttle_1 = SharedMemoryThrottle(throttle_at=5, timeframe=100, path=self.path, slots=16)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=3), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=3), True)
+        self.assertEqual(throttle_1.should_be_throttled('daniel', cost=2), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        throttle_1.close()
+    
+    def test_eviction(self):
+        throttle_1 = SharedMemoryThrottle(throttle_at=1, timeframe=100, path=self.path, slots=2, ways=2)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        self.now += 1
+        self.assertEqual(throttle_1.should_be_throttled('cody'), False)
+        self.now += 1
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        
+        # The table is full, so the least recently used (cody) goes.
+        self.now += 1
+        self.assertEqual(throttle_1.should_be_throttled('joe'), False)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        self.assertEqual(throttle_1.should_be_throttled('cody'), False)
+        
+        # A differently laid out table is never wiped, in use or not.
+        throttle_2 = SharedMemoryThrottle(throttle_at=1, timeframe=100, path=self.path, slots=4, ways=2)
+        self.assertRaises(ImproperlyConfigured, throttle_2.should_be_throttled, 'daniel')
+        throttle_1.close()
+        self.assertRaises(ImproperlyConfigured, throttle_2.should_be_throttled, 'daniel')
+        self.assertEqual(os.path.getsize(self.path), 64 + 2 * 32)
+        
+        # Unless the layout is part of the (default) name.
+        self.assertTrue(SharedMemoryThrottle(slots=4, ways=2).path.endswith('tastypie-throttle-4-2.mmap'))
+    
+    def test_shared_table(self):
+        throttle_1 = SharedMemoryThrottle(throttle_at=2, timeframe=100, path=self.path, slots=16)
+        throttle_2 = SharedMemoryThrottle(throttle_at=2, timeframe=100, path=os.path.join(self.directory, '.', 'throttle.mmap'), slots=16)
+        
+        # Throttles in the same process share a descriptor (& so the locks).
+        self.assertTrue(throttle_1.open() is throttle_2.open())
+        
+        # Which stays open for as long as one of them uses it.
+        throttle_1.close()
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), False)
+        self.assertEqual(throttle_2.should_be_throttled('daniel'), True)
+        throttle_2.close()
+        
+        throttle_1 = SharedMemoryThrottle(throttle_at=2, timeframe=100, path=self.path, slots=16)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        throttle_1.close()
+    
+    def test_processes(self):
+        throttle_1 = SharedMemoryThrottle(throttle_at=10, timeframe=100, path=self.path, slots=16)
+        throttle_1.should_be_throttled('daniel')
+        pid = os.fork()
+        
+        if pid == 0:
+            try:
+                for i in range(5):
+                    throttle_1.should_be_throttled('daniel')
+            finally:
+                os._exit(0)
+        
+        os.waitpid(pid, 0)
+        
+        for i in range(4):
+            self.assertEqual(throttle_1.should_be_throttled('daniel'), False)
+        
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        throttle_1.close()
 
 
 class CacheDBThrottleTestCase(TestCase):
@@ -129,3 +380,95 @@ class CacheDBThrottleTestCase(TestCase):
         self.assertEqual(len(cache.get('daniel_accesses')), 0)
         self.assertEqual(ApiAccess.objects.count(), 7)
         self.assertEqual(ApiAccess.objects.filter(identifier='daniel').count(), 4)
+
+
+class FailingAccessLogger(BufferedApiAccessLogger):
+    def write(self, records):
+        raise IOError("The database is gone.")
+
+
+class RecordingAccessLogger(BufferedApiAccessLogger):
+    def __init__(self, *args, **kwargs):
+        super(RecordingAccessLogger, self).__init__(*args, **kwargs)
+        self.written = []
+        self.event = threading.Event()
+    
+    def write(self, records):
+        self.written.append(records)
+        self.event.set()
+
+
+class BufferedApiAccessLoggerTestCase(TestCase):
+    def tearDown(self):
+        cache.delete('daniel_accesses')
+    
+    def test_batches(self):
+        logger = BufferedApiAccessLogger(batch_size=3, flush_interval=None)
+        throttle_1 = CacheDBThrottle(throttle_at=2, timeframe=5, access_logger=logger)
+        
+        throttle_1.accessed('daniel', url='/api/v1/notes/', request_method='get')
+        throttle_1.accessed('daniel', url='/api/v1/notes/1/', request_method='put')
+        self.assertEqual(ApiAccess.objects.count(), 0)
+        self.assertEqual(len(cache.get('daniel_accesses')), 2)
+        self.assertEqual(throttle_1.should_be_throttled('daniel'), True)
+        
+        # A full batch is written at once.
+        throttle_1.accessed('daniel', url='/api/v1/notes/2/', request_method='delete')
+        self.assertEqual(ApiAccess.objects.count(), 3)
+        self.assertEqual([access.url for access in ApiAccess.objects.order_by('id')], [u'/api/v1/notes/', u'/api/v1/notes/1/', u'/api/v1/notes/2/'])
+        self.assertEqual(ApiAccess.objects.filter(request_method='put').count(), 1)
+        self.assertTrue(ApiAccess.objects.all()[0].accessed > 0)
+        
+        throttle_1.accessed('daniel')
+        self.assertEqual(ApiAccess.objects.count(), 3)
+        logger.close()
+        self.assertEqual(ApiAccess.objects.count(), 4)
+        
+        # Bigger batches are split into several statements.
+        logger = BufferedApiAccessLogger(batch_size=1000, flush_interval=None)
+        logger.max_rows_per_insert = 7
+        
+        for i in range(20):
+            logger.log('cody', url='/api/v1/notes/%d/' % i)
+        
+        logger.flush()
+        self.assertEqual(ApiAccess.objects.filter(identifier='cody').count(), 20)
+    
+    def test_drop(self):
+        logger = FailingAccessLogger(batch_size=10, flush_interval=None, max_queued=3)
+        
+        for i in range(5):
+            logger.log('daniel', accessed=i)
+        
+        self.assertEqual(logger.dropped, 2)
+        self.assertEqual([record[3] for record in logger._queue], [0, 1, 2])
+        
+        # Failed writes are kept for later.
+        self.assertRaises(IOError, logger.flush)
+        self.assertEqual(len(logger._queue), 3)
+        logger._queue.clear()
+        
+        logger = FailingAccessLogger(batch_size=10, flush_interval=None, max_queued=3, drop_oldest=True)
+        
+        for i in range(5):
+            logger.log('daniel', accessed=i)
+        
+        self.assertEqual(logger.dropped, 2)
+        self.assertEqual([record[3] for record in logger._queue], [2, 3, 4])
+        logger._queue.clear()
+    
+    def test_background_thread(self):
+        logger = RecordingAccessLogger(batch_size=2, flush_interval=60)
+        logger.log('daniel', accessed=1)
+        self.assertTrue(logger._thread.isAlive())
+        self.assertEqual(logger.written, [])
+        
+        # A full batch wakes the thread up.
+        logger.log('daniel', accessed=2)
+        logger.event.wait(5)
+        self.assertEqual(logger.written, [[('daniel', '', '', 1), ('daniel', '', '', 2)]])
+        
+        logger.log('daniel', accessed=3)
+        logger.close()
+        self.assertFalse(logger._thread.isAlive())
+        self.assertEqual(logger.written[-1], [('daniel', '', '', 3)])
@@ -0,0 +1,242 @@
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+from django.conf.urls.defaults import *
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.handlers.wsgi import WSGIRequest
+from django.test import TestCase
+from django.utils import simplejson as json
+from tastypie.api import Api
+from tastypie.authorization import Authorization
+from tastypie.bundle import Bundle
+from tastypie.exceptions import BadRequest, NotFound, RequestEntityTooLarge
+from tastypie.fields import AttachmentFileField
+from tastypie.resources import ModelResource
+from tastypie.uploads import FileUploadStore, parse_content_range
+from core.models import MediaBit, Note
+
+
+class UploadMediaBitResource(ModelResource):
+    image = AttachmentFileField(attribute='image', null=True)
+
+    class Meta:
+        resource_name = 'mediabits'
+        queryset = MediaBit.objects.all()
+        authorization = Authorization()
+        upload_store = FileUploadStore(max_size=1024)
+
+
+api = Api(api_name='v1')
+api.register(UploadMediaBitResource())
+
+urlpatterns = patterns('',
+    (r'^api/', include(api.urls)),
+)
+
+
+def build_request(method, content='', **meta):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': '/api/v1/mediabits/uploads/',
+        'QUERY_STRING': 'format=json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': StringIO(content),
+    }
+    environ.update(meta)
+    return WSGIRequest(environ)
+
+
+class ParseContentRangeTestCase(TestCase):
+    def test_parse_content_range(self):
+        self.assertEqual(parse_content_range('bytes 0-499/1234'), (0, 499, 1234))
+        self.assertEqual(parse_content_range('bytes 500-999/*'), (500, 999, None))
+        self.assertRaises(BadRequest, parse_content_range, None)
+        self.assertRaises(BadRequest, parse_content_range, 'bytes 10-5/20')
+        self.assertRaises(BadRequest, parse_content_range, 'bytes 0-20/20')
+        self.assertRaises(BadRequest, parse_content_range, 'items 0-5/20')
+
+
+class FileUploadStoreTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileUploadStore(directory=self.directory, max_size=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_upload(self):
+        session = self.store.create(filename='hello.txt', size=10, owner='me')
+        self.assertEqual(session.offset, 0)
+        self.assertFalse(session.complete)
+        self.assertRaises(NotFound, self.store.get, session.id, owner='someone else')
+        self.assertRaises(NotFound, self.store.get, '../../etc/passwd', owner='me')
+
+        session = self.store.write(session, 0, StringIO('hello'), 5)
+        self.assertEqual(session.offset, 5)
+        # Out of order ranges are ignored.
+        session = self.store.write(session, 2, StringIO('xxxxx'), 5)
+        self.assertEqual(session.offset, 5)
+        # A short body keeps whatever arrived.
+        session = self.store.write(session, 5, StringIO('wor'), 5)
+        self.assertEqual(session.offset, 8)
+        self.assertRaises(BadRequest, self.store.write, session, 8, StringIO('ld!!'), 4)
+
+        session = self.store.get(session.id, owner='me')
+        session = self.store.write(session, 8, StringIO('ld'), 2)
+        self.assertTrue(session.complete)
+        self.assertEqual(self.store.open(session).read(), 'helloworld')
+        self.assertEqual(self.store.open(session).name, 'hello.txt')
+
+        self.store.delete(session)
+        self.assertRaises(NotFound, self.store.get, session.id, owner='me')
+
+    def test_limits(self):
+        self.assertRaises(RequestEntityTooLarge, self.store.create, size=11)
+        session = self.store.create(owner='me')
+        self.assertRaises(RequestEntityTooLarge, self.store.write, session, 0, StringIO('x' * 11), 11)
+
+        self.store.expires = -1
+        self.assertRaises(NotFound, self.store.get, session.id, owner='me')
+        self.store.cleanup()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_expiry(self):
+        session = self.store.create(size=10, owner='me')
+        old = time.time() - 2 * self.store.expires
+        os.utime(self.store.path(session.id, 'json'), (old, old))
+        os.utime(self.store.path(session.id, 'part'), (old, old))
+        self.assertRaises(NotFound, self.store.get, session.id, owner='me')
+
+        # Expiry counts from the last chunk, not from the start.
+        self.store.write(session, 0, StringIO('hello'), 5)
+        self.assertEqual(self.store.get(session.id, owner='me').offset, 5)
+        self.store.cleanup()
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+class ResumableUploadTestCase(TestCase):
+    urls = 'core.tests.uploads'
+
+    def setUp(self):
+        self.resource = api.canonical_resource_for('mediabits')
+        self.store = self.resource._meta.upload_store
+        self.directory = tempfile.mkdtemp()
+        self.store._directory = self.directory
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_upload(self):
+        resp = self.resource.dispatch_upload(build_request('POST', '{"filename": "cat.txt", "size": 10}'))
+        self.assertEqual(resp.status_code, 201)
+        data = json.loads(resp.content)
+        upload_id = data['id']
+        self.assertEqual(resp['Location'], '/api/v1/mediabits/uploads/%s/' % upload_id)
+        self.assertEqual(data['offset'], 0)
+        self.assertEqual(data['size'], 10)
+
+        resp = self.resource.dispatch_upload(build_request('PUT', 'meow ', HTTP_CONTENT_RANGE='bytes 0-4/10'), upload_id=upload_id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content)['offset'], 5)
+        self.assertEqual(resp['Range'], 'bytes=0-4')
+
+        # A retried range that has already been received.
+        resp = self.resource.dispatch_upload(build_request('PUT', 'meow ', HTTP_CONTENT_RANGE='bytes 0-4/10'), upload_id=upload_id)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(json.loads(resp.content)['offset'], 5)
+
+        resp = self.resource.dispatch_upload(build_request('GET'), upload_id=upload_id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(json.loads(resp.content)['complete'])
+
+        # Uploads belong to whoever started them.
+        self.assertRaises(NotFound, self.resource.dispatch_upload, build_request('GET', REMOTE_ADDR='10.0.0.1'), upload_id=upload_id)
+
+        field = self.resource.fields['image']
+        bundle = Bundle(data={'image': {'upload': upload_id}})
+        self.assertRaises(BadRequest, field.hydrate, bundle, build_request('GET'))
+
+        resp = self.resource.dispatch_upload(build_request('PUT', 'meow!', HTTP_CONTENT_RANGE='bytes 5-9/10'), upload_id=upload_id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(json.loads(resp.content)['complete'])
+
+        uploaded = field.hydrate(bundle, build_request('GET'))
+        self.assertEqual(uploaded.name, 'cat.txt')
+        self.assertEqual(uploaded.read(), 'meow meow!')
+
+        resp = self.resource.dispatch_upload(build_request('DELETE'), upload_id=upload_id)
+        self.assertEqual(resp.status_code, 204)
+        self.assertRaises(NotFound, self.resource.dispatch_upload, build_request('GET'), upload_id=upload_id)
+
+    def test_bad_details(self):
+        self.assertRaises(BadRequest, self.resource.dispatch_upload, build_request('POST', '["cat.txt", 10]'))
+        self.assertRaises(BadRequest, self.resource.dispatch_upload, build_request('POST', '10'))
+
+    def test_owner(self):
+        request = build_request('POST', '{"size": 4}')
+        request.user = User.objects.create_user('uploader', 'uploader@example.com', 'secret')
+        upload_id = json.loads(self.resource.dispatch_upload(request).content)['id']
+
+        # Users can resume from another address.
+        request = build_request('PUT', 'meow', HTTP_CONTENT_RANGE='bytes 0-3/4', REMOTE_ADDR='10.0.0.1')
+        request.user = User.objects.get(username='uploader')
+        self.assertEqual(self.resource.dispatch_upload(request, upload_id=upload_id).status_code, 200)
+
+        # Without them, it's down to the address.
+        self.assertRaises(NotFound, self.resource.dispatch_upload, build_request('GET'), upload_id=upload_id)
+
+    def test_consumed(self):
+        upload_id = json.loads(self.resource.dispatch_upload(build_request('POST', '{"filename": "cat.txt", "size": 4}')).content)['id']
+        self.resource.dispatch_upload(build_request('PUT', 'meow', HTTP_CONTENT_RANGE='bytes 0-3/4'), upload_id=upload_id)
+        note = Note.objects.create(title='Uploads', slug='uploads')
+
+        bundle = self.resource.obj_create(Bundle(data={'title': 'Cat', 'image': {'upload': upload_id}}), request=build_request('POST'), note=note)
+        self.assertEqual(MediaBit.objects.get(pk=bundle.obj.pk).image.read(), 'meow')
+        bundle.obj.image.delete(save=False)
+
+        # Once saved, the upload is gone.
+        self.assertEqual(bundle.uploads, [])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertRaises(NotFound, self.resource.dispatch_upload, build_request('GET'), upload_id=upload_id)
+
+    def test_deferred_discard(self):
+        upload_id = json.loads(self.resource.dispatch_upload(build_request('POST', '{"filename": "cat.txt", "size": 4}')).content)['id']
+        self.resource.dispatch_upload(build_request('PUT', 'meow', HTTP_CONTENT_RANGE='bytes 0-3/4'), upload_id=upload_id)
+        note = Note.objects.create(title='Uploads', slug='uploads')
+        opened = []
+        store_open = self.resource._meta.upload_store.open
+        self.resource._meta.upload_store.open = lambda session: opened.append(store_open(session)) or opened[-1]
+
+        try:
+            # Held back (as in a ``put_list`` transaction), the upload outlives
+            # the save, though its file is closed...
+            request = build_request('POST')
+            self.resource.defer_upload_discards(request)
+            bundle = self.resource.obj_create(Bundle(data={'title': 'Cat', 'image': {'upload': upload_id}}), request=request, note=note)
+            bundle.obj.image.delete(save=False)
+            self.assertEqual(bundle.uploads, [])
+            self.assertEqual(len(opened), 1)
+            self.assertTrue(opened[0].closed)
+            self.assertEqual(request._tastypie_deferred_uploads[0].id, upload_id)
+
+            # ...& is kept after a rollback, so it can be retried...
+            self.resource.end_upload_discards(request, discard=False)
+            self.assertFalse(hasattr(request, '_tastypie_deferred_uploads'))
+            self.assertEqual(self.resource.dispatch_upload(build_request('GET'), upload_id=upload_id).status_code, 200)
+
+            # ...but discarded after a commit.
+            request = build_request('POST')
+            self.resource.defer_upload_discards(request)
+            bundle = self.resource.obj_create(Bundle(data={'title': 'Cat', 'image': {'upload': upload_id}}), request=request, note=note)
+            bundle.obj.image.delete(save=False)
+            self.assertEqual(self.resource.dispatch_upload(build_request('GET'), upload_id=upload_id).status_code, 200)
+            self.resource.end_upload_discards(request)
+            self.assertEqual(os.listdir(self.directory), [])
+            self.assertRaises(NotFound, self.resource.dispatch_upload, build_request('GET'), upload_id=upload_id)
+        finally:
+            del self.resource._meta.upload_store.open
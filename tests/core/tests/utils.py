@@ -1,6 +1,14 @@
-from django.http import HttpRequest
+import gzip
+import zlib
+from StringIO import StringIO
+from django.http import HttpRequest, HttpResponse
 from django.test import TestCase
 from tastypie.serializers import Serializer
+from tastypie.utils import LRUCache
+from tastypie.utils.bloom import BloomFilter
+from tastypie.exceptions import BadRequest, UnsupportedEncoding, RequestEntityTooLarge
+from tastypie.utils.jsonstream import JSONArrayReader
+from tastypie.utils.compression import parse_accept_encoding, determine_encoding, compress_string, compress_sequence, compress_response, DecompressingStream
 from tastypie.utils.mime import determine_format, build_content_type
 
 
@@ -69,3 +77,243 @@ class MimeTestCase(TestCase):
         
         request.META = {'HTTP_ACCEPT': 'text/javascript,application/json'}
         self.assertEqual(determine_format(request, serializer), 'application/json')
+    
+    def test_determine_format_memoized(self):
+        serializer = Serializer()
+        request = HttpRequest()
+        request.META = {'HTTP_ACCEPT': 'application/xml'}
+        
+        self.assertEqual(determine_format(request, serializer), 'application/xml')
+        self.assertEqual(request._tastypie_formats.values(), ['application/xml'])
+        self.assertEqual(serializer.negotiation_cache.keys(), ['application/xml'])
+        
+        # Served from the request memo, even if the serializer forgot.
+        serializer.negotiation_cache.clear()
+        self.assertEqual(determine_format(request, serializer), 'application/xml')
+        self.assertEqual(len(serializer.negotiation_cache), 0)
+        
+        # Changing the inputs re-negotiates.
+        request.META = {'HTTP_ACCEPT': 'text/yaml'}
+        self.assertEqual(determine_format(request, serializer), 'text/yaml')
+        self.assertEqual(determine_format(request, serializer, default_format='application/xml'), 'text/yaml')
+        request.GET = {'format': 'json'}
+        self.assertEqual(determine_format(request, serializer), 'application/json')
+        self.assertEqual(len(request._tastypie_formats), 4)
+
+
+class BloomFilterTestCase(TestCase):
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        
+        for i in xrange(1000):
+            bloom.add('key-%d' % i)
+        
+        self.assertEqual(len(bloom), 1000)
+        
+        # No false negatives...
+        for i in xrange(1000):
+            self.assertTrue('key-%d' % i in bloom)
+        
+        # ...and few false positives.
+        false_positives = len([i for i in xrange(10000) if 'other-%d' % i in bloom])
+        self.assertTrue(false_positives < 300)
+        
+        self.assertTrue(u'cl\xe9' not in bloom)
+        bloom.add(u'cl\xe9')
+        self.assertTrue(u'cl\xe9' in bloom)
+
+
+class LRUCacheTestCase(TestCase):
+    def test_get_set(self):
+        cache = LRUCache(max_size=2)
+        self.assertEqual(len(cache), 0)
+        self.assertRaises(KeyError, lambda: cache['foo'])
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.get('foo', 'default'), 'default')
+        
+        cache['foo'] = 1
+        cache['bar'] = 2
+        self.assertEqual(cache['foo'], 1)
+        self.assertEqual(cache.keys(), ['foo', 'bar'])
+        self.assertTrue('bar' in cache)
+        
+        # Evicts the least recently used.
+        cache['baz'] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('bar' in cache)
+        self.assertEqual(cache.keys(), ['baz', 'foo'])
+        
+        # Overwriting refreshes.
+        cache['foo'] = 4
+        cache['moof'] = 5
+        self.assertEqual(cache.keys(), ['moof', 'foo'])
+        self.assertEqual(cache['foo'], 4)
+    
+    def test_delete(self):
+        cache = LRUCache()
+        cache['foo'] = 1
+        cache['bar'] = 2
+        del(cache['foo'])
+        self.assertRaises(KeyError, cache.__delitem__, 'foo')
+        self.assertEqual(cache.pop('bar'), 2)
+        self.assertEqual(cache.pop('bar', 'gone'), 'gone')
+        self.assertEqual(cache.keys(), [])
+        
+        cache['foo'] = 1
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.keys(), [])
+
+
+class CompressionTestCase(TestCase):
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding(''), {})
+        self.assertEqual(parse_accept_encoding('gzip'), {'gzip': 1.0})
+        self.assertEqual(parse_accept_encoding('gzip, deflate'), {'gzip': 1.0, 'deflate': 1.0})
+        self.assertEqual(parse_accept_encoding('GZIP;q=0.5, identity; q=1, *;q=0'), {'gzip': 0.5, 'identity': 1.0, '*': 0.0})
+        self.assertEqual(parse_accept_encoding('gzip;q=abc'), {'gzip': 1.0})
+    
+    def test_determine_encoding(self):
+        request = HttpRequest()
+        self.assertEqual(determine_encoding(request), None)
+        
+        request.META = {'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}
+        self.assertEqual(determine_encoding(request), 'gzip')
+        self.assertEqual(determine_encoding(request, ('deflate', 'gzip')), 'deflate')
+        
+        request.META = {'HTTP_ACCEPT_ENCODING': 'gzip;q=0.5, deflate'}
+        self.assertEqual(determine_encoding(request), 'deflate')
+        
+        request.META = {'HTTP_ACCEPT_ENCODING': 'gzip;q=0, deflate;q=0'}
+        self.assertEqual(determine_encoding(request), None)
+        
+        request.META = {'HTTP_ACCEPT_ENCODING': '*'}
+        self.assertEqual(determine_encoding(request), 'gzip')
+        
+        request.META = {'HTTP_ACCEPT_ENCODING': 'br'}
+        self.assertEqual(determine_encoding(request), None)
+    
+    def test_compress_string(self):
+        content = '{"hello": "world"}' * 100
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compress_string(content, 'gzip'))).read(), content)
+        self.assertEqual(zlib.decompress(compress_string(content, 'deflate')), content)
+    
+    def test_compress_sequence(self):
+        chunks = ['{"objects": [', '{"a": 1}, ' * 50, u'{"a": 2}', ']}']
+        compressed = ''.join(compress_sequence(iter(chunks), 'gzip'))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed)).read(), ''.join(chunks))
+    
+    def test_compress_response(self):
+        request = HttpRequest()
+        request.META = {'HTTP_ACCEPT_ENCODING': 'gzip'}
+        content = '{"hello": "world"}' * 100
+        
+        # Too short to bother, but still varies.
+        resp = compress_response(request, HttpResponse('{"hello": "world"}'), min_length=100)
+        self.assertEqual(resp.content, '{"hello": "world"}')
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+        
+        resp = compress_response(request, HttpResponse(content), min_length=100)
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp['Content-Length'], str(len(resp.content)))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(resp.content)).read(), content)
+        
+        # Disabled.
+        resp = compress_response(request, HttpResponse(content), encodings=(), min_length=100)
+        self.assertEqual(resp.content, content)
+        self.assertFalse(resp.has_header('Vary'))
+        
+        # Client doesn't accept it.
+        request.META = {}
+        resp = compress_response(request, HttpResponse(content), min_length=100)
+        self.assertEqual(resp.content, content)
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+        
+        # Already encoded.
+        request.META = {'HTTP_ACCEPT_ENCODING': 'deflate'}
+        resp = HttpResponse(content)
+        resp['Content-Encoding'] = 'identity'
+        resp = compress_response(request, resp, min_length=100)
+        self.assertEqual(resp.content, content)
+        
+        # Streaming.
+        resp = compress_response(request, HttpResponse(iter([content, content])), min_length=100)
+        self.assertEqual(resp['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(''.join(resp)), content * 2)
+    
+    def test_decompressing_stream(self):
+        content = '{"objects": [%s]}' % ', '.join(['{"id": %d}' % i for i in range(1000)])
+        
+        for encoding in ('gzip', 'deflate'):
+            stream = DecompressingStream(StringIO(compress_string(content, encoding)), encoding, chunk_size=128)
+            self.assertEqual(stream.read(10), content[:10])
+            self.assertEqual(stream.read(), content[10:])
+            self.assertEqual(stream.read(), '')
+        
+        # Raw deflate (no zlib header), as some clients send.
+        raw = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        stream = DecompressingStream(StringIO(raw.compress(content) + raw.flush()), 'Deflate')
+        self.assertEqual(stream.read(), content)
+        
+        lines = 'first\nsecond\n\nlast'
+        stream = DecompressingStream(StringIO(compress_string(lines)), 'gzip', chunk_size=4)
+        self.assertEqual(stream.readline(), 'first\n')
+        self.assertEqual(list(stream), ['second\n', '\n', 'last'])
+        
+        self.assertRaises(UnsupportedEncoding, DecompressingStream, StringIO(''), 'compress')
+        self.assertRaises(BadRequest, DecompressingStream(StringIO('not gzipped'), 'gzip').read)
+    
+    def test_decompressing_stream_max_length(self):
+        bomb = compress_string('\0' * 1024 * 1024)
+        stream = DecompressingStream(StringIO(bomb), 'gzip', max_length=1024 * 1024)
+        self.assertEqual(len(stream.read()), 1024 * 1024)
+        
+        stream = DecompressingStream(StringIO(bomb), 'gzip', max_length=64 * 1024, chunk_size=1024)
+        self.assertRaises(RequestEntityTooLarge, stream.read)
+        # Bounded by the chunk size, not the whole payload.
+        self.assertTrue(stream.inflated <= 65 * 1024)
+
+
+
+class JSONArrayReaderTestCase(TestCase):
+    def test_read(self):
+        content = '{"meta": {"note": "a [tricky] \\"string\\" {"}, "objects": [{"a": [1, 2, {"b": "]"}]}, "two", 3, null, true, [], {"c": "\\\\"}], "after": 1}'
+        expected = [{'a': [1, 2, {'b': ']'}]}, 'two', 3, None, True, [], {'c': '\\'}]
+        
+        # Small chunk sizes exercise resuming mid-value.
+        for chunk_size in (1, 2, 3, 7, 64 * 1024):
+            reader = JSONArrayReader(StringIO(content), chunk_size=chunk_size)
+            self.assertEqual(list(reader), expected)
+        
+        reader = JSONArrayReader(StringIO(' [ 1 , "2" ] '), key=None, chunk_size=2)
+        self.assertEqual(list(reader), [1, u'2'])
+        
+        reader = JSONArrayReader(StringIO('{"objects": []}'))
+        self.assertEqual(list(reader), [])
+    
+    def test_incremental(self):
+        stream = StringIO('{"objects": [{"id": 1}, {"id": 2}, {"id": 3}]}')
+        reader = JSONArrayReader(stream, chunk_size=4)
+        reader.open()
+        objects = iter(reader)
+        self.assertEqual(objects.next(), {'id': 1})
+        # Only what's needed for the first object has been read.
+        self.assertTrue(stream.tell() < 30)
+        self.assertTrue(len(reader.buffer) < 16)
+        self.assertEqual(list(objects), [{'id': 2}, {'id': 3}])
+    
+    def test_errors(self):
+        self.assertRaises(BadRequest, JSONArrayReader(StringIO('{"meta": {}}')).open)
+        self.assertRaises(BadRequest, JSONArrayReader(StringIO('{"objects": {}}')).open)
+        self.assertRaises(BadRequest, JSONArrayReader(StringIO('[1, 2]')).open)
+        self.assertRaises(BadRequest, JSONArrayReader(StringIO('')).open)
+        
+        reader = JSONArrayReader(StringIO('{"objects": [{"id": 1}, {"id": 2'))
+        objects = iter(reader)
+        self.assertEqual(objects.next(), {'id': 1})
+        self.assertRaises(BadRequest, objects.next)
+        
+        self.assertRaises(BadRequest, list, JSONArrayReader(StringIO('{"objects": [1 2]}')))
+        self.assertRaises(BadRequest, list, JSONArrayReader(StringIO('{"objects": [nope]}')))
@@ -14,9 +14,10 @@ class NamespacedViewsTestCase(TestCase):
     def test_urls(self):
         from namespaced.api.urls import api
         patterns = api.urls
-        self.assertEqual(len(patterns), 3)
-        self.assertEqual(sorted([pattern.name for pattern in patterns if hasattr(pattern, 'name')]), ['api_v1_top_level'])
-        self.assertEqual([[pattern.name for pattern in include.url_patterns if hasattr(pattern, 'name')] for include in patterns if hasattr(include, 'reverse_dict')], [['api_dispatch_list', 'api_get_schema', 'api_get_multiple', 'api_dispatch_detail'], ['api_dispatch_list', 'api_get_schema', 'api_get_multiple', 'api_dispatch_detail']])
+        self.assertEqual(len(patterns), 4)
+        self.assertEqual(sorted([pattern.name for pattern in patterns if hasattr(pattern, 'name')]), ['api_v1_schema', 'api_v1_top_level'])
+        # Each resource nests its URLs under its ``resource_name``.
+        self.assertEqual([[pattern.name for pattern in resource.url_patterns if hasattr(pattern, 'name')] for include in patterns if hasattr(include, 'reverse_dict') for resource in include.url_patterns], [['api_dispatch_list', 'api_get_schema', 'api_dispatch_detail', 'api_get_multiple'], ['api_dispatch_list', 'api_get_schema', 'api_dispatch_detail', 'api_get_multiple']])
         
         self.assertRaises(NoReverseMatch, reverse, 'api_v1_top_level')
         self.assertRaises(NoReverseMatch, reverse, 'special:api_v1_top_level')